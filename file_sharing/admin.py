@@ -1,21 +1,22 @@
 from django.contrib import admin
 from django.contrib import messages
 from django.shortcuts import redirect
-from django.urls import path
-from django.http import HttpResponseRedirect, HttpResponse, FileResponse
+from django.urls import path, reverse
+from django.http import HttpResponseRedirect, HttpResponse
 from django.utils.html import format_html
-from django.core.files.base import ContentFile
-from django.db import models
-import os
-from .models import FileUpload
-from django.db.models import Sum
+from django.db import models, transaction
+from django.db.models import Q
+from django.core.files.storage import default_storage
+import re
+from .models import FileUpload, Job
+from . import blobs, integrity, downloads, jobs, routecache, search, stats
 
 @admin.register(FileUpload)
 class FileUploadAdmin(admin.ModelAdmin):
     list_display = ('filename', 'file_size_mb', 'file_type', 'uploaded_at', 'download_count', 'integrity_status', 'is_active', 'admin_actions')
-    list_filter = ('file_type', 'uploaded_at', 'is_active')
+    list_filter = ('file_type', 'uploaded_at', 'is_active', 'integrity_ok')
     search_fields = ('filename', 'unique_id', 'md5_hash', 'sha256_hash')
-    readonly_fields = ('unique_id', 'uploaded_at', 'download_count', 'display_file_size', 'file_type', 'md5_hash', 'sha256_hash', 'integrity_status')
+    readonly_fields = ('unique_id', 'uploaded_at', 'download_count', 'display_file_size', 'file_type', 'md5_hash', 'sha256_hash', 'integrity_status', 'last_verified_at')
     list_per_page = 25
     
     fieldsets = (
@@ -23,7 +24,7 @@ class FileUploadAdmin(admin.ModelAdmin):
             'fields': ('file', 'filename', 'display_file_size', 'file_type')
         }),
         ('Integrity Verification', {
-            'fields': ('md5_hash', 'sha256_hash', 'integrity_status'),
+            'fields': ('md5_hash', 'sha256_hash', 'integrity_status', 'last_verified_at'),
             'classes': ('collapse',)
         }),
         ('Metadata', {
@@ -31,6 +32,15 @@ class FileUploadAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_search_results(self, request, queryset, search_term):
+        """Look up full MD5/SHA256 hashes through their indexes instead of substring matching"""
+        term = search_term.strip().lower()
+        if re.fullmatch(r'[0-9a-f]{64}', term):
+            return queryset.filter(sha256_hash=term), False
+        if re.fullmatch(r'[0-9a-f]{32}', term):
+            return queryset.filter(Q(md5_hash=term) | Q(unique_id=term)), False
+        return super().get_search_results(request, queryset, search_term)
+    
     def file_size_mb(self, obj):
         return f"{obj.get_file_size_mb()} MB"
     file_size_mb.short_description = 'Size (MB)'
@@ -51,14 +61,15 @@ class FileUploadAdmin(admin.ModelAdmin):
     display_file_size.short_description = 'File size'
     
     def integrity_status(self, obj):
-        """Display file integrity status with icons"""
+        """Display the stored integrity state without touching storage; `verify_store` and the verify button check files"""
         if not obj.md5_hash or not obj.sha256_hash:
             return format_html('<span class="integrity-no-hash"><i class="fas fa-exclamation-triangle"></i> No Hash</span>')
-        
-        if obj.verify_file_integrity():
-            return format_html('<span class="integrity-verified"><i class="fas fa-check-circle"></i> Verified</span>')
-        else:
-            return format_html('<span class="integrity-corrupted"><i class="fas fa-times-circle"></i> Corrupted</span>')
+        if obj.integrity_ok is None:
+            return format_html('<span class="integrity-no-hash"><i class="fas fa-question-circle"></i> Not Verified</span>')
+        verified_at = obj.last_verified_at.strftime('%Y-%m-%d %H:%M') if obj.last_verified_at else ''
+        if not obj.integrity_ok:
+            return format_html('<span class="integrity-corrupted" title="Checked {}"><i class="fas fa-times-circle"></i> Corrupted</span>', verified_at)
+        return format_html('<span class="integrity-verified" title="Verified {}"><i class="fas fa-check-circle"></i> Verified</span>', verified_at)
     integrity_status.short_description = 'Integrity'
     
     def admin_actions(self, obj):
@@ -92,26 +103,27 @@ class FileUploadAdmin(admin.ModelAdmin):
     ]
     
     def mark_inactive(self, request, queryset):
-        updated = queryset.update(is_active=False)
+        updated = stats.set_active(queryset, False)
+        search.bulk_changed()
+        routecache.invalidate_all()
         self.message_user(request, f'{updated} files marked as inactive.')
     mark_inactive.short_description = "Mark selected files as inactive"
     
     def mark_active(self, request, queryset):
-        updated = queryset.update(is_active=True)
+        updated = stats.set_active(queryset, True)
+        search.bulk_changed()
+        routecache.invalidate_all()
         self.message_user(request, f'{updated} files marked as active.')
     mark_active.short_description = "Mark selected files as active"
     
     def reset_download_count(self, request, queryset):
-        updated = queryset.update(download_count=0)
+        updated = stats.reset_downloads(queryset)
         self.message_user(request, f'Download count reset for {updated} files.')
     reset_download_count.short_description = "Reset download count to 0"
     
     def delete_files(self, request, queryset):
         count = queryset.count()
-        for file_obj in queryset:
-            # Delete the actual file from storage
-            if file_obj.file and os.path.exists(file_obj.file.path):
-                os.remove(file_obj.file.path)
+        # Stored contents are released per file and removed with their last reference
         queryset.delete()
         self.message_user(request, f'{count} files deleted successfully.')
     delete_files.short_description = "Delete selected files (permanent)"
@@ -119,23 +131,25 @@ class FileUploadAdmin(admin.ModelAdmin):
     def duplicate_files(self, request, queryset):
         duplicated_count = 0
         for file_obj in queryset:
-            # Create a copy of the file
-            new_filename = f"copy_{file_obj.filename}"
-            new_file_obj = FileUpload.objects.create(
-                filename=new_filename,
-                file_size=file_obj.file_size,
-                file_type=file_obj.file_type,
-                is_active=file_obj.is_active
-            )
-            
-            # Copy the actual file
-            if file_obj.file and os.path.exists(file_obj.file.path):
-                with open(file_obj.file.path, 'rb') as original_file:
-                    new_file_obj.file.save(
-                        os.path.basename(file_obj.file.name),
-                        ContentFile(original_file.read())
-                    )
-                duplicated_count += 1
+            if not file_obj.file:
+                continue
+            if file_obj.blob is None:
+                # Files stored before deduplication move into the blob store first
+                blobs.adopt_upload(file_obj)
+            with transaction.atomic():
+                blob = blobs.acquire(file_obj.blob.sha256_hash) if file_obj.blob else None
+                if blob is None:
+                    continue
+                # Metadata-only copy: the new record shares the stored contents
+                new_file_obj = FileUpload(
+                    filename=f"copy_{file_obj.filename}",
+                    file_size=file_obj.file_size,
+                    file_type=file_obj.file_type,
+                    is_active=file_obj.is_active
+                )
+                new_file_obj.use_blob(blob)
+                new_file_obj.save()
+            duplicated_count += 1
         
         self.message_user(request, f'{duplicated_count} files duplicated successfully.')
     duplicate_files.short_description = "Duplicate selected files"
@@ -149,14 +163,16 @@ class FileUploadAdmin(admin.ModelAdmin):
         response['Content-Disposition'] = 'attachment; filename="file_info.csv"'
         
         writer = csv.writer(response)
-        writer.writerow(['Filename', 'Size (MB)', 'Type', 'Uploaded', 'Downloads', 'Active', 'Unique ID', 'MD5 Hash', 'SHA256 Hash', 'Integrity Status'])
+        writer.writerow(['Filename', 'Size (MB)', 'Type', 'Uploaded', 'Downloads', 'Active', 'Unique ID', 'MD5 Hash', 'SHA256 Hash', 'Integrity Status', 'Last Verified'])
         
         for file_obj in queryset:
-            integrity_status = 'Unknown'
-            if file_obj.md5_hash and file_obj.sha256_hash:
-                integrity_status = 'Verified' if file_obj.verify_file_integrity() else 'Corrupted'
-            else:
+            # Stored result of the last verification; exporting never re-hashes
+            if not file_obj.md5_hash or not file_obj.sha256_hash:
                 integrity_status = 'No Hash'
+            elif file_obj.integrity_ok is None:
+                integrity_status = 'Not Verified'
+            else:
+                integrity_status = 'Verified' if file_obj.integrity_ok else 'Corrupted'
             
             writer.writerow([
                 file_obj.filename,
@@ -168,62 +184,30 @@ class FileUploadAdmin(admin.ModelAdmin):
                 file_obj.unique_id,
                 file_obj.md5_hash or 'N/A',
                 file_obj.sha256_hash or 'N/A',
-                integrity_status
+                integrity_status,
+                file_obj.last_verified_at.strftime('%Y-%m-%d %H:%M:%S') if file_obj.last_verified_at else 'Never'
             ])
         
         return response
     export_file_info.short_description = "Export file information as CSV"
     
+    def _queue_jobs(self, request, kind, queryset):
+        """Queue one background job per file and link to their progress"""
+        batch, count = jobs.enqueue_for_files(kind, queryset)
+        url = reverse('admin:file_sharing_job_changelist') + f'?batch={batch}'
+        self.message_user(request, format_html(
+            '{} files queued. <a href="{}">Follow their progress</a> (processed by <code>manage.py run_workers</code>).',
+            count, url
+        ))
+    
     def verify_integrity(self, request, queryset):
-        """Verify integrity of selected files"""
-        verified_count = 0
-        corrupted_count = 0
-        no_hash_count = 0
-        
-        for file_obj in queryset:
-            if not file_obj.md5_hash or not file_obj.sha256_hash:
-                no_hash_count += 1
-            elif file_obj.verify_file_integrity():
-                verified_count += 1
-            else:
-                corrupted_count += 1
-        
-        message_parts = []
-        if verified_count > 0:
-            message_parts.append(f'{verified_count} files verified')
-        if corrupted_count > 0:
-            message_parts.append(f'{corrupted_count} files corrupted')
-        if no_hash_count > 0:
-            message_parts.append(f'{no_hash_count} files without hashes')
-        
-        self.message_user(request, f'Integrity check complete: {", ".join(message_parts)}.')
+        """Queue integrity verification of selected files"""
+        self._queue_jobs(request, Job.KIND_VERIFY_INTEGRITY, queryset)
     verify_integrity.short_description = "Verify file integrity"
     
     def recalculate_hashes(self, request, queryset):
-        """Recalculate hashes for selected files"""
-        updated_count = 0
-        failed_count = 0
-        
-        for file_obj in queryset:
-            try:
-                md5_hash, sha256_hash = file_obj.calculate_hashes()
-                if md5_hash and sha256_hash:
-                    file_obj.md5_hash = md5_hash
-                    file_obj.sha256_hash = sha256_hash
-                    file_obj.save(update_fields=['md5_hash', 'sha256_hash'])
-                    updated_count += 1
-                else:
-                    failed_count += 1
-            except Exception:
-                failed_count += 1
-        
-        message_parts = []
-        if updated_count > 0:
-            message_parts.append(f'{updated_count} hashes updated')
-        if failed_count > 0:
-            message_parts.append(f'{failed_count} failed')
-        
-        self.message_user(request, f'Hash recalculation complete: {", ".join(message_parts)}.')
+        """Queue hash recalculation for selected files"""
+        self._queue_jobs(request, Job.KIND_RECALCULATE_HASHES, queryset)
     recalculate_hashes.short_description = "Recalculate file hashes"
     
     def get_urls(self):
@@ -262,23 +246,15 @@ class FileUploadAdmin(admin.ModelAdmin):
                         messages.error(request, f'File size exceeds 100GB limit. Current size: {new_file.size / (1024**3):.2f} GB')
                         return HttpResponseRedirect(f'/admin/file_sharing/fileupload/{file_id}/replace_file/')
                     
-                    # Delete old file
-                    if file_obj.file and os.path.exists(file_obj.file.path):
-                        os.remove(file_obj.file.path)
-                    
-                    # Update with new file
+                    # Update with new file; the old contents are released on save
                     file_obj.file = new_file
                     file_obj.filename = new_file.name
                     file_obj.file_size = new_file.size
                     file_obj.file_type = new_file.content_type
+                    # Hashes are computed while the upload streams in
                     file_obj.save()
                     
-                    # Calculate hashes for the new file
-                    md5_hash, sha256_hash = file_obj.calculate_hashes()
-                    if md5_hash and sha256_hash:
-                        file_obj.md5_hash = md5_hash
-                        file_obj.sha256_hash = sha256_hash
-                        file_obj.save(update_fields=['md5_hash', 'sha256_hash'])
+                    if file_obj.md5_hash and file_obj.sha256_hash:
                         messages.success(request, f'File "{file_obj.filename}" replaced successfully with integrity verification!')
                     else:
                         messages.warning(request, f'File "{file_obj.filename}" replaced but hash calculation failed.')
@@ -313,30 +289,16 @@ class FileUploadAdmin(admin.ModelAdmin):
         try:
             file_obj = FileUpload.objects.get(id=file_id)
             
-            if not file_obj.file or not os.path.exists(file_obj.file.path):
-                messages.error(request, 'File not found on disk.')
+            if not file_obj.file or not default_storage.exists(file_obj.file.name):
+                messages.error(request, 'File not found in storage.')
                 return HttpResponseRedirect(f'/admin/file_sharing/fileupload/{file_id}/change/')
             
-            # Verify file integrity before download
-            if file_obj.md5_hash and file_obj.sha256_hash:
-                if not file_obj.verify_file_integrity():
-                    messages.warning(request, 'File integrity check failed. The file may be corrupted.')
-            
-            # Increment download count
-            file_obj.increment_download_count()
-            
-            # Prepare response
-            response = FileResponse(open(file_obj.file.path, 'rb'), content_type=file_obj.file_type)
-            response['Content-Disposition'] = f'attachment; filename="{file_obj.filename}"'
-            response['Content-Length'] = file_obj.file_size
+            # Check file integrity according to FILE_INTEGRITY_MODE
+            if not integrity.allow_download(file_obj):
+                messages.warning(request, 'File integrity check failed. The file may be corrupted.')
             
-            # Add hash information to headers
-            if file_obj.md5_hash:
-                response['X-File-MD5'] = file_obj.md5_hash
-            if file_obj.sha256_hash:
-                response['X-File-SHA256'] = file_obj.sha256_hash
-            
-            return response
+            # Stream the file, answering Range and conditional requests (counts the download)
+            return downloads.serve_file(request, file_obj)
             
         except FileUpload.DoesNotExist:
             messages.error(request, 'File not found.')
@@ -347,14 +309,14 @@ class FileUploadAdmin(admin.ModelAdmin):
         try:
             file_obj = FileUpload.objects.get(id=file_id)
             
-            if not file_obj.file or not os.path.exists(file_obj.file.path):
-                messages.error(request, 'File not found on disk.')
+            if not file_obj.file or not default_storage.exists(file_obj.file.name):
+                messages.error(request, 'File not found in storage.')
                 return HttpResponseRedirect(f'/admin/file_sharing/fileupload/{file_id}/change/')
             
             # Verify integrity
             if not file_obj.md5_hash or not file_obj.sha256_hash:
                 messages.warning(request, 'No hash information available for this file.')
-            elif file_obj.verify_file_integrity():
+            elif integrity.verify_and_record(file_obj):
                 messages.success(request, 'File integrity verified successfully! ✅')
             else:
                 messages.error(request, 'File integrity check failed! The file may be corrupted. ❌')
@@ -384,16 +346,20 @@ class FileUploadAdmin(admin.ModelAdmin):
     def changelist_view(self, request, extra_context=None):
         """Override changelist view to add advanced statistics"""
         
-        # Global statistics
-        total_files = FileUpload.objects.count()
-        active_files = FileUpload.objects.filter(is_active=True).count()
-        inactive_files = FileUpload.objects.filter(is_active=False).count()
-        total_downloads = FileUpload.objects.aggregate(total=Sum('download_count'))['total'] or 0
-        total_size_bytes = FileUpload.objects.aggregate(total=Sum('file_size'))['total'] or 0
-        total_size_mb = round(total_size_bytes / (1024 * 1024), 2)
+        # Global statistics from the incrementally maintained rollup
+        storage_stats = stats.get_stats()
+        total_files = storage_stats.total_files
+        active_files = storage_stats.active_files
+        inactive_files = storage_stats.inactive_files
+        total_downloads = storage_stats.total_downloads
+        total_size_mb = round(storage_stats.total_size / (1024 * 1024), 2)
+        
+        # Background jobs still to run
+        pending_jobs = Job.objects.filter(status__in=[Job.STATUS_QUEUED, Job.STATUS_RUNNING]).count()
         
         extra_context = extra_context or {}
         extra_context.update({
+            'global_pending_jobs': pending_jobs,
             'global_total_files': total_files,
             'global_active_files': active_files,
             'global_inactive_files': inactive_files,
@@ -402,3 +368,42 @@ class FileUploadAdmin(admin.ModelAdmin):
         })
         
         return super().changelist_view(request, extra_context)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'file_upload', 'status', 'progress', 'result', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    list_select_related = ('file_upload',)
+    readonly_fields = (
+        'batch', 'status', 'progress', 'result', 'error', 'attempts', 'worker',
+        'created_at', 'started_at', 'finished_at', 'updated_at',
+    )
+    raw_id_fields = ('file_upload',)
+    actions = ['retry_jobs']
+    
+    def progress(self, obj):
+        """Progress bar from the bytes the worker has processed"""
+        percent = obj.progress_percent()
+        return format_html(
+            '<div style="width:120px;background:#495057;border-radius:3px">'
+            '<div style="width:{}%;background:#198754;height:10px;border-radius:3px"></div></div>{}%',
+            percent, percent
+        )
+    progress.short_description = 'Progress'
+    
+    def get_fields(self, request, obj=None):
+        """Only the kind and target can be chosen when queuing a job by hand"""
+        if obj is None:
+            return ('kind', 'file_upload')
+        return ('kind', 'file_upload') + self.readonly_fields
+    
+    def get_readonly_fields(self, request, obj=None):
+        if obj:
+            return ('kind', 'file_upload') + self.readonly_fields
+        return ()
+    
+    def retry_jobs(self, request, queryset):
+        updated = jobs.retry(queryset)
+        self.message_user(request, f'{updated} failed jobs queued again.')
+    retry_jobs.short_description = "Retry selected failed jobs"
@@ -0,0 +1,82 @@
+"""
+Async file I/O for the ASGI views.
+
+Blocking file work (reading blocks, parsing and writing uploads) runs on a
+dedicated thread pool of FILE_IO_THREADS threads rather than asgiref's
+sync_to_async executor, so a slow client holds a coroutine and never a
+thread. Streaming responses get async iterators: Django's ASGI handler
+would otherwise read a synchronous iterator into memory in one go before
+sending it.
+
+Calls that also use the database (storing an upload, integrity checks)
+go through run_db(), which drops stale or broken connections on the pool
+thread before and after the call, as Django does around each request.
+Pure file I/O uses run().
+
+Django's ASGI handler still parks one thread per request for its
+thread-sensitive context (middleware, async ORM calls). That thread sits
+idle while the body streams, so it costs a stack but no CPU.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+
+BLOCK_SIZE = 256 * 1024  # Bytes read per pool call when streaming a file
+
+_executor = None
+_executor_lock = threading.Lock()
+_done = object()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'FILE_IO_THREADS', 32), thread_name_prefix='file-io'
+            )
+        return _executor
+
+
+async def run(func, *args, **kwargs):
+    """Run a blocking call on the file I/O pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+def _with_connections(func, *args, **kwargs):
+    # Pool threads never see request_started/finished, so close their connections
+    # by CONN_MAX_AGE and health here
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking call that uses the database on the file I/O pool"""
+    return await run(_with_connections, func, *args, **kwargs)
+
+
+async def iterate(iterable):
+    """Async iterator over a blocking iterator, advancing it on the file I/O pool"""
+    iterator = iter(iterable)
+    while True:
+        item = await run(next, iterator, _done)
+        if item is _done:
+            return
+        yield item
+
+
+def stream_response(response):
+    """Make a streaming response read its body on the file I/O pool"""
+    if response.streaming and not response.is_async:
+        if hasattr(response, 'block_size'):
+            # FileResponse reads block_size bytes per step
+            response.block_size = BLOCK_SIZE
+        response.streaming_content = iterate(response.streaming_content)
+    return response
@@ -0,0 +1,271 @@
+"""
+Content-addressed blob store.
+
+File contents live once under ``blobs/ab/cd/<sha256>`` no matter how many
+FileUploads use them. Each Blob row counts its references: storing known
+content or duplicating an upload only adds a reference, and a blob's file is
+deleted as soon as its last reference is released. Reference changes run in
+a transaction that locks the Blob row, and callers take a reference and
+write the FileUpload using it in one transaction, so collect() never sees a
+reference without its row. collect() also leaves blobs younger than its
+minimum age alone.
+"""
+import hashlib
+import os
+import uuid
+from datetime import timedelta
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from .models import Blob, FileUpload, get_blob_path
+from .storage import hash_file
+from . import storage
+
+INCOMING_DIR = 'blobs/.incoming'  # Under the local staging root
+STREAM_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def acquire(sha256_hash, size=None, listed_only=False):
+    """Take a reference to a stored blob if its contents are already here; returns the Blob or None.
+
+    listed_only restricts it to contents an active upload still shares, for callers that never sent the bytes.
+    """
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(sha256_hash=sha256_hash).first()
+        if blob is None or (size is not None and blob.size != size):
+            return None
+        if listed_only and not blob.uploads.filter(is_active=True).exists():
+            return None
+        if not default_storage.exists(blob.name):
+            return None
+        Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        blob.ref_count += 1
+        return blob
+
+
+def adopt(path, md5_hash, sha256_hash):
+    """Move a hashed local file into the store and take a reference; returns (blob, created)"""
+    name = get_blob_path(sha256_hash)
+    size = os.path.getsize(path)
+    if not storage.is_local():
+        # Object stores cannot rename, so upload before taking the row lock; the key is
+        # the content hash, so a racing upload of the same contents writes the same bytes
+        if default_storage.exists(name):
+            os.remove(path)
+        else:
+            storage.put_file(path, name)
+        path = None
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                blob = Blob.objects.select_for_update().filter(sha256_hash=sha256_hash).first()
+                if blob is not None:
+                    Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+                    blob.ref_count += 1
+                    if path is not None:
+                        if default_storage.exists(name):
+                            os.remove(path)
+                        else:
+                            # Row without a file (lost blob): these bytes restore it
+                            storage.put_file(path, name)
+                    return blob, False
+                blob = Blob.objects.create(sha256_hash=sha256_hash, md5_hash=md5_hash, size=size, ref_count=1)
+                if path is not None:
+                    storage.put_file(path, name)
+                return blob, True
+        except IntegrityError:
+            # Another request created the row first; take a reference to it instead
+            if attempt:
+                raise
+
+
+def _stage_blocks(blocks):
+    """Write blocks to a new local staging file, hashing them on the way; returns (path, md5, sha256)"""
+    md5_hash = hashlib.md5()
+    sha256_hash = hashlib.sha256()
+    path = storage.staging_path(INCOMING_DIR, uuid.uuid4().hex)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        with open(path, 'wb') as f:
+            for block in blocks:
+                md5_hash.update(block)
+                sha256_hash.update(block)
+                f.write(block)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, md5_hash, sha256_hash
+
+
+def store(content):
+    """Store uploaded content and take a reference; returns (blob, created)"""
+    md5_hash, sha256_hash = getattr(content, 'md5_hash', None), getattr(content, 'sha256_hash', None)
+    if sha256_hash:
+        # Digests from the hashing upload handlers: known content is never written again
+        blob = acquire(sha256_hash, getattr(content, 'size', None))
+        if blob is not None:
+            return blob, False
+    if hasattr(content, 'temporary_file_path'):
+        # Spooled uploads already sit in staging: adopting them is a rename
+        path = content.temporary_file_path()
+        if not (md5_hash and sha256_hash):
+            md5_hash, sha256_hash = hash_file(path)
+        return adopt(path, md5_hash, sha256_hash)
+    if not hasattr(content, 'chunks'):
+        content = File(content)
+    path, md5, sha256 = _stage_blocks(content.chunks())
+    return adopt(path, md5.hexdigest(), sha256.hexdigest())
+
+
+def write_stream(stream, length, block_size=STREAM_BLOCK_SIZE):
+    """Write length bytes read from stream to a new staging file, hashing them on the way.
+
+    Returns (path, md5, sha256) with raw digests; raises ValueError if the stream ends early.
+    """
+    def blocks():
+        remaining = length
+        while remaining:
+            block = stream.read(min(block_size, remaining))
+            if not block:
+                raise ValueError(f'Body ended after {length - remaining} of {length} bytes')
+            remaining -= len(block)
+            yield block
+
+    path, md5_hash, sha256_hash = _stage_blocks(blocks())
+    return path, md5_hash.digest(), sha256_hash.digest()
+
+
+def adopt_upload(file_upload):
+    """Move a file saved before deduplication into the store; returns its Blob, or None if missing or corrupted"""
+    name = file_upload.file.name
+    path = storage.local_path(name)
+    if path is None:
+        # Remote stores cannot rename: copy the contents into staging and adopt the copy
+        if not default_storage.exists(name):
+            return None
+        with default_storage.open(name, 'rb') as f:
+            path, md5, sha256 = _stage_blocks(iter(lambda: f.read(STREAM_BLOCK_SIZE), b''))
+        md5_hash, sha256_hash = md5.hexdigest(), sha256.hexdigest()
+    elif not os.path.exists(path):
+        return None
+    else:
+        md5_hash, sha256_hash = hash_file(path)
+    if file_upload.sha256_hash and sha256_hash != file_upload.sha256_hash:
+        if not storage.is_local():
+            os.remove(path)
+        return None
+    with transaction.atomic():
+        blob, _ = adopt(path, md5_hash, sha256_hash)
+        FileUpload.objects.filter(pk=file_upload.pk).update(blob=blob, file=blob.name)
+    if not storage.is_local():
+        default_storage.delete(name)
+    file_upload.blob = blob
+    file_upload.file.name = blob.name
+    return blob
+
+
+def has_size(size):
+    """Whether an active file has this size: a cheap pre-check before hashing on the client.
+
+    Only active files count, whose sizes the public file list shows anyway.
+    """
+    return (
+        Blob.objects.filter(size=size, uploads__is_active=True).exists()
+        or FileUpload.objects.filter(blob__isnull=True, is_active=True, file_size=size).exclude(file='').exists()
+    )
+
+
+def acquire_by_digest(sha256_hash, size):
+    """Take a reference to contents of an active file matching a client-computed digest, or return None.
+
+    The client proves nothing but the digest, so contents only deactivated files use stay out of reach.
+    """
+    blob = acquire(sha256_hash, size, listed_only=True)
+    if blob is None:
+        legacy = (
+            FileUpload.objects.filter(sha256_hash=sha256_hash, file_size=size, blob__isnull=True, is_active=True)
+            .exclude(file='').first()
+        )
+        if legacy is not None and adopt_upload(legacy):
+            blob = acquire(sha256_hash, size, listed_only=True)
+    return blob
+
+
+def release(blob_id, legacy_name=None):
+    """Drop one reference to a blob, deleting it with its last reference"""
+    if blob_id is None:
+        # Files stored before deduplication belong to a single upload
+        if legacy_name:
+            default_storage.delete(legacy_name)
+        return
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=blob_id).first()
+        if blob is None:
+            return
+        if blob.ref_count > 1:
+            Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+            return
+        in_use = blob.uploads.count()
+        if in_use:
+            # The count drifted; trust the actual references and keep the blob
+            Blob.objects.filter(pk=blob_id).update(ref_count=in_use)
+            return
+        blob.delete()
+        default_storage.delete(blob.name)
+
+
+def release_on_commit(blob_id, legacy_name=None):
+    """Release once the surrounding transaction commits, so a rollback keeps the file"""
+    transaction.on_commit(lambda: release(blob_id, legacy_name))
+
+
+def collect(min_age_hours=24):
+    """Fix drifted reference counts and delete unreferenced blobs, orphaned blob files and
+    abandoned staging writes older than min_age_hours; returns (recounted, deleted_blobs, deleted_files)"""
+    recounted = deleted_blobs = deleted_files = 0
+    cutoff = timezone.now() - timedelta(hours=min_age_hours)
+    drifted = (
+        Blob.objects.filter(created_at__lt=cutoff)
+        .annotate(actual=Count('uploads')).exclude(ref_count=F('actual'))
+    )
+    for blob_id in drifted.values_list('pk', flat=True):
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(pk=blob_id).first()
+            if blob is None:
+                continue
+            actual = blob.uploads.count()
+            if actual:
+                Blob.objects.filter(pk=blob_id).update(ref_count=actual)
+                recounted += 1
+            else:
+                blob.delete()
+                default_storage.delete(blob.name)
+                deleted_blobs += 1
+
+    # Stored files without a row: crashes between writing and committing
+    for directory, filenames in storage.walk('blobs'):
+        known = set(Blob.objects.filter(sha256_hash__in=filenames).values_list('sha256_hash', flat=True))
+        for filename in filenames:
+            if filename in known:
+                continue
+            name = f'{directory}/{filename}'
+            try:
+                if default_storage.get_modified_time(name) < cutoff:
+                    default_storage.delete(name)
+                    deleted_files += 1
+            except FileNotFoundError:
+                pass
+
+    # Abandoned writes in the local staging directory
+    incoming = storage.staging_path(INCOMING_DIR)
+    for filename in os.listdir(incoming) if os.path.isdir(incoming) else []:
+        path = os.path.join(incoming, filename)
+        try:
+            if os.path.getmtime(path) < cutoff.timestamp():
+                os.remove(path)
+                deleted_files += 1
+        except FileNotFoundError:
+            pass
+    return recounted, deleted_blobs, deleted_files
@@ -0,0 +1,271 @@
+"""
+Chunk assembly for chunked uploads.
+
+Each chunk is written at its offset straight into a preallocated partial file
+in the local staging directory, using copy_file_range/sendfile when the chunk
+was spooled to disk. Chunks may arrive in any order and in parallel; an
+UploadSession keeps a bitmap of received chunks and the upload is finalised
+only once it is full. The partial file is then moved into the blob store (or
+dropped when the same contents are already stored): a rename for local
+storage, a single multipart upload for an object store.
+"""
+import math
+import os
+import re
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
+from .models import FileUpload, UploadSession
+from .storage import hash_file, staging_path
+from . import aio, blobs
+
+PARTIAL_DIR = os.path.join('uploads', '.partial')
+COPY_BUFFER_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+_upload_id_re = re.compile(r'^[\w-]{1,100}$')
+
+
+def validate_upload_id(upload_id):
+    """Reject client-supplied upload ids that could escape the partial directory"""
+    if not upload_id or not _upload_id_re.match(upload_id):
+        raise ValueError('Invalid file_id')
+    return upload_id
+
+
+def partial_path(upload_id):
+    """Absolute path of the partial file for an upload"""
+    return staging_path(PARTIAL_DIR, f'{validate_upload_id(upload_id)}.part')
+
+
+def open_partial(upload_id, file_size):
+    """Open (creating and preallocating if needed) the partial file, returning an fd"""
+    path = partial_path(upload_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        if os.fstat(fd).st_size < file_size:
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, 0, file_size)
+                except OSError:
+                    os.ftruncate(fd, file_size)
+            else:
+                os.ftruncate(fd, file_size)
+    except Exception:
+        os.close(fd)
+        raise
+    return fd
+
+
+def _pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+def _copy_fd_range(src_fd, dst_fd, offset, count):
+    """Copy count bytes from the start of src_fd to offset in dst_fd in the kernel where possible"""
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < count:
+                n = os.copy_file_range(src_fd, dst_fd, count - copied, copied, offset + copied)
+                if n == 0:
+                    return copied
+                copied += n
+            return copied
+        except OSError:
+            pass
+    if hasattr(os, 'sendfile'):
+        try:
+            os.lseek(dst_fd, offset + copied, os.SEEK_SET)
+            while copied < count:
+                n = os.sendfile(dst_fd, src_fd, copied, count - copied)
+                if n == 0:
+                    return copied
+                copied += n
+            return copied
+        except OSError:
+            pass
+    while copied < count:
+        size = min(COPY_BUFFER_SIZE, count - copied)
+        if hasattr(os, 'pread'):
+            data = os.pread(src_fd, size, copied)
+        else:
+            os.lseek(src_fd, copied, os.SEEK_SET)
+            data = os.read(src_fd, size)
+        if not data:
+            break
+        _pwrite_all(dst_fd, data, offset + copied)
+        copied += len(data)
+    return copied
+
+
+def write_chunk(upload_id, file_size, offset, chunk):
+    """Write an uploaded chunk at offset in the partial file and return the bytes written"""
+    fd = open_partial(upload_id, file_size)
+    try:
+        if hasattr(chunk, 'temporary_file_path'):
+            src_fd = os.open(chunk.temporary_file_path(), os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            try:
+                return _copy_fd_range(src_fd, fd, offset, chunk.size)
+            finally:
+                os.close(src_fd)
+        written = 0
+        for data in chunk.chunks():
+            _pwrite_all(fd, data, offset + written)
+            written += len(data)
+        return written
+    finally:
+        os.close(fd)
+
+
+def discard(upload_id):
+    """Remove the partial file of an abandoned upload"""
+    try:
+        os.remove(partial_path(upload_id))
+    except FileNotFoundError:
+        pass
+
+
+def _session_defaults(upload_id, filename, file_size, file_type, chunk_size, total_chunks):
+    validate_upload_id(upload_id)
+    if not filename:
+        raise ValueError('filename is required')
+    if file_size < 0 or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError('Invalid file_size or chunk_size')
+    if total_chunks != max(1, math.ceil(file_size / chunk_size)):
+        raise ValueError('total_chunks does not match file_size and chunk_size')
+    return {
+        'filename': filename,
+        'file_size': file_size,
+        'file_type': file_type,
+        'chunk_size': chunk_size,
+        'total_chunks': total_chunks,
+    }
+
+
+def _check_session(session, created, defaults):
+    if not created and (session.file_size, session.chunk_size, session.total_chunks) != (
+        defaults['file_size'], defaults['chunk_size'], defaults['total_chunks']
+    ):
+        raise ValueError('Upload parameters do not match the existing upload session')
+    return session
+
+
+def get_or_create_session(upload_id, filename, file_size, file_type, chunk_size, total_chunks):
+    """Return the UploadSession for upload_id, creating it on the first chunk"""
+    defaults = _session_defaults(upload_id, filename, file_size, file_type, chunk_size, total_chunks)
+    session, created = UploadSession.objects.get_or_create(upload_id=upload_id, defaults=defaults)
+    return _check_session(session, created, defaults)
+
+
+async def aget_or_create_session(upload_id, filename, file_size, file_type, chunk_size, total_chunks):
+    """Async get_or_create_session"""
+    defaults = _session_defaults(upload_id, filename, file_size, file_type, chunk_size, total_chunks)
+    session, created = await UploadSession.objects.aget_or_create(upload_id=upload_id, defaults=defaults)
+    return _check_session(session, created, defaults)
+
+
+def _validate_chunk(session, chunk_number, chunk):
+    if not 0 <= chunk_number < session.total_chunks:
+        raise ValueError(f'chunk_number must be between 0 and {session.total_chunks - 1}')
+    expected_size = session.expected_chunk_size(chunk_number)
+    if chunk.size != expected_size:
+        raise ValueError(f'Chunk {chunk_number} must be {expected_size} bytes, got {chunk.size}')
+    return expected_size
+
+
+def _write_received_chunk(session, chunk_number, chunk, expected_size):
+    written = write_chunk(session.upload_id, session.file_size, session.chunk_offset(chunk_number), chunk)
+    if written != expected_size:
+        raise ValueError(f'Chunk {chunk_number} was only partially written')
+
+
+def _mark_received(session, chunk_number):
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        session.mark_chunk(chunk_number)
+        completed = session.status == UploadSession.STATUS_ACTIVE and session.is_complete()
+        if completed:
+            session.status = UploadSession.STATUS_ASSEMBLING
+        session.save(update_fields=['received_chunks', 'received_count', 'bytes_received', 'status', 'updated_at'])
+    return session, completed
+
+
+def receive_chunk(session, chunk_number, chunk):
+    """
+    Validate a chunk against the session, write it and mark it received.
+    Returns (session, completed) where completed is True for exactly one request:
+    the one whose chunk filled the bitmap, which must then call complete_session().
+    """
+    expected_size = _validate_chunk(session, chunk_number, chunk)
+    if session.status != UploadSession.STATUS_ACTIVE:
+        return session, False
+    if not session.has_chunk(chunk_number):
+        _write_received_chunk(session, chunk_number, chunk, expected_size)
+    return _mark_received(session, chunk_number)
+
+
+async def areceive_chunk(session, chunk_number, chunk):
+    """Async receive_chunk: the write runs on the file I/O pool"""
+    expected_size = _validate_chunk(session, chunk_number, chunk)
+    if session.status != UploadSession.STATUS_ACTIVE:
+        return session, False
+    if not session.has_chunk(chunk_number):
+        await aio.run(_write_received_chunk, session, chunk_number, chunk, expected_size)
+    # The async ORM has no transactions: lock the row in a sync call
+    return await sync_to_async(_mark_received)(session, chunk_number)
+
+
+def complete_session(session):
+    """Move the assembled file into place and create its FileUpload"""
+    try:
+        path = partial_path(session.upload_id)
+        md5_hash, sha256_hash = hash_file(path)
+        # The reference and the row using it commit together, see blobs.collect()
+        with transaction.atomic():
+            blob, created = blobs.adopt(path, md5_hash, sha256_hash)
+            file_upload = FileUpload(
+                filename=session.filename,
+                file_size=session.file_size,
+                file_type=session.file_type
+            )
+            file_upload.use_blob(blob, fresh=created)
+            file_upload.save()
+    except Exception:
+        session.status = UploadSession.STATUS_ACTIVE
+        session.save(update_fields=['status', 'updated_at'])
+        raise
+
+    session.status = UploadSession.STATUS_COMPLETE
+    session.file_upload = file_upload
+    session.save(update_fields=['status', 'file_upload', 'updated_at'])
+    return file_upload
+
+
+def discard_session(session):
+    """Delete an unfinished session and its partial file"""
+    discard(session.upload_id)
+    session.delete()
+
+
+def cleanup_sessions(older_than_hours):
+    """Delete sessions idle for older_than_hours; returns (abandoned, completed) counts"""
+    cutoff = timezone.now() - timedelta(hours=older_than_hours)
+    abandoned = 0
+    sessions = UploadSession.objects.filter(updated_at__lt=cutoff).exclude(status=UploadSession.STATUS_COMPLETE)
+    for session in sessions.iterator():
+        discard_session(session)
+        abandoned += 1
+    # Completed sessions only serve retried final chunks; drop them after the same delay
+    completed, _ = UploadSession.objects.filter(updated_at__lt=cutoff, status=UploadSession.STATUS_COMPLETE).delete()
+    return abandoned, completed
@@ -0,0 +1,109 @@
+"""
+Buffered download counters.
+
+Downloads are counted in an in-process buffer and written in batches with
+``F('download_count') + n`` by a background thread every
+DOWNLOAD_COUNT_FLUSH_INTERVAL seconds (and at interpreter exit), so the
+download path never waits on a database write and concurrent increments are
+never lost. Set the interval to 0 to write each increment immediately.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pending = defaultdict(int)
+_flusher = None
+_flusher_pid = None
+
+
+def get_flush_interval():
+    return getattr(settings, 'DOWNLOAD_COUNT_FLUSH_INTERVAL', 5)
+
+
+def record_download(file_id, count=1):
+    """Count a download of the FileUpload with primary key file_id"""
+    if get_flush_interval() <= 0:
+        _apply({file_id: count})
+        return
+    with _lock:
+        _pending[file_id] += count
+    _ensure_flusher()
+
+
+def pending_count(file_id):
+    """Downloads of file_id counted but not yet written to the database"""
+    with _lock:
+        return _pending.get(file_id, 0)
+
+
+def _apply(counts):
+    # Imported here: models imports this module
+    from .models import FileUpload
+    from . import stats
+    by_count = defaultdict(list)
+    for file_id, count in counts.items():
+        by_count[count].append(file_id)
+    with transaction.atomic():
+        for count, file_ids in by_count.items():
+            FileUpload.objects.filter(pk__in=file_ids).update(download_count=F('download_count') + count)
+        stats.downloads_added(counts)
+
+
+def flush():
+    """Write all buffered counts to the database; returns the number of files updated"""
+    global _pending
+    with _lock:
+        counts, _pending = _pending, defaultdict(int)
+    if not counts:
+        return 0
+    try:
+        _apply(counts)
+    except Exception:
+        # Put the counts back so the next flush retries them
+        with _lock:
+            for file_id, count in counts.items():
+                _pending[file_id] += count
+        raise
+    return len(counts)
+
+
+def _run_flusher(interval):
+    while True:
+        time.sleep(interval)
+        close_old_connections()
+        try:
+            flush()
+        except Exception:
+            logger.exception('Flushing download counts failed')
+
+
+def _ensure_flusher():
+    global _flusher, _flusher_pid
+    # Threads do not survive fork(), so pre-forking servers get one flusher per worker
+    if _flusher is not None and _flusher_pid == os.getpid() and _flusher.is_alive():
+        return
+    with _lock:
+        if _flusher is not None and _flusher_pid == os.getpid() and _flusher.is_alive():
+            return
+        _flusher = threading.Thread(
+            target=_run_flusher, args=(get_flush_interval(),), name='download-count-flusher', daemon=True
+        )
+        _flusher_pid = os.getpid()
+        _flusher.start()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception('Flushing download counts at exit failed')
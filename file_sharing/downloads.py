@@ -0,0 +1,295 @@
+"""
+Download responses with HTTP conditional and Range request support.
+
+- Strong ETags come from the stored SHA256 hash; Last-Modified from the file's mtime
+- If-None-Match / If-Modified-Since answer 304 Not Modified
+- Range (single and multiple byte ranges) answers 206 Partial Content, honouring If-Range
+
+The bytes themselves are sent by the backend named in DOWNLOAD_BACKEND:
+``stream`` sends them through Django, ``nginx`` (X-Accel-Redirect) and
+``xsendfile`` (Apache mod_xsendfile, lighttpd) hand the file to the front-end
+web server once Django has done the lookup, checks and counting (files in an
+object store are redirected to instead), and ``redirect`` sends the client to
+a presigned URL on the object store (STORAGE_BACKEND=s3). A dotted path to a
+custom backend class is also accepted.
+"""
+import uuid
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.utils.module_loading import import_string
+from . import aio, integrity, storage
+
+MAX_RANGES = 16  # More ranges than this are served as a full response
+RANGE_BLOCK_SIZE = 256 * 1024
+
+
+def get_etag(file_upload):
+    """Strong ETag derived from the content hash, or None if the file has no hash"""
+    if file_upload.sha256_hash:
+        return f'"{file_upload.sha256_hash}"'
+    return None
+
+
+def parse_range_header(header, size):
+    """
+    Parse a ``Range: bytes=...`` header into a list of inclusive (start, end) pairs.
+    Returns None when the header should be ignored (absent, malformed or too many
+    ranges) and an empty list when no range is satisfiable.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    specs = header[len('bytes='):].split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        spec = spec.strip()
+        if '-' not in spec:
+            return None
+        first, last = spec.split('-', 1)
+        try:
+            if not first:
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length <= 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            start = int(first)
+            end = int(last) if last else None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and end < start):
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+    return ranges
+
+
+def _etag_matches(etag, header, weak=True):
+    if not etag or not header:
+        return False
+    if header.strip() == '*':
+        return True
+    etags = parse_etags(header)
+    if weak:
+        etag = etag.removeprefix('W/')
+        return any(candidate.removeprefix('W/') == etag for candidate in etags)
+    return etag in etags
+
+
+def is_not_modified(request, etag, last_modified):
+    """True if the client's cached copy is still current"""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        return _etag_matches(etag, if_none_match)
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+def if_range_allows(request, etag, last_modified):
+    """True if a Range request may be served partially according to If-Range"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return _etag_matches(etag, if_range, weak=False)
+    date = parse_http_date_safe(if_range)
+    return date is not None and int(last_modified) == date
+
+
+def _read_range(f, start, end):
+    f.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        data = f.read(min(RANGE_BLOCK_SIZE, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+def _single_range(name, start, end):
+    with storage.open_stored(name) as f:
+        yield from _read_range(f, start, end)
+
+
+def _multiple_ranges(name, ranges, parts, boundary):
+    with storage.open_stored(name) as f:
+        for (start, end), part_header in zip(ranges, parts):
+            yield part_header
+            yield from _read_range(f, start, end)
+            yield b'\r\n'
+        yield f'--{boundary}--\r\n'.encode()
+
+
+def _set_file_headers(response, file_upload, etag, last_modified):
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = http_date(last_modified)
+    if etag:
+        response['ETag'] = etag
+    response['Content-Disposition'] = f'attachment; filename="{file_upload.filename}"'
+    # Add hash information to headers for client verification
+    if file_upload.md5_hash:
+        response['X-File-MD5'] = file_upload.md5_hash
+    if file_upload.sha256_hash:
+        response['X-File-SHA256'] = file_upload.sha256_hash
+    return response
+
+
+def _requested_ranges(request, size, etag, last_modified):
+    if request.method not in ('GET', 'HEAD') or not if_range_allows(request, etag, last_modified):
+        return None
+    return parse_range_header(request.META.get('HTTP_RANGE', ''), size)
+
+
+def _counts_as_download(request, ranges):
+    """HEAD requests fetch no bytes; segmented clients count once, for the range at byte 0"""
+    return request.method != 'HEAD' and (not ranges or ranges[0][0] == 0)
+
+
+class StreamingDownloadBackend:
+    """Send file bytes through the Django worker (development and fallback)"""
+
+    def serve(self, request, file_upload, path, size, etag, last_modified):
+        content_type = file_upload.file_type or 'application/octet-stream'
+        ranges = _requested_ranges(request, size, etag, last_modified)
+
+        if ranges == []:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return _set_file_headers(response, file_upload, etag, last_modified)
+
+        if _counts_as_download(request, ranges):
+            file_upload.increment_download_count()
+
+        if ranges is None:
+            response = FileResponse(integrity.open_for_download(file_upload), content_type=content_type)
+            response['Content-Length'] = size
+            return _set_file_headers(response, file_upload, etag, last_modified)
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            response = StreamingHttpResponse(
+                _single_range(file_upload.file.name, start, end), status=206, content_type=content_type
+            )
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = end - start + 1
+            return _set_file_headers(response, file_upload, etag, last_modified)
+
+        boundary = uuid.uuid4().hex
+        parts = [
+            (f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+             f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode()
+            for start, end in ranges
+        ]
+        length = sum(len(part) + (end - start + 1) + 2 for part, (start, end) in zip(parts, ranges))
+        length += len(f'--{boundary}--\r\n')
+        response = StreamingHttpResponse(
+            _multiple_ranges(file_upload.file.name, ranges, parts, boundary),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}',
+        )
+        response['Content-Length'] = length
+        return _set_file_headers(response, file_upload, etag, last_modified)
+
+
+class AcceleratedDownloadBackend:
+    """Hand the file to the front-end web server through an internal-redirect header"""
+    header = None
+
+    def get_location(self, file_upload, path):
+        raise NotImplementedError
+
+    def serve(self, request, file_upload, path, size, etag, last_modified):
+        if path is None:
+            # The front-end server cannot reach files in an object store: redirect or stream instead
+            return RedirectDownloadBackend().serve(request, file_upload, path, size, etag, last_modified)
+        # The web server answers Range requests itself; count downloads starting at byte 0
+        ranges = _requested_ranges(request, size, etag, last_modified)
+        if _counts_as_download(request, ranges):
+            file_upload.increment_download_count()
+
+        response = HttpResponse(content_type=file_upload.file_type or 'application/octet-stream')
+        response[self.header] = self.get_location(file_upload, path)
+        return _set_file_headers(response, file_upload, etag, last_modified)
+
+
+class RedirectDownloadBackend(AcceleratedDownloadBackend):
+    """Redirect to a presigned URL on the object store, which then serves the bytes and Range requests"""
+
+    def serve(self, request, file_upload, path, size, etag, last_modified):
+        url = storage.download_url(file_upload.file.name, file_upload.filename, file_upload.file_type)
+        if url is None:
+            # Local storage cannot presign; send the bytes ourselves
+            return StreamingDownloadBackend().serve(request, file_upload, path, size, etag, last_modified)
+        ranges = _requested_ranges(request, size, etag, last_modified)
+        if _counts_as_download(request, ranges):
+            file_upload.increment_download_count()
+        response = HttpResponseRedirect(url)
+        if etag:
+            response['ETag'] = etag
+        return response
+
+
+class NginxDownloadBackend(AcceleratedDownloadBackend):
+    """nginx: X-Accel-Redirect to an ``internal`` location aliased to MEDIA_ROOT"""
+    header = 'X-Accel-Redirect'
+
+    def get_location(self, file_upload, path):
+        prefix = getattr(settings, 'DOWNLOAD_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        return prefix.rstrip('/') + '/' + quote(file_upload.file.name)
+
+
+class XSendfileDownloadBackend(AcceleratedDownloadBackend):
+    """Apache mod_xsendfile and lighttpd: X-Sendfile with the absolute file path"""
+    header = 'X-Sendfile'
+
+    def get_location(self, file_upload, path):
+        return path
+
+
+DOWNLOAD_BACKENDS = {
+    'stream': StreamingDownloadBackend,
+    'nginx': NginxDownloadBackend,
+    'xsendfile': XSendfileDownloadBackend,
+    'redirect': RedirectDownloadBackend,
+}
+
+
+def get_download_backend():
+    """Instantiate the backend configured by DOWNLOAD_BACKEND"""
+    name = getattr(settings, 'DOWNLOAD_BACKEND', 'stream')
+    backend_class = DOWNLOAD_BACKENDS.get(name) or import_string(name)
+    return backend_class()
+
+
+def serve_file(request, file_upload):
+    """
+    Build the response for downloading file_upload, answering conditional
+    requests here and delegating the bytes to the configured download backend.
+    The download count is incremented only for GET responses that start at
+    the first byte, so segmented clients count once per download.
+    """
+    mtime_ns, size = storage.stat(file_upload.file.name)
+    last_modified = mtime_ns / 10 ** 9
+    etag = get_etag(file_upload)
+
+    if is_not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+        if etag:
+            response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    path = storage.local_path(file_upload.file.name)
+    return get_download_backend().serve(request, file_upload, path, size, etag, last_modified)
+
+
+async def aserve_file(request, file_upload):
+    """serve_file for async views: checks run on the file I/O pool and the body streams asynchronously"""
+    return aio.stream_response(await aio.run_db(serve_file, request, file_upload))
@@ -0,0 +1,178 @@
+"""
+Upload ingestion budgets.
+
+Request bodies are bounded twice per worker process:
+
+* memory: an upload is kept in RAM only if the whole request fits under
+  FILE_UPLOAD_MAX_MEMORY_SIZE (per request) and UPLOAD_MEMORY_BUDGET still has
+  room (all requests together); anything else is spooled to disk.
+* in flight: bodies larger than FILE_UPLOAD_MAX_MEMORY_SIZE reserve their
+  Content-Length from UPLOAD_INFLIGHT_BUDGET before a byte is read. When it is
+  exhausted the request waits up to UPLOAD_BACKPRESSURE_TIMEOUT seconds for
+  room (the client is held at TCP level meanwhile) and then gets a 503.
+  Under ASGI, Django has already received the body by then, so the budget
+  bounds how many are processed at once.
+
+Budgets are per process, so the limits for a server are the budgets times the
+number of worker processes. A value of 0 disables a budget.
+"""
+import asyncio
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+
+RETRY_AFTER_SECONDS = 5
+BACKPRESSURE_POLL_SECONDS = 0.1
+
+
+class Budget:
+    """Byte budget shared by the request threads of one process"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size, timeout=0):
+        """Reserve size bytes, waiting up to timeout seconds; returns the amount reserved or None.
+
+        A request larger than the whole budget is admitted once it can run alone.
+        """
+        if not self.limit:
+            return 0
+        size = min(size, self.limit)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self.in_use + size > self.limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            self.in_use += size
+            return size
+
+    def try_acquire(self, size):
+        """Reserve exactly size bytes if they fit right now"""
+        if not self.limit:
+            return True
+        with self._condition:
+            if self.in_use + size > self.limit:
+                return False
+            self.in_use += size
+            return True
+
+    def release(self, size):
+        if not size or not self.limit:
+            return
+        with self._condition:
+            self.in_use -= size
+            self._condition.notify_all()
+
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def _budget(setting):
+    limit = getattr(settings, setting, 0)
+    with _budgets_lock:
+        budget = _budgets.get(setting)
+        if budget is None or budget.limit != limit:
+            budget = _budgets[setting] = Budget(limit)
+        return budget
+
+
+def memory_budget():
+    return _budget('UPLOAD_MEMORY_BUDGET')
+
+
+def inflight_budget():
+    return _budget('UPLOAD_INFLIGHT_BUDGET')
+
+
+def hold_memory(request, size):
+    """Reserve memory for an upload kept in RAM; False means spool it to disk instead"""
+    if not hasattr(request, '_upload_memory'):
+        # Not admitted by the middleware, so nothing would release a reservation
+        return True
+    if not memory_budget().try_acquire(size):
+        return False
+    request._upload_memory += size
+    return True
+
+
+def content_length(request):
+    try:
+        return max(0, int(request.META.get('CONTENT_LENGTH') or 0))
+    except ValueError:
+        return 0
+
+
+def admit_upload(length, inflight, timeout):
+    """Admit an upload of length bytes against MAX_UPLOAD_SIZE and the in-flight budget.
+
+    Returns (rejection response or None, bytes reserved); the caller releases the reservation.
+    """
+    if length > getattr(settings, 'MAX_UPLOAD_SIZE', length):
+        return JsonResponse({'error': 'Upload exceeds the maximum upload size'}, status=413), 0
+    reserved = 0
+    if length > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+        reserved = inflight.acquire(length, timeout)
+        if reserved is None:
+            response = JsonResponse({'error': 'Server is busy receiving other uploads, retry shortly'}, status=503)
+            response['Retry-After'] = str(RETRY_AFTER_SECONDS)
+            return response, 0
+    return None, reserved
+
+
+class UploadBudgetMiddleware:
+    """Admit large request bodies against the in-flight budget and release upload reservations afterwards"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        inflight = inflight_budget()
+        rejected, reserved = self.admit(request, inflight, getattr(settings, 'UPLOAD_BACKPRESSURE_TIMEOUT', 0))
+        if rejected:
+            return rejected
+        try:
+            return self.get_response(request)
+        finally:
+            self.release(request, inflight, reserved)
+
+    async def __acall__(self, request):
+        inflight = inflight_budget()
+        # Waiting on the budget's condition would block the event loop, so poll it instead
+        deadline = time.monotonic() + getattr(settings, 'UPLOAD_BACKPRESSURE_TIMEOUT', 0)
+        while True:
+            rejected, reserved = self.admit(request, inflight, 0)
+            if rejected is None or time.monotonic() >= deadline or rejected.status_code != 503:
+                break
+            await asyncio.sleep(BACKPRESSURE_POLL_SECONDS)
+        if rejected:
+            return rejected
+        try:
+            return await self.get_response(request)
+        finally:
+            self.release(request, inflight, reserved)
+
+    def admit(self, request, inflight, timeout):
+        """Returns (rejection response or None, bytes reserved)"""
+        rejected, reserved = admit_upload(content_length(request), inflight, timeout)
+        if rejected is None:
+            request._upload_memory = 0
+        return rejected, reserved
+
+    def release(self, request, inflight, reserved):
+        inflight.release(reserved)
+        memory_budget().release(request._upload_memory)
@@ -0,0 +1,122 @@
+"""
+Integrity policies for serving files.
+
+FILE_INTEGRITY_MODE in settings selects how much hashing a download costs:
+
+- ``always``:   re-hash the whole file before every download (legacy behaviour)
+- ``stat``:     re-hash only when the file's mtime/size differ from the last verification
+- ``periodic``: trust the result stored by ``manage.py verify_store`` runs
+- ``stream``:   hash the bytes as they are sent and record any mismatch afterwards
+"""
+import hashlib
+from django.conf import settings
+from django.utils import timezone
+from . import storage
+
+INTEGRITY_MODES = ('always', 'stat', 'periodic', 'stream')
+
+
+def get_integrity_mode():
+    """Return the configured integrity mode"""
+    mode = getattr(settings, 'FILE_INTEGRITY_MODE', 'stat')
+    if mode not in INTEGRITY_MODES:
+        raise ValueError(f'Unknown FILE_INTEGRITY_MODE "{mode}", expected one of {", ".join(INTEGRITY_MODES)}')
+    return mode
+
+
+def file_signature(file_upload):
+    """Return (mtime_ns, size) of the stored file"""
+    return storage.stat(file_upload.file.name)
+
+
+def record_verification(file_upload, ok, signature=None):
+    """Store the result of a verification on the model"""
+    if signature is None:
+        try:
+            signature = file_signature(file_upload)
+        except OSError:
+            signature = (None, None)
+    file_upload.integrity_ok = ok
+    file_upload.last_verified_at = timezone.now()
+    file_upload.verified_mtime, file_upload.verified_size = signature
+    file_upload.save(update_fields=['integrity_ok', 'last_verified_at', 'verified_mtime', 'verified_size'])
+
+
+def verify_and_record(file_upload, progress=None):
+    """Fully re-hash the file, store the result and return it; progress(bytes_done) is called per chunk"""
+    ok = False
+    try:
+        signature = file_signature(file_upload)
+        if file_upload.md5_hash and file_upload.sha256_hash:
+            md5_hash, sha256_hash = storage.hash_stored(file_upload.file.name, progress=progress)
+            ok = md5_hash == file_upload.md5_hash and sha256_hash == file_upload.sha256_hash
+    except OSError:
+        signature = (None, None)
+    record_verification(file_upload, ok, signature)
+    return ok
+
+
+def signature_unchanged(file_upload):
+    """True if the file still has the mtime/size recorded at its last verification"""
+    if file_upload.integrity_ok is None or file_upload.verified_mtime is None:
+        return False
+    try:
+        return file_signature(file_upload) == (file_upload.verified_mtime, file_upload.verified_size)
+    except OSError:
+        return False
+
+
+def allow_download(file_upload):
+    """Decide, according to the integrity mode, whether a file may be served"""
+    if not file_upload.md5_hash or not file_upload.sha256_hash:
+        return True
+
+    mode = get_integrity_mode()
+    if mode == 'always':
+        return verify_and_record(file_upload)
+    if mode == 'stat':
+        if signature_unchanged(file_upload):
+            return file_upload.integrity_ok
+        return verify_and_record(file_upload)
+    # periodic and stream: rely on the stored result, unknown files are served
+    return file_upload.integrity_ok is not False
+
+
+class VerifyingStream:
+    """File wrapper that hashes bytes as they are read and records the result on close"""
+
+    def __init__(self, file_upload, f):
+        self.file_upload = file_upload
+        self.file = f
+        self.name = f.name
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+        self.position = 0
+        self.complete = False
+
+    def read(self, size=-1):
+        chunk = self.file.read(size)
+        if chunk:
+            self.md5.update(chunk)
+            self.sha256.update(chunk)
+            self.position += len(chunk)
+        else:
+            self.complete = True
+        return chunk
+
+    def close(self):
+        self.file.close()
+        # Only a fully streamed file says anything about integrity
+        if self.complete:
+            ok = (self.md5.hexdigest() == self.file_upload.md5_hash
+                  and self.sha256.hexdigest() == self.file_upload.sha256_hash)
+            if not ok or self.file_upload.integrity_ok is not True:
+                record_verification(self.file_upload, ok)
+
+
+def open_for_download(file_upload):
+    """Open the stored file for streaming, verifying it on the way out in stream mode"""
+    f = storage.open_stored(file_upload.file.name)
+    if get_integrity_mode() == 'stream' and file_upload.md5_hash and file_upload.sha256_hash:
+        return VerifyingStream(file_upload, f)
+    return f
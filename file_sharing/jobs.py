@@ -0,0 +1,169 @@
+"""
+Background jobs.
+
+Slow, I/O-bound admin work (re-hashing, integrity verification, cleanup) is
+stored as Job rows and executed by ``manage.py run_workers``, which runs a pool
+of worker processes outside the web tier. Workers claim the oldest queued job
+with a conditional UPDATE, so any number of processes can poll the same table,
+and write their progress to the row while they work.
+"""
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+from .models import Job
+from .storage import hash_stored
+from . import blobs, chunked, integrity
+
+PROGRESS_INTERVAL = 1.0  # Seconds between progress writes
+STALE_AFTER_MINUTES = 30  # Running jobs without a heartbeat for this long are requeued
+CLEANUP_UPLOADS_AFTER_HOURS = 48
+
+
+class Progress:
+    """Callable that records bytes processed on the job row, at most once per PROGRESS_INTERVAL"""
+
+    def __init__(self, job):
+        self.job = job
+        self.last_write = 0
+
+    def set_total(self, total):
+        self.job.progress_total = total
+        Job.objects.filter(pk=self.job.pk).update(progress_total=total, updated_at=timezone.now())
+
+    def __call__(self, done):
+        self.job.progress_done = done
+        now = time.monotonic()
+        if now - self.last_write >= PROGRESS_INTERVAL:
+            self.last_write = now
+            Job.objects.filter(pk=self.job.pk).update(progress_done=done, updated_at=timezone.now())
+
+
+def _verify_integrity(job, progress):
+    file_upload = job.file_upload
+    if not file_upload.md5_hash or not file_upload.sha256_hash:
+        return 'No hash'
+    progress.set_total(file_upload.file_size)
+    return 'Verified' if integrity.verify_and_record(file_upload, progress=progress) else 'Corrupted'
+
+
+def _recalculate_hashes(job, progress):
+    file_upload = job.file_upload
+    progress.set_total(file_upload.file_size)
+    md5_hash, sha256_hash = hash_stored(file_upload.file.name, progress=progress)
+    if file_upload.blob_id and sha256_hash != file_upload.blob.sha256_hash:
+        # Stored contents are named by their hash; changed bytes are corruption, not new hashes
+        integrity.record_verification(file_upload, False)
+        return 'Corrupted: contents no longer match the stored blob'
+    file_upload.set_fresh_hashes(md5_hash, sha256_hash)
+    file_upload.save(update_fields=[
+        'md5_hash', 'sha256_hash', 'integrity_ok', 'last_verified_at', 'verified_mtime', 'verified_size'
+    ])
+    return 'Hashes updated'
+
+
+def _collect_blobs(job, progress):
+    recounted, deleted_blobs, deleted_files = blobs.collect()
+    return f'{recounted} counts fixed, {deleted_blobs} blobs and {deleted_files} orphaned files deleted'
+
+
+def _cleanup_uploads(job, progress):
+    abandoned, completed = chunked.cleanup_sessions(CLEANUP_UPLOADS_AFTER_HOURS)
+    return f'Removed {abandoned} abandoned and {completed} completed upload sessions'
+
+
+JOB_HANDLERS = {
+    Job.KIND_VERIFY_INTEGRITY: _verify_integrity,
+    Job.KIND_RECALCULATE_HASHES: _recalculate_hashes,
+    Job.KIND_COLLECT_BLOBS: _collect_blobs,
+    Job.KIND_CLEANUP_UPLOADS: _cleanup_uploads,
+}
+
+
+def enqueue(kind, file_upload=None):
+    """Queue a single job"""
+    return Job.objects.create(kind=kind, file_upload=file_upload)
+
+
+def enqueue_for_files(kind, queryset):
+    """Queue one job per file in one batch; returns (batch, count)"""
+    first = Job(kind=kind)
+    jobs = [
+        Job(kind=kind, file_upload_id=pk, batch=first.batch, progress_total=size)
+        for pk, size in queryset.values_list('pk', 'file_size')
+    ]
+    Job.objects.bulk_create(jobs, batch_size=500)
+    return first.batch, len(jobs)
+
+
+def claim(worker):
+    """Mark the oldest queued job as running for this worker and return it, or None"""
+    while True:
+        job_id = Job.objects.filter(status=Job.STATUS_QUEUED).order_by('id').values_list('id', flat=True).first()
+        if job_id is None:
+            return None
+        claimed = Job.objects.filter(pk=job_id, status=Job.STATUS_QUEUED).update(
+            status=Job.STATUS_RUNNING, worker=worker, started_at=timezone.now(), updated_at=timezone.now(),
+            attempts=F('attempts') + 1
+        )
+        # Another worker may have taken it between the two queries
+        if claimed:
+            return Job.objects.select_related('file_upload').get(pk=job_id)
+
+
+def run(job):
+    """Run a claimed job and record its outcome"""
+    try:
+        result = JOB_HANDLERS[job.kind](job, Progress(job))
+    except Exception:
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.STATUS_FAILED, error=traceback.format_exc(), finished_at=timezone.now(), updated_at=timezone.now()
+        )
+        return False
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.STATUS_DONE, result=result or '', error='', progress_done=F('progress_total'),
+        finished_at=timezone.now(), updated_at=timezone.now()
+    )
+    return True
+
+
+def requeue_stale(minutes=STALE_AFTER_MINUTES):
+    """Put back running jobs whose worker stopped reporting (crashed or killed)"""
+    cutoff = timezone.now() - timedelta(minutes=minutes)
+    return Job.objects.filter(status=Job.STATUS_RUNNING, updated_at__lt=cutoff).update(
+        status=Job.STATUS_QUEUED, worker='', progress_done=0
+    )
+
+
+def retry(queryset):
+    """Queue failed jobs again"""
+    return queryset.filter(status=Job.STATUS_FAILED).update(
+        status=Job.STATUS_QUEUED, error='', result='', progress_done=0, worker='', finished_at=None
+    )
+
+
+def work(burst=False, poll_interval=1.0):
+    """Worker process loop: claim and run jobs until interrupted (or the queue is empty with burst)"""
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    job = None
+    try:
+        while True:
+            close_old_connections()
+            job = claim(worker)
+            if job is None:
+                if burst:
+                    return
+                time.sleep(poll_interval)
+                continue
+            run(job)
+            job = None
+    except KeyboardInterrupt:
+        if job is not None:
+            # Interrupted mid-job: let another worker start it again
+            Job.objects.filter(pk=job.pk, status=Job.STATUS_RUNNING).update(
+                status=Job.STATUS_QUEUED, worker='', progress_done=0
+            )
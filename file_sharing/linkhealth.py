@@ -0,0 +1,126 @@
+"""
+Short-link target health.
+
+Short links pointing at this server's /download/ URLs are resolved with a
+direct database lookup. External targets are probed in the background by
+``manage.py check_links`` (pooled HTTP connections, several at a time) and the
+result is stored on the ShortLink, so resolving a short link never makes an
+outbound HTTP request.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlparse
+import requests
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .models import FileUpload, ShortLink
+from . import routecache
+
+DOWNLOAD_PATH_RE = re.compile(r'^/download/([0-9a-fA-F-]{36})/')
+CHECK_TIMEOUT = 5
+
+
+def download_target(target_url):
+    """(hostname, unique_id) of a URL with a /download/<uuid>/ path on any host, or (None, None)"""
+    parsed = urlparse(target_url)
+    match = DOWNLOAD_PATH_RE.match(parsed.path)
+    if not match:
+        return None, None
+    return parsed.hostname, match.group(1)
+
+
+def local_file_id(target_url, extra_hosts=()):
+    """Return the FileUpload unique_id a URL points at on this server, or None"""
+    hostname, unique_id = download_target(target_url)
+    hosts = set(settings.ALLOWED_HOSTS) | set(extra_hosts)
+    if hostname and hostname not in hosts and '*' not in hosts:
+        return None
+    return unique_id
+
+
+def local_file_exists(unique_id):
+    return FileUpload.objects.filter(unique_id=unique_id, is_active=True).exists()
+
+
+def attach_file(short_link, extra_hosts=()):
+    """Point a new short link at the FileUpload its target URL downloads, if any"""
+    unique_id = local_file_id(short_link.target_url, extra_hosts)
+    if unique_id:
+        short_link.file_upload = FileUpload.objects.filter(unique_id=unique_id).first()
+    return short_link
+
+
+def is_available(short_link, request_host=None):
+    """Decide from stored state alone whether a short link's target can be served"""
+    if short_link.file_upload_id:
+        return short_link.file_upload.is_active
+    unique_id = local_file_id(short_link.target_url, [request_host] if request_host else [])
+    if unique_id:
+        # A download URL with no linked upload: the file was never here
+        return local_file_exists(unique_id)
+    return short_link.status != ShortLink.STATUS_BROKEN
+
+
+def probe(session, url):
+    """Return (ok, status_code) for an external URL"""
+    try:
+        response = session.head(url, allow_redirects=True, timeout=CHECK_TIMEOUT)
+        if response.status_code in (405, 501):
+            # Some servers refuse HEAD; fetch headers only with a streamed GET
+            response = session.get(url, allow_redirects=True, timeout=CHECK_TIMEOUT, stream=True)
+            response.close()
+        return response.status_code < 400, response.status_code
+    except requests.RequestException:
+        return False, None
+
+
+def links_due(max_age_minutes):
+    """Short links never checked or last checked more than max_age_minutes ago"""
+    cutoff = timezone.now() - timedelta(minutes=max_age_minutes)
+    return ShortLink.objects.filter(
+        Q(last_checked_at__isnull=True) | Q(last_checked_at__lt=cutoff)
+    ).select_related('file_upload')
+
+
+def check_links(links, workers=8):
+    """Check a batch of short links and store the results; returns (ok, broken) counts"""
+    links = list(links)
+    threshold = getattr(settings, 'LINK_CHECK_FAILURE_THRESHOLD', 2)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def check(link):
+        if link.file_upload_id:
+            return link, link.file_upload.is_active, None, True
+        unique_id = local_file_id(link.target_url)
+        if unique_id:
+            return link, local_file_exists(unique_id), None, True
+        ok, status_code = probe(session, link.target_url)
+        return link, ok, status_code, False
+
+    now = timezone.now()
+    ok_count = broken_count = 0
+    with session, ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(check, links))
+    for link, ok, status_code, definitive in results:
+        link.last_checked_at = now
+        link.status_code = status_code
+        link.failure_count = 0 if ok else link.failure_count + 1
+        # A single failed probe may be a network blip; only repeated failures break a link
+        if ok:
+            link.status = ShortLink.STATUS_OK
+            ok_count += 1
+        elif definitive or link.failure_count >= threshold or status_code in (404, 410):
+            link.status = ShortLink.STATUS_BROKEN
+            broken_count += 1
+    ShortLink.objects.bulk_update(
+        [result[0] for result in results], ['status', 'status_code', 'last_checked_at', 'failure_count']
+    )
+    # bulk_update sends no signals; drop cached routes whose availability may have changed
+    for result in results:
+        routecache.invalidate_code(result[0].code)
+    return ok_count, broken_count
@@ -0,0 +1,37 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from file_sharing import linkhealth
+
+
+class Command(BaseCommand):
+    help = 'Probe short-link targets and store their health, so resolving links needs no HTTP request'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age', type=int, default=None,
+            help='Re-check links last checked this many minutes ago (default: LINK_CHECK_INTERVAL_MINUTES)',
+        )
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent probes (default: 8)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Links checked per batch (default: 500)')
+        parser.add_argument('--loop', action='store_true', help='Keep running, checking links as they fall due')
+
+    def handle(self, *args, **options):
+        max_age = options['max_age']
+        if max_age is None:
+            max_age = getattr(settings, 'LINK_CHECK_INTERVAL_MINUTES', 60)
+
+        while True:
+            ok_total = broken_total = 0
+            while True:
+                batch = list(linkhealth.links_due(max_age).order_by('last_checked_at')[:options['batch_size']])
+                if not batch:
+                    break
+                ok_count, broken_count = linkhealth.check_links(batch, options['workers'])
+                ok_total += ok_count
+                broken_total += broken_count
+            if ok_total or broken_total:
+                self.stdout.write(self.style.SUCCESS(f'Checked links: {ok_total} ok, {broken_total} broken.'))
+            if not options['loop']:
+                break
+            time.sleep(60)
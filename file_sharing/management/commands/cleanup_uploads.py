@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from file_sharing import chunked
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked upload sessions (and their partial files) that stopped receiving chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=48, help='Idle time in hours (default: 48)')
+
+    def handle(self, *args, **options):
+        count, completed = chunked.cleanup_sessions(options['older_than'])
+        self.stdout.write(self.style.SUCCESS(f'Removed {count} abandoned and {completed} completed upload sessions.'))
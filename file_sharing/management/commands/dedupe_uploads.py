@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from file_sharing.models import FileUpload
+from file_sharing import blobs
+
+
+class Command(BaseCommand):
+    help = 'Move files saved before deduplication into the content-addressed blob store'
+
+    def handle(self, *args, **options):
+        moved = skipped = 0
+        # Rows are updated as they move, so an interrupted run resumes where it stopped
+        for file_obj in FileUpload.objects.filter(blob__isnull=True).exclude(file='').iterator():
+            if blobs.adopt_upload(file_obj):
+                moved += 1
+            else:
+                skipped += 1
+                self.stderr.write(f'Skipped (missing or corrupted): {file_obj.filename} ({file_obj.unique_id})')
+
+        self.stdout.write(self.style.SUCCESS(f'Deduplication complete: {moved} files moved, {skipped} skipped.'))
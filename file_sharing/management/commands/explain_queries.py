@@ -0,0 +1,78 @@
+import re
+from datetime import datetime, timezone
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from file_sharing.models import Blob, FileUpload, ShortLink, UploadSession
+from file_sharing import linkhealth
+
+# Plan lines that mean every row of a table is read
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (\w+)\b(?! USING)'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+# Sorting is only a problem when the rows were not first narrowed by an index lookup
+SORT_PATTERNS = {
+    'sqlite': re.compile(r'USE TEMP B-TREE FOR ORDER BY'),
+    'postgresql': re.compile(r'\bSort\b'),
+}
+INDEX_LOOKUP_PATTERNS = {
+    'sqlite': re.compile(r'\bSEARCH\b'),
+    'postgresql': re.compile(r'Index Cond'),
+}
+
+def audited_queries():
+    """The app's hot queries, as the views and admin issue them"""
+    some_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    active = FileUpload.objects.filter(is_active=True)
+    return [
+        ('home: recent files', active.order_by('-uploaded_at')[:10]),
+        ('file_list: page', active.order_by('-uploaded_at', '-id')[20:40]),
+        ('api_file_list: first page', active.order_by('-uploaded_at', '-id')[:100]),
+        ('api_file_list: next page', active.order_by('-uploaded_at', '-id').filter(
+            Q(uploaded_at__lt=some_time) | Q(uploaded_at=some_time, id__lt=1000))[:100]),
+        ('download: by unique_id', FileUpload.objects.filter(unique_id='00000000-0000-0000-0000-000000000000', is_active=True)),
+        ('admin: search by sha256', FileUpload.objects.filter(sha256_hash='0' * 64)),
+        ('admin: search by md5', FileUpload.objects.filter(md5_hash='0' * 32)),
+        ('admin: filter by file type', FileUpload.objects.filter(is_active=True, file_type='application/pdf')),
+        ('precheck: blob by size', Blob.objects.filter(size=1024, uploads__is_active=True)),
+        ('precheck: blob by sha256', Blob.objects.filter(sha256_hash='0' * 64)),
+        ('short link: by code', ShortLink.objects.filter(code='abc')),
+        ('short link: by file', ShortLink.objects.filter(file_upload_id=1)),
+        ('check_links: due', linkhealth.links_due(60)[:500]),
+        ('chunked upload: session', UploadSession.objects.filter(upload_id='abc')),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Run EXPLAIN over the app's main queries and flag full table scans and sorts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every query plan')
+        parser.add_argument('--fail-on-scan', action='store_true', help='Exit with an error if any query scans a table')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in FULL_SCAN_PATTERNS:
+            raise CommandError(f'Plan checks are not implemented for {vendor}')
+        if vendor == 'postgresql':
+            # Small development tables make sequential scans look cheapest
+            self.stdout.write('Note: PostgreSQL picks plans from table statistics; audit a database with real data.')
+
+        problems = 0
+        for name, queryset in audited_queries():
+            plan = queryset.explain()
+            scans = FULL_SCAN_PATTERNS[vendor].findall(plan)
+            sorts = SORT_PATTERNS[vendor].search(plan) and not INDEX_LOOKUP_PATTERNS[vendor].search(plan)
+            if scans or sorts:
+                problems += 1
+                issues = [f'full scan of {table}' for table in scans] + (['sort without index'] if sorts else [])
+                self.stdout.write(self.style.WARNING(f'{name}: {", ".join(issues)}'))
+            else:
+                self.stdout.write(f'{name}: ok')
+            if options['verbose_plans'] or scans or sorts:
+                self.stdout.write('    ' + plan.replace('\n', '\n    '))
+
+        if problems and options['fail_on_scan']:
+            raise CommandError(f'{problems} queries scan or sort without an index.')
+        self.stdout.write(self.style.SUCCESS(f'Query plan audit complete: {problems} queries need attention.'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from file_sharing import blobs
+
+
+class Command(BaseCommand):
+    help = 'Recount blob references and delete unreferenced or orphaned blob files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=24,
+            help='Only recount or delete blobs and orphaned files older than this many hours (default: 24)',
+        )
+
+    def handle(self, *args, **options):
+        recounted, deleted_blobs, deleted_files = blobs.collect(options['min_age'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Blob collection complete: {recounted} reference counts fixed, '
+            f'{deleted_blobs} unreferenced blobs and {deleted_files} orphaned files deleted.'
+        ))
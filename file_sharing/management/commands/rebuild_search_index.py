@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from file_sharing import search
+
+
+class Command(BaseCommand):
+    help = 'Create or repair the database search index (SQLite FTS5 trigram table or pg_trgm indexes)'
+
+    def handle(self, *args, **options):
+        if search.install_search_index(connection):
+            search.invalidate()
+            self.stdout.write(self.style.SUCCESS(f'Search index ready for {connection.vendor}.'))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'{connection.vendor} has no supported search index; the in-process n-gram index will be used.'
+            ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from file_sharing import stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the StorageStats/FileTypeStats rollup from the FileUpload table'
+
+    def handle(self, *args, **options):
+        result = stats.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Statistics rebuilt: {result.total_files} files ({result.active_files} active), '
+            f'{result.total_downloads} downloads, {result.total_size} bytes.'
+        ))
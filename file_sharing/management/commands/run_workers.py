@@ -0,0 +1,41 @@
+import multiprocessing
+import os
+from django.core.management.base import BaseCommand
+from django.db import connections
+from file_sharing import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs queued by the admin in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help='Number of worker processes (default: one per CPU)',
+        )
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between queue polls when idle')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} jobs left running by a stopped worker.')
+
+        # Each worker opens its own database connection after the fork
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=jobs.work, args=(options['burst'], options['poll_interval']))
+            for _ in range(max(1, options['processes']))
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(self.style.SUCCESS(f'Started {len(processes)} workers.'))
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            # Workers got the same SIGINT and requeue the job they were running
+            for process in processes:
+                process.join()
+        self.stdout.write(self.style.SUCCESS('Workers stopped.'))
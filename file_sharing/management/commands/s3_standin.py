@@ -0,0 +1,283 @@
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+from django.core.management.base import BaseCommand
+from file_sharing import s3
+
+COPY_BLOCK_SIZE = 1024 * 1024
+AUTHORIZATION_RE = re.compile(r'Credential=([^/]+)/(\d{8})/([^/]+)/s3/aws4_request, *SignedHeaders=([^,]+), *Signature=(\w+)')
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """Serves the subset of the S3 API used by S3Storage from a directory"""
+    protocol_version = 'HTTP/1.1'
+
+    # Request plumbing
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def handle_method(self):
+        split = urlsplit(self.path)
+        self.query = dict(parse_qsl(split.query, keep_blank_values=True))
+        path = unquote(split.path)
+        bucket, _, self.key = path.lstrip('/').partition('/')
+        try:
+            if not self.authorized(path):
+                return self.error(403, 'SignatureDoesNotMatch', 'The request signature does not match')
+            if bucket != self.server.bucket:
+                return self.error(404, 'NoSuchBucket', 'The bucket does not exist')
+            if '..' in self.key.split('/'):
+                return self.error(400, 'InvalidArgument', 'Invalid key')
+            getattr(self, f'do_object_{self.command}' if self.key else f'do_bucket_{self.command}')()
+        except FileNotFoundError:
+            self.error(404, 'NoSuchKey', 'The specified key does not exist')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = handle_method
+
+    def authorized(self, path):
+        """Check a SigV4 Authorization header or presigned query string"""
+        signature_query = {key: value for key, value in self.query.items() if key != 'X-Amz-Signature'}
+        header = self.headers.get('Authorization')
+        if header:
+            match = AUTHORIZATION_RE.search(header)
+            if not match:
+                return False
+            access_key, _, region, signed_headers, expected = match.groups()
+            amz_date = self.headers.get('x-amz-date', '')
+            payload_hash = self.headers.get('x-amz-content-sha256', s3.UNSIGNED_PAYLOAD)
+            query = self.query
+        elif 'X-Amz-Signature' in self.query:
+            credential = self.query.get('X-Amz-Credential', '').split('/')
+            if len(credential) != 5:
+                return False
+            access_key, region = credential[0], credential[2]
+            signed_headers = self.query.get('X-Amz-SignedHeaders', '')
+            expected = self.query['X-Amz-Signature']
+            amz_date = self.query.get('X-Amz-Date', '')
+            payload_hash = s3.UNSIGNED_PAYLOAD
+            query = signature_query
+        else:
+            return False
+        if access_key != self.server.access_key:
+            return False
+        names = signed_headers.split(';')
+        headers = {name: self.headers.get(name, '') for name in names}
+        canonical = s3.canonical_request(self.command, path, query, headers, names, payload_hash)
+        return s3.signature(self.server.secret_key, amz_date, region, canonical) == expected
+
+    def file_path(self, key=None):
+        return os.path.join(self.server.root, *(key or self.key).split('/'))
+
+    def send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def error(self, status, code, message):
+        self.send(status, (
+            f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code>'
+            f'<Message>{escape(message)}</Message></Error>'
+        ).encode(), {'Content-Type': 'application/xml'})
+
+    def xml(self, body):
+        self.send(200, ('<?xml version="1.0" encoding="UTF-8"?>' + body).encode(), {'Content-Type': 'application/xml'})
+
+    def receive(self, path):
+        """Write the request body to path through a temporary file; returns its quoted md5 ETag"""
+        remaining = int(self.headers.get('Content-Length', 0))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        md5_hash = hashlib.md5()
+        with open(temp_path, 'wb') as f:
+            while remaining:
+                data = self.rfile.read(min(remaining, COPY_BLOCK_SIZE))
+                if not data:
+                    raise ConnectionResetError('Client sent a short body')
+                md5_hash.update(data)
+                f.write(data)
+                remaining -= len(data)
+        os.replace(temp_path, path)
+        return f'"{md5_hash.hexdigest()}"'
+
+    # Bucket requests
+
+    def do_bucket_PUT(self):
+        self.send(200)
+
+    def do_bucket_HEAD(self):
+        self.send(200)
+
+    def do_bucket_GET(self):
+        """ListObjectsV2"""
+        prefix = self.query.get('prefix', '')
+        delimiter = self.query.get('delimiter', '')
+        keys, prefixes = [], set()
+        for directory, dirnames, filenames in os.walk(self.server.root):
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            relative = os.path.relpath(directory, self.server.root).replace(os.sep, '/')
+            for filename in filenames:
+                key = filename if relative == '.' else f'{relative}/{filename}'
+                if not key.startswith(prefix):
+                    continue
+                rest = key[len(prefix):]
+                if delimiter and delimiter in rest:
+                    prefixes.add(prefix + rest.split(delimiter, 1)[0] + delimiter)
+                else:
+                    keys.append(key)
+        entries = sorted([(key, False) for key in keys] + [(common, True) for common in prefixes])
+        start = self.query.get('continuation-token', '')
+        entries = [entry for entry in entries if entry[0] > start]
+        limit = int(self.query.get('max-keys', 1000))
+        page, truncated = entries[:limit], len(entries) > limit
+        body = [f'<ListBucketResult><Name>{self.server.bucket}</Name><Prefix>{escape(prefix)}</Prefix>'
+                f'<KeyCount>{len(page)}</KeyCount><IsTruncated>{str(truncated).lower()}</IsTruncated>']
+        if truncated:
+            body.append(f'<NextContinuationToken>{escape(page[-1][0])}</NextContinuationToken>')
+        for key, is_prefix in page:
+            if is_prefix:
+                body.append(f'<CommonPrefixes><Prefix>{escape(key)}</Prefix></CommonPrefixes>')
+            else:
+                size = os.path.getsize(self.file_path(key))
+                body.append(f'<Contents><Key>{escape(key)}</Key><Size>{size}</Size></Contents>')
+        self.xml(''.join(body) + '</ListBucketResult>')
+
+    # Object requests
+
+    def do_object_PUT(self):
+        if 'uploadId' in self.query:
+            path = os.path.join(self.upload_dir(), self.query['partNumber'])
+            return self.send(200, headers={'ETag': self.receive(path)})
+        self.send(200, headers={'ETag': self.receive(self.file_path())})
+
+    def do_object_HEAD(self):
+        self.do_object_GET()
+
+    def do_object_GET(self):
+        path = self.file_path()
+        st = os.stat(path)
+        start, end = 0, st.st_size - 1
+        status = 200
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        if match and match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            status = 206
+            if start >= st.st_size:
+                return self.error(416, 'InvalidRange', 'The requested range is not satisfiable')
+        headers = {
+            'Content-Type': self.query.get('response-content-type', 'application/octet-stream'),
+            'Last-Modified': formatdate(st.st_mtime, usegmt=True),
+            'Accept-Ranges': 'bytes',
+        }
+        if 'response-content-disposition' in self.query:
+            headers['Content-Disposition'] = self.query['response-content-disposition']
+        if status == 206:
+            headers['Content-Range'] = f'bytes {start}-{end}/{st.st_size}'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                data = f.read(min(remaining, COPY_BLOCK_SIZE))
+                if not data:
+                    break
+                self.wfile.write(data)
+                remaining -= len(data)
+
+    def do_object_DELETE(self):
+        if 'uploadId' in self.query:
+            shutil.rmtree(self.upload_dir(), ignore_errors=True)
+        else:
+            try:
+                os.remove(self.file_path())
+            except FileNotFoundError:
+                pass
+        self.send(204)
+
+    def do_object_POST(self):
+        if 'uploads' in self.query:
+            upload_id = uuid.uuid4().hex
+            os.makedirs(self.upload_dir(upload_id))
+            return self.xml(
+                f'<InitiateMultipartUploadResult><Bucket>{self.server.bucket}</Bucket><Key>{escape(self.key)}</Key>'
+                f'<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>'
+            )
+        if 'uploadId' in self.query:
+            return self.complete_upload()
+        self.error(400, 'InvalidRequest', 'Unsupported POST')
+
+    def upload_dir(self, upload_id=None):
+        return os.path.join(self.server.root, '.multipart', upload_id or self.query['uploadId'])
+
+    def complete_upload(self):
+        upload_dir = self.upload_dir()
+        root = ElementTree.fromstring(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        numbers = [element.text for element in root.iter() if element.tag.rsplit('}', 1)[-1] == 'PartNumber']
+        if not os.path.isdir(upload_dir):
+            return self.error(404, 'NoSuchUpload', 'The specified upload does not exist')
+        path = self.file_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'wb') as out:
+            for number in numbers:
+                with open(os.path.join(upload_dir, number), 'rb') as part:
+                    shutil.copyfileobj(part, out, COPY_BLOCK_SIZE)
+        os.replace(temp_path, path)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        self.xml(
+            f'<CompleteMultipartUploadResult><Bucket>{self.server.bucket}</Bucket><Key>{escape(self.key)}</Key>'
+            f'<ETag>"{uuid.uuid4().hex}-{len(numbers)}"</ETag></CompleteMultipartUploadResult>'
+        )
+
+
+class Command(BaseCommand):
+    help = 'Run a local S3-compatible server backed by a directory, for development and tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--addr', default='127.0.0.1:9000', help='Address to listen on (default: 127.0.0.1:9000)')
+        parser.add_argument('--root', default='s3data', help='Directory holding the objects (default: ./s3data)')
+        parser.add_argument('--bucket', default='files', help='Bucket name (default: files)')
+        parser.add_argument('--access-key', default='standin', help='Access key clients sign with')
+        parser.add_argument('--secret-key', default='standin-secret', help='Secret key clients sign with')
+        parser.add_argument('--verbose', action='store_true', help='Log every request')
+
+    def handle(self, *args, **options):
+        host, _, port = options['addr'].rpartition(':')
+        os.makedirs(options['root'], exist_ok=True)
+        server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), StandinHandler)
+        server.daemon_threads = True
+        server.root = os.path.abspath(options['root'])
+        server.bucket = options['bucket']
+        server.access_key = options['access_key']
+        server.secret_key = options['secret_key']
+        server.verbose = options['verbose']
+        self.stdout.write(self.style.SUCCESS(
+            f"Serving bucket '{server.bucket}' from {server.root} on http://{options['addr']}/"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
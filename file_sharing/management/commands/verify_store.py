@@ -0,0 +1,219 @@
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from file_sharing.models import FileUpload
+from file_sharing import storage
+
+RESULT_FIELDS = ['integrity_ok', 'last_verified_at', 'verified_mtime', 'verified_size']
+
+# Set in each worker process by _init_worker
+_io_semaphore = None
+_bytes_hashed = None
+_chunk_size = None
+_use_mmap = False
+
+
+def _init_worker(io_semaphore, bytes_hashed, chunk_size, use_mmap):
+    global _io_semaphore, _bytes_hashed, _chunk_size, _use_mmap
+    _io_semaphore, _bytes_hashed, _chunk_size, _use_mmap = io_semaphore, bytes_hashed, chunk_size, use_mmap
+
+
+def _hash_stored(name):
+    """Worker: return (md5, sha256, (mtime_ns, size), error) for one stored file"""
+    last = [0]
+
+    def progress(done):
+        with _bytes_hashed.get_lock():
+            _bytes_hashed.value += done - last[0]
+        last[0] = done
+
+    try:
+        signature = storage.stat(name)
+        md5_hash, sha256_hash = storage.hash_stored(name, _chunk_size, progress, _use_mmap, _io_semaphore)
+        return md5_hash, sha256_hash, signature, None
+    except OSError as e:
+        return None, None, (None, None), str(e)
+
+
+class Command(BaseCommand):
+    help = 'Re-hash stored files in parallel and record the integrity result on each FileUpload'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age', type=int, default=None,
+            help='Only verify files not verified in this many hours (default: FILE_INTEGRITY_MAX_AGE_HOURS)',
+        )
+        parser.add_argument('--all', action='store_true', help='Verify every file regardless of age')
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Only verify files never verified or whose mtime/size changed since their last verification',
+        )
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help='Hashing processes (default: one per CPU)',
+        )
+        parser.add_argument(
+            '--io-limit', type=int, default=None,
+            help='Maximum processes reading from disk at once (default: no limit)',
+        )
+        parser.add_argument('--buffer-size', type=int, default=8, help='Read size in MB (default: 8)')
+        parser.add_argument('--mmap', action='store_true', help='Map files into memory instead of reading them (local storage)')
+        parser.add_argument('--report', help='Write a JSON report to this path ("-" for stdout)')
+        parser.add_argument('--no-progress', action='store_true', help='Do not draw the progress bar')
+        parser.add_argument('--fail-on-corruption', action='store_true', help='Exit with an error if any file fails')
+
+    def select_files(self, options):
+        files = FileUpload.objects.exclude(md5_hash__isnull=True).exclude(sha256_hash__isnull=True).exclude(file='')
+        if options['all'] or options['incremental']:
+            return files
+        max_age = options['max_age']
+        if max_age is None:
+            max_age = getattr(settings, 'FILE_INTEGRITY_MAX_AGE_HOURS', 24)
+        cutoff = timezone.now() - timedelta(hours=max_age)
+        return files.filter(Q(last_verified_at__isnull=True) | Q(last_verified_at__lt=cutoff))
+
+    def handle(self, *args, **options):
+        started_at = timezone.now()
+        start = time.monotonic()
+        fields = ['pk', 'filename', 'unique_id', 'file', 'md5_hash', 'sha256_hash'] + RESULT_FIELDS
+        # Deduplicated uploads share a blob: hash each stored file once
+        uploads_by_name = {}
+        sizes = {}
+        unchanged = 0
+        for file_obj in self.select_files(options).only(*fields).iterator():
+            name = file_obj.file.name
+            if name not in sizes:
+                try:
+                    signature = storage.stat(name)
+                except OSError:
+                    signature = None
+                sizes[name] = signature
+            signature = sizes[name]
+            if (options['incremental'] and file_obj.integrity_ok is not None and file_obj.verified_mtime is not None
+                    and signature == (file_obj.verified_mtime, file_obj.verified_size)):
+                unchanged += 1
+                continue
+            uploads_by_name.setdefault(name, []).append(file_obj)
+        total_bytes = sum(sizes[name][1] for name in uploads_by_name if sizes[name])
+
+        counts = {'verified': 0, 'corrupted': 0, 'missing': 0}
+        problems = []
+        show_progress = not options['no_progress'] and sys.stderr.isatty()
+        processes = max(1, options['processes'])
+        context = multiprocessing.get_context('fork')
+        io_semaphore = context.Semaphore(options['io_limit']) if options['io_limit'] else None
+        bytes_hashed = context.Value('q', 0)
+        pending_updates = []
+
+        # Workers do not touch the database; only this process records results
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=processes, mp_context=context, initializer=_init_worker,
+            initargs=(io_semaphore, bytes_hashed, options['buffer_size'] * 1024 * 1024, options['mmap']),
+        ) as executor:
+            names = iter(list(uploads_by_name))
+            in_flight = {}
+            done_files = 0
+            while True:
+                # Keep a bounded window of work queued so huge stores do not build huge queues
+                while len(in_flight) < processes * 2:
+                    name = next(names, None)
+                    if name is None:
+                        break
+                    in_flight[executor.submit(_hash_stored, name)] = name
+                if not in_flight:
+                    break
+                finished, _ = wait(in_flight, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = in_flight.pop(future)
+                    done_files += 1
+                    self.record(uploads_by_name.pop(name), future.result(), counts, problems, pending_updates)
+                if len(pending_updates) >= 500:
+                    FileUpload.objects.bulk_update(pending_updates, RESULT_FIELDS)
+                    pending_updates = []
+                if show_progress:
+                    self.draw_progress(bytes_hashed.value, total_bytes, done_files, start)
+        if pending_updates:
+            FileUpload.objects.bulk_update(pending_updates, RESULT_FIELDS)
+        if show_progress:
+            self.stderr.write('')
+
+        elapsed = time.monotonic() - start
+        if options['report']:
+            self.write_report(options, {
+                'started_at': started_at.isoformat(),
+                'finished_at': timezone.now().isoformat(),
+                'duration_seconds': round(elapsed, 3),
+                'mode': 'all' if options['all'] else 'incremental' if options['incremental'] else 'max-age',
+                'processes': processes,
+                'files_checked': sum(counts.values()),
+                'files_unchanged': unchanged,
+                'bytes_hashed': bytes_hashed.value,
+                'throughput_bytes_per_second': round(bytes_hashed.value / elapsed) if elapsed else None,
+                **counts,
+                'problems': problems,
+            })
+
+        for problem in problems:
+            self.stderr.write(f"{problem['status'].capitalize()}: {problem['filename']} ({problem['unique_id']})")
+        # With the report on stdout, keep the summary out of the machine-readable output
+        out = self.stderr if options['report'] == '-' else self.stdout
+        out.write(self.style.SUCCESS(
+            f"Integrity check complete: {counts['verified']} files verified, {counts['corrupted']} files corrupted, "
+            f"{counts['missing']} missing, {unchanged} unchanged since last verification."
+        ))
+        if options['fail_on_corruption'] and problems:
+            raise CommandError(f'{len(problems)} files failed verification.')
+
+    def record(self, uploads, result, counts, problems, pending_updates):
+        md5_hash, sha256_hash, (mtime, size), error = result
+        now = timezone.now()
+        for file_obj in uploads:
+            ok = error is None and md5_hash == file_obj.md5_hash and sha256_hash == file_obj.sha256_hash
+            file_obj.integrity_ok = ok
+            file_obj.last_verified_at = now
+            file_obj.verified_mtime, file_obj.verified_size = mtime, size
+            pending_updates.append(file_obj)
+            if ok:
+                counts['verified'] += 1
+                continue
+            status = 'missing' if error else 'corrupted'
+            counts[status] += 1
+            problems.append({
+                'unique_id': str(file_obj.unique_id),
+                'filename': file_obj.filename,
+                'path': file_obj.file.name,
+                'status': status,
+                'expected_sha256': file_obj.sha256_hash,
+                'actual_sha256': sha256_hash,
+                'error': error,
+            })
+
+    def draw_progress(self, done, total, files_done, start, width=30):
+        fraction = min(1, done / total) if total else 1
+        elapsed = time.monotonic() - start
+        rate = done / elapsed if elapsed else 0
+        bar = '#' * int(width * fraction) + '.' * (width - int(width * fraction))
+        self.stderr.write(
+            f'\r[{bar}] {fraction:6.1%}  {done / 1024 ** 2:,.0f}/{total / 1024 ** 2:,.0f} MB  '
+            f'{rate / 1024 ** 2:,.1f} MB/s  {files_done} files',
+            ending='',
+        )
+        self.stderr.flush()
+
+    def write_report(self, options, report):
+        data = json.dumps(report, indent=2)
+        if options['report'] == '-':
+            self.stdout.write(data)
+        else:
+            with open(options['report'], 'w') as f:
+                f.write(data + '\n')
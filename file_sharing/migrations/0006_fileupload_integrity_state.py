@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0005_remove_fileupload_owner_remove_shortlink_created_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='integrity_ok',
+            field=models.BooleanField(blank=True, help_text='Result of the last integrity verification', null=True),
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='last_verified_at',
+            field=models.DateTimeField(blank=True, help_text='When the stored file was last hashed and compared', null=True),
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='verified_mtime',
+            field=models.BigIntegerField(blank=True, help_text='File mtime (ns) at last verification', null=True),
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='verified_size',
+            field=models.BigIntegerField(blank=True, help_text='File size on disk at last verification', null=True),
+        ),
+    ]
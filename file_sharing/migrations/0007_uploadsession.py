@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0006_fileupload_integrity_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('upload_id', models.CharField(help_text='Client-generated upload identifier', max_length=100, unique=True)),
+                ('filename', models.CharField(max_length=255)),
+                ('file_size', models.BigIntegerField()),
+                ('file_type', models.CharField(max_length=100)),
+                ('chunk_size', models.IntegerField()),
+                ('total_chunks', models.IntegerField()),
+                ('received_chunks', models.BinaryField(help_text='Bitmap of received chunks')),
+                ('received_count', models.IntegerField(default=0)),
+                ('bytes_received', models.BigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('assembling', 'Assembling'), ('complete', 'Complete')], default='active', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('file_upload', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='file_sharing.fileupload')),
+            ],
+        ),
+    ]
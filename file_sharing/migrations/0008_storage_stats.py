@@ -0,0 +1,61 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:10
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def build_stats(apps, schema_editor):
+    FileUpload = apps.get_model('file_sharing', 'FileUpload')
+    StorageStats = apps.get_model('file_sharing', 'StorageStats')
+    FileTypeStats = apps.get_model('file_sharing', 'FileTypeStats')
+    everything = FileUpload.objects.aggregate(count=Count('id'), size=Sum('file_size'), downloads=Sum('download_count'))
+    active = FileUpload.objects.filter(is_active=True).aggregate(count=Count('id'), size=Sum('file_size'), downloads=Sum('download_count'))
+    StorageStats.objects.create(
+        pk=1,
+        total_files=everything['count'],
+        total_size=everything['size'] or 0,
+        total_downloads=everything['downloads'] or 0,
+        active_files=active['count'],
+        active_size=active['size'] or 0,
+        active_downloads=active['downloads'] or 0,
+    )
+    FileTypeStats.objects.bulk_create([
+        FileTypeStats(file_type=row['file_type'], active_count=row['n'])
+        for row in FileUpload.objects.filter(is_active=True).values('file_type').annotate(n=Count('id'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0007_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileTypeStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_type', models.CharField(max_length=100, unique=True)),
+                ('active_count', models.BigIntegerField(db_index=True, default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StorageStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_files', models.BigIntegerField(default=0)),
+                ('active_files', models.BigIntegerField(default=0)),
+                ('total_size', models.BigIntegerField(default=0)),
+                ('active_size', models.BigIntegerField(default=0)),
+                ('total_downloads', models.BigIntegerField(default=0)),
+                ('active_downloads', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Storage Statistics',
+                'verbose_name_plural': 'Storage Statistics',
+            },
+        ),
+        migrations.RunPython(build_stats, migrations.RunPython.noop),
+    ]
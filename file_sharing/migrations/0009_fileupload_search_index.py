@@ -0,0 +1,77 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:40
+
+import logging
+from django.db import migrations, transaction
+
+logger = logging.getLogger(__name__)
+
+# Frozen copies of search.SQLITE_FTS_SQL and search.POSTGRES_TRGM_SQL as of this migration
+FTS_TABLE = 'file_sharing_fileupload_fts'
+
+SQLITE_FTS_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        filename, file_type, content='file_sharing_fileupload', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON file_sharing_fileupload BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, filename, file_type) VALUES (new.id, new.filename, new.file_type);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON file_sharing_fileupload BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, filename, file_type) VALUES ('delete', old.id, old.filename, old.file_type);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF filename, file_type ON file_sharing_fileupload BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, filename, file_type) VALUES ('delete', old.id, old.filename, old.file_type);
+        INSERT INTO {FTS_TABLE}(rowid, filename, file_type) VALUES (new.id, new.filename, new.file_type);
+    END""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+POSTGRES_TRGM_SQL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS file_sharing_fileupload_filename_trgm '
+    'ON file_sharing_fileupload USING gin (UPPER(filename) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS file_sharing_fileupload_file_type_trgm '
+    'ON file_sharing_fileupload USING gin (UPPER(file_type) gin_trgm_ops)',
+]
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        statements = SQLITE_FTS_SQL
+    elif connection.vendor == 'postgresql':
+        statements = POSTGRES_TRGM_SQL
+    else:
+        return
+    try:
+        # A savepoint: a failed statement must not abort the migration's transaction
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    except Exception as e:
+        # Old SQLite without trigram tokenizer, or no permission to create pg_trgm
+        logger.warning(
+            'Skipped the %s search index (%s); search uses the in-process n-gram index. '
+            'Run `manage.py rebuild_search_index` once it is supported.', connection.vendor, e
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS file_sharing_fileupload_filename_trgm')
+        schema_editor.execute('DROP INDEX IF EXISTS file_sharing_fileupload_file_type_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0008_storage_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
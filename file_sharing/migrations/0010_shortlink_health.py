@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0009_fileupload_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shortlink',
+            name='failure_count',
+            field=models.IntegerField(default=0, help_text='Consecutive failed checks'),
+        ),
+        migrations.AddField(
+            model_name='shortlink',
+            name='last_checked_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='shortlink',
+            name='status',
+            field=models.CharField(choices=[('unknown', 'Unknown'), ('ok', 'OK'), ('broken', 'Broken')], default='unknown', help_text='Target health from the last check', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='shortlink',
+            name='status_code',
+            field=models.IntegerField(blank=True, help_text='HTTP status of the last check', null=True),
+        ),
+    ]
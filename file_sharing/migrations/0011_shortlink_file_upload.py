@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:16
+
+import re
+from urllib.parse import urlparse
+import django.db.models.deletion
+from django.db import migrations, models
+
+DOWNLOAD_PATH_RE = re.compile(r'^/download/([0-9a-fA-F-]{36})/')
+
+
+def link_short_links(apps, schema_editor):
+    # The request host is unknown here, so a download path whose UUID belongs
+    # to an upload in this database is taken to be local
+    FileUpload = apps.get_model('file_sharing', 'FileUpload')
+    ShortLink = apps.get_model('file_sharing', 'ShortLink')
+    wanted = {}
+    for link in ShortLink.objects.filter(target_url__contains='/download/').only('id', 'target_url'):
+        match = DOWNLOAD_PATH_RE.match(urlparse(link.target_url).path)
+        if match:
+            wanted.setdefault(match.group(1).lower(), []).append(link.id)
+    for unique_id, file_id in FileUpload.objects.filter(unique_id__in=list(wanted)).values_list('unique_id', 'id'):
+        ShortLink.objects.filter(id__in=wanted[str(unique_id)]).update(file_upload_id=file_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0010_shortlink_health'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shortlink',
+            name='file_upload',
+            field=models.ForeignKey(blank=True, help_text='Local file the target URL downloads, if any', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='short_links', to='file_sharing.fileupload'),
+        ),
+        migrations.RunPython(link_short_links, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0011_shortlink_file_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256_hash', models.CharField(max_length=64, unique=True)),
+                ('md5_hash', models.CharField(max_length=32)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.IntegerField(default=0, help_text='Number of FileUploads using this blob')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='blob',
+            field=models.ForeignKey(blank=True, help_text='Stored contents; empty for files saved before deduplication', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='uploads', to='file_sharing.blob'),
+        ),
+    ]
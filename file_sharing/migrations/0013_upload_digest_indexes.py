@@ -0,0 +1,21 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0012_blob_store'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blob',
+            index=models.Index(fields=['size'], name='file_sharing_blob_size_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fileupload',
+            index=models.Index(fields=['sha256_hash'], name='file_sharing_sha256_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0013_upload_digest_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fileupload',
+            index=models.Index(fields=['md5_hash'], name='file_sharing_md5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fileupload',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-uploaded_at', '-id'], name='file_sharing_active_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fileupload',
+            index=models.Index(fields=['is_active', 'file_type'], name='file_sharing_active_type_idx'),
+        ),
+    ]
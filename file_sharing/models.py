@@ -1,15 +1,40 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 import os
 import uuid
-import hashlib
+from .counters import record_download
+from .storage import hash_stored, stat
 
 def get_file_path(instance, filename):
-    """Generate unique file path for uploaded files"""
+    """upload_to for FileUpload.file. FileUpload.save stores new contents in the blob store
+    (blobs/ab/cd/<sha256>) before the field would use this, so it names no fresh files;
+    `dedupe_uploads` moves files stored here before the blob store into it."""
     ext = filename.split('.')[-1]
     filename = f"{uuid.uuid4()}.{ext}"
     return os.path.join('uploads', filename)
 
+def get_blob_path(sha256_hash):
+    """Content-addressed storage name: blobs/ab/cd/<sha256>"""
+    return os.path.join('blobs', sha256_hash[:2], sha256_hash[2:4], sha256_hash)
+
+class Blob(models.Model):
+    """Stored file contents, shared by every FileUpload with the same SHA256"""
+    sha256_hash = models.CharField(max_length=64, unique=True)
+    md5_hash = models.CharField(max_length=32)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0, help_text="Number of FileUploads using this blob")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['size'], name='file_sharing_blob_size_idx')]
+
+    def __str__(self):
+        return self.sha256_hash
+
+    @property
+    def name(self):
+        return get_blob_path(self.sha256_hash)
+
 class FileUpload(models.Model):
     """Model to store uploaded file information"""
     file = models.FileField(upload_to=get_file_path, max_length=500)
@@ -22,15 +47,87 @@ class FileUpload(models.Model):
     unique_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     md5_hash = models.CharField(max_length=32, blank=True, null=True, help_text="MD5 hash for file integrity")
     sha256_hash = models.CharField(max_length=64, blank=True, null=True, help_text="SHA256 hash for file integrity")
+    last_verified_at = models.DateTimeField(blank=True, null=True, help_text="When the stored file was last hashed and compared")
+    integrity_ok = models.BooleanField(blank=True, null=True, help_text="Result of the last integrity verification")
+    verified_mtime = models.BigIntegerField(blank=True, null=True, help_text="File mtime (ns) at last verification")
+    verified_size = models.BigIntegerField(blank=True, null=True, help_text="File size on disk at last verification")
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, blank=True, null=True, related_name='uploads', help_text="Stored contents; empty for files saved before deduplication")
     
     class Meta:
         ordering = ['-uploaded_at']
+        # Meta indexes rather than db_index so SQLite adds them without remaking the table (and its search triggers)
+        indexes = [
+            models.Index(fields=['sha256_hash'], name='file_sharing_sha256_idx'),
+            models.Index(fields=['md5_hash'], name='file_sharing_md5_idx'),
+            # Every public listing: active files, newest first (keyset pagination uses id as tie-breaker)
+            models.Index(
+                fields=['-uploaded_at', '-id'], name='file_sharing_active_recent_idx', condition=models.Q(is_active=True)
+            ),
+            models.Index(fields=['is_active', 'file_type'], name='file_sharing_active_type_idx'),
+        ]
         verbose_name = 'File Upload'
         verbose_name_plural = 'File Uploads'
     
     def __str__(self):
         return f"{self.filename} ({self.file_size} bytes)"
     
+    def save(self, *args, **kwargs):
+        """Store a pending file in the blob store first so its digests are saved in the same write"""
+        from . import blobs
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # download_count only changes through F() updates; a full save would write back a stale count
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'download_count'
+            ]
+        file = self.file
+        if file and not file._committed:
+            # One transaction, so the new reference and the row pointing at it commit together
+            # and `gc_blobs` never sees a referenced blob without uploads
+            with transaction.atomic():
+                # Known content only gains a reference; new content is written once
+                blob, created = blobs.store(file.file)
+                old = None
+                if self.pk:
+                    old = FileUpload.objects.filter(pk=self.pk).values('blob_id', 'file').first()
+                self.use_blob(blob, fresh=created)
+                super().save(*args, **kwargs)
+            if old:
+                # Drop the reference to the replaced contents
+                blobs.release_on_commit(old['blob_id'], old['file'])
+            return
+        super().save(*args, **kwargs)
+    
+    def use_blob(self, blob, fresh=False):
+        """Point at a stored blob the caller holds a reference to; fresh means its bytes were just written"""
+        self.blob = blob
+        self.file.name = blob.name
+        self.file._committed = True
+        if fresh:
+            self.set_fresh_hashes(blob.md5_hash, blob.sha256_hash)
+            return
+        self.md5_hash, self.sha256_hash = blob.md5_hash, blob.sha256_hash
+        # The blob is the same file on disk, so another upload's verification applies here too
+        verified = (
+            FileUpload.objects.filter(blob=blob, integrity_ok__isnull=False)
+            .order_by('-last_verified_at')
+            .values('last_verified_at', 'integrity_ok', 'verified_mtime', 'verified_size')
+            .first()
+        ) or dict.fromkeys(['last_verified_at', 'integrity_ok', 'verified_mtime', 'verified_size'])
+        for field, value in verified.items():
+            setattr(self, field, value)
+    
+    def set_fresh_hashes(self, md5_hash, sha256_hash):
+        """Store hashes computed from the bytes just written; they count as a verification"""
+        self.md5_hash = md5_hash
+        self.sha256_hash = sha256_hash
+        self.integrity_ok = True if md5_hash and sha256_hash else None
+        self.last_verified_at = timezone.now() if self.integrity_ok else None
+        if self.integrity_ok:
+            self.verified_mtime, self.verified_size = stat(self.file.name)
+        else:
+            self.verified_mtime = self.verified_size = None
+    
     def get_file_size_mb(self):
         """Return file size in MB"""
         return round(self.file_size / (1024 * 1024), 2)
@@ -44,28 +141,16 @@ class FileUpload(models.Model):
         return os.path.splitext(self.filename)[1].lower()
     
     def increment_download_count(self):
-        """Increment download count"""
-        self.download_count += 1
-        self.save(update_fields=['download_count'])
+        """Count a download; written to the database in batches by counters.flush()"""
+        record_download(self.pk)
     
     def calculate_hashes(self):
         """Calculate MD5 and SHA256 hashes for the file"""
         if not self.file:
             return None, None
         
-        md5_hash = hashlib.md5()
-        sha256_hash = hashlib.sha256()
-        
         try:
-            with open(self.file.path, 'rb') as f:
-                while True:
-                    chunk = f.read(8192)  # Read in 8KB chunks
-                    if not chunk:
-                        break
-                    md5_hash.update(chunk)
-                    sha256_hash.update(chunk)
-            
-            return md5_hash.hexdigest(), sha256_hash.hexdigest()
+            return hash_stored(self.file.name)
         except Exception as e:
             print(f"Error calculating hashes: {e}")
             return None, None
@@ -79,9 +164,170 @@ class FileUpload(models.Model):
         return (current_md5 == self.md5_hash and current_sha256 == self.sha256_hash)
 
 class ShortLink(models.Model):
+    STATUS_UNKNOWN = 'unknown'
+    STATUS_OK = 'ok'
+    STATUS_BROKEN = 'broken'
+    STATUS_CHOICES = [
+        (STATUS_UNKNOWN, 'Unknown'),
+        (STATUS_OK, 'OK'),
+        (STATUS_BROKEN, 'Broken'),
+    ]
+
     code = models.CharField(max_length=32, unique=True, help_text="Custom short code, e.g. 'myfile'")
     target_url = models.URLField(help_text='The actual file download or external link')
     created_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_UNKNOWN, help_text="Target health from the last check")
+    status_code = models.IntegerField(blank=True, null=True, help_text="HTTP status of the last check")
+    last_checked_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    failure_count = models.IntegerField(default=0, help_text="Consecutive failed checks")
+    file_upload = models.ForeignKey(
+        FileUpload, on_delete=models.CASCADE, null=True, blank=True, related_name='short_links',
+        help_text="Local file the target URL downloads, if any",
+    )
 
     def __str__(self):
         return self.code
+
+class UploadSession(models.Model):
+    """Resumable chunked upload: which chunks of the partial file have arrived"""
+    STATUS_ACTIVE = 'active'
+    STATUS_ASSEMBLING = 'assembling'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (STATUS_ACTIVE, 'Active'),
+        (STATUS_ASSEMBLING, 'Assembling'),
+        (STATUS_COMPLETE, 'Complete'),
+    ]
+
+    upload_id = models.CharField(max_length=100, unique=True, help_text="Client-generated upload identifier")
+    filename = models.CharField(max_length=255)
+    file_size = models.BigIntegerField()
+    file_type = models.CharField(max_length=100)
+    chunk_size = models.IntegerField()
+    total_chunks = models.IntegerField()
+    received_chunks = models.BinaryField(help_text="Bitmap of received chunks")
+    received_count = models.IntegerField(default=0)
+    bytes_received = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_ACTIVE)
+    file_upload = models.ForeignKey(FileUpload, on_delete=models.SET_NULL, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.received_count}/{self.total_chunks} chunks)"
+
+    def save(self, *args, **kwargs):
+        if not self.received_chunks:
+            self.received_chunks = bytes((self.total_chunks + 7) // 8)
+        super().save(*args, **kwargs)
+
+    def chunk_offset(self, chunk_number):
+        """Byte offset of a chunk in the assembled file"""
+        return chunk_number * self.chunk_size
+
+    def expected_chunk_size(self, chunk_number):
+        """Exact size a chunk must have; only the last one may be short"""
+        return min(self.chunk_size, self.file_size - self.chunk_offset(chunk_number))
+
+    def has_chunk(self, chunk_number):
+        return bool(self.received_chunks[chunk_number // 8] & (1 << (chunk_number % 8)))
+
+    def mark_chunk(self, chunk_number):
+        """Set a chunk's bit; returns False if it was already received"""
+        if self.has_chunk(chunk_number):
+            return False
+        bitmap = bytearray(self.received_chunks)
+        bitmap[chunk_number // 8] |= 1 << (chunk_number % 8)
+        self.received_chunks = bytes(bitmap)
+        self.received_count += 1
+        self.bytes_received += self.expected_chunk_size(chunk_number)
+        return True
+
+    def received_chunk_numbers(self):
+        return [i for i in range(self.total_chunks) if self.has_chunk(i)]
+
+    def is_complete(self):
+        return self.received_count == self.total_chunks
+
+class StorageStats(models.Model):
+    """Single-row rollup of FileUpload totals, maintained incrementally (see stats.py)"""
+    total_files = models.BigIntegerField(default=0)
+    active_files = models.BigIntegerField(default=0)
+    total_size = models.BigIntegerField(default=0)
+    active_size = models.BigIntegerField(default=0)
+    total_downloads = models.BigIntegerField(default=0)
+    active_downloads = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Storage Statistics'
+        verbose_name_plural = 'Storage Statistics'
+
+    def __str__(self):
+        return f"{self.active_files} active files, {self.total_files} total"
+
+    @property
+    def inactive_files(self):
+        return self.total_files - self.active_files
+
+
+class FileTypeStats(models.Model):
+    """Number of active files per content type, maintained with StorageStats"""
+    file_type = models.CharField(max_length=100, unique=True)
+    active_count = models.BigIntegerField(default=0, db_index=True)
+
+    def __str__(self):
+        return f"{self.file_type}: {self.active_count}"
+
+class Job(models.Model):
+    """Background task queued by the admin and run by `manage.py run_workers`"""
+    KIND_VERIFY_INTEGRITY = 'verify_integrity'
+    KIND_RECALCULATE_HASHES = 'recalculate_hashes'
+    KIND_COLLECT_BLOBS = 'collect_blobs'
+    KIND_CLEANUP_UPLOADS = 'cleanup_uploads'
+    KIND_CHOICES = [
+        (KIND_VERIFY_INTEGRITY, 'Verify file integrity'),
+        (KIND_RECALCULATE_HASHES, 'Recalculate file hashes'),
+        (KIND_COLLECT_BLOBS, 'Collect unreferenced blobs'),
+        (KIND_CLEANUP_UPLOADS, 'Clean up abandoned chunked uploads'),
+    ]
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES)
+    file_upload = models.ForeignKey(FileUpload, on_delete=models.CASCADE, blank=True, null=True, related_name='jobs')
+    batch = models.UUIDField(default=uuid.uuid4, db_index=True, help_text="Jobs queued by the same admin action")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    progress_done = models.BigIntegerField(default=0)
+    progress_total = models.BigIntegerField(default=0)
+    result = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, help_text="Doubles as the worker heartbeat while running")
+
+    class Meta:
+        ordering = ['-id']
+        # Workers claim the oldest queued job
+        indexes = [models.Index(fields=['status', 'id'], name='file_sharing_job_status_idx')]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk}"
+
+    def progress_percent(self):
+        if self.status == self.STATUS_DONE:
+            return 100
+        if not self.progress_total:
+            return 0
+        return min(100, round(self.progress_done * 100 / self.progress_total))
@@ -0,0 +1,81 @@
+"""
+Upload progress tracking.
+
+Progress snapshots are written to a Django cache as each chunk lands, so
+progress polling never touches the filesystem and only falls back to a single
+indexed UploadSession lookup when the cache entry is missing. Use a shared
+cache backend (Redis, Memcached) when running several worker processes.
+"""
+import time
+from django.conf import settings
+from django.core.cache import caches
+from .models import UploadSession
+
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _cache():
+    return caches[getattr(settings, 'UPLOAD_PROGRESS_CACHE', 'default')]
+
+
+def _key(upload_id):
+    return f'upload-progress:{upload_id}'
+
+
+def _snapshot(session, started_at, started_bytes, file_id=None):
+    now = time.time()
+    elapsed = now - started_at
+    transferred = session.bytes_received - started_bytes
+    bytes_per_second = round(transferred / elapsed, 1) if elapsed > 0 else 0
+    remaining = session.file_size - session.bytes_received
+    return {
+        'upload_id': session.upload_id,
+        'filename': session.filename,
+        'status': session.status,
+        'file_size': session.file_size,
+        'bytes_received': session.bytes_received,
+        'total_chunks': session.total_chunks,
+        'chunks_received': session.received_count,
+        'progress': round(session.bytes_received / session.file_size * 100, 2) if session.file_size else 100.0,
+        'bytes_per_second': bytes_per_second,
+        'eta_seconds': round(remaining / bytes_per_second, 1) if bytes_per_second > 0 else None,
+        'started_at': started_at,
+        'started_bytes': started_bytes,
+        'updated_at': now,
+        'file_id': file_id,
+    }
+
+
+def record(session, file_id=None):
+    """Store the current progress of an upload session"""
+    previous = _cache().get(_key(session.upload_id))
+    # Parallel chunk requests may report out of order; never move progress backwards
+    if previous and previous['bytes_received'] > session.bytes_received and previous['status'] == session.status:
+        return previous
+    if previous:
+        started_at, started_bytes = previous['started_at'], previous['started_bytes']
+    elif session.received_count <= 1:
+        started_at, started_bytes = session.created_at.timestamp(), 0
+    else:
+        # Throughput of a resumed upload is measured from this process's first sighting
+        started_at, started_bytes = time.time(), session.bytes_received
+    snapshot = _snapshot(session, started_at, started_bytes, file_id)
+    _cache().set(_key(session.upload_id), snapshot, CACHE_TIMEOUT)
+    return snapshot
+
+
+def get(upload_id):
+    """Return the latest progress snapshot for an upload, or None if unknown"""
+    snapshot = _cache().get(_key(upload_id))
+    if snapshot is not None:
+        return snapshot
+    session = UploadSession.objects.filter(upload_id=upload_id).select_related('file_upload').first()
+    if session is None:
+        return None
+    file_id = str(session.file_upload.unique_id) if session.file_upload else None
+    return record(session, file_id)
+
+
+def public(snapshot):
+    """Progress fields exposed to clients"""
+    return {key: value for key, value in snapshot.items() if key not in ('started_at', 'started_bytes')}
@@ -0,0 +1,189 @@
+"""
+Short-code routing cache.
+
+Maps a short code to its resolved target and whether it can be served, so a
+hit on /share/<code>/ needs no database query. Entries are invalidated by
+signals when a ShortLink or the FileUpload it points at changes or is deleted.
+
+By default entries live in a bounded per-process LRU. Signals only reach the
+process that made the change, so other workers may serve a deleted or
+deactivated link until the entry expires: SHORTLINK_LOCAL_CACHE_TTL keeps that
+window to a few seconds. Set SHORTLINK_CACHE to a CACHES alias shared by all
+workers (Redis, Memcached) to invalidate everywhere at once; entries there
+live SHORTLINK_CACHE_TTL seconds. Hit/miss counters are per process.
+"""
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+_lock = threading.Lock()
+_counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+
+def _count(name, n=1):
+    with _lock:
+        _counters[name] += n
+
+
+class LocalRouteCache:
+    """Bounded LRU with per-entry TTL, private to this process"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._codes_by_file = {}
+        self._lock = threading.Lock()
+
+    def get(self, code):
+        with self._lock:
+            item = self._entries.get(code)
+            if item is None:
+                return None
+            entry, expires = item
+            if expires < time.monotonic():
+                self._drop(code)
+                return None
+            self._entries.move_to_end(code)
+            return entry
+
+    def set(self, code, entry):
+        with self._lock:
+            self._drop(code)
+            self._entries[code] = (entry, time.monotonic() + self.ttl)
+            if entry.get('file_id'):
+                self._codes_by_file.setdefault(entry['file_id'], set()).add(code)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                _count('evictions')
+
+    def _drop(self, code):
+        item = self._entries.pop(code, None)
+        if item and item[0].get('file_id'):
+            codes = self._codes_by_file.get(item[0]['file_id'])
+            if codes is not None:
+                codes.discard(code)
+                if not codes:
+                    del self._codes_by_file[item[0]['file_id']]
+
+    def delete(self, code):
+        with self._lock:
+            self._drop(code)
+
+    def delete_file(self, file_id):
+        with self._lock:
+            for code in list(self._codes_by_file.get(file_id, ())):
+                self._drop(code)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._codes_by_file.clear()
+
+    def size(self):
+        return len(self._entries)
+
+
+class SharedRouteCache:
+    """Entries in a Django cache shared by all workers; clear() bumps a generation"""
+
+    def __init__(self, alias, ttl):
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def _generation(self):
+        return self.cache.get_or_set('shortlink-route-generation', 1, None)
+
+    def _key(self, code):
+        return f'shortlink-route:{self._generation()}:{code}'
+
+    def _file_key(self, file_id):
+        return f'shortlink-route-file:{self._generation()}:{file_id}'
+
+    def get(self, code):
+        return self.cache.get(self._key(code))
+
+    def set(self, code, entry):
+        self.cache.set(self._key(code), entry, self.ttl)
+        if entry.get('file_id'):
+            key = self._file_key(entry['file_id'])
+            codes = set(self.cache.get(key) or ())
+            codes.add(code)
+            self.cache.set(key, sorted(codes), self.ttl)
+
+    def delete(self, code):
+        self.cache.delete(self._key(code))
+
+    def delete_file(self, file_id):
+        key = self._file_key(file_id)
+        codes = self.cache.get(key) or ()
+        self.cache.delete_many([self._key(code) for code in codes] + [key])
+
+    def clear(self):
+        try:
+            self.cache.incr('shortlink-route-generation')
+        except ValueError:
+            self.cache.set('shortlink-route-generation', 2, None)
+
+    def size(self):
+        return None
+
+
+_route_cache = None
+
+
+def get_route_cache():
+    global _route_cache
+    if _route_cache is None:
+        with _lock:
+            if _route_cache is None:
+                alias = getattr(settings, 'SHORTLINK_CACHE', 'local')
+                if alias == 'local':
+                    _route_cache = LocalRouteCache(
+                        getattr(settings, 'SHORTLINK_CACHE_SIZE', 10000), getattr(settings, 'SHORTLINK_LOCAL_CACHE_TTL', 5)
+                    )
+                else:
+                    _route_cache = SharedRouteCache(alias, getattr(settings, 'SHORTLINK_CACHE_TTL', 300))
+    return _route_cache
+
+
+def lookup(code, resolve):
+    """Return the cached route for code, calling resolve(code) to fill a miss"""
+    route_cache = get_route_cache()
+    entry = route_cache.get(code)
+    if entry is not None:
+        _count('hits')
+        return entry
+    _count('misses')
+    entry = resolve(code)
+    route_cache.set(code, entry)
+    return entry
+
+
+def invalidate_code(code):
+    _count('invalidations')
+    get_route_cache().delete(code)
+
+
+def invalidate_file(file_id):
+    _count('invalidations')
+    get_route_cache().delete_file(str(file_id))
+
+
+def invalidate_all():
+    _count('invalidations')
+    get_route_cache().clear()
+
+
+def stats():
+    """Hit/miss counters for sizing the cache"""
+    with _lock:
+        data = dict(_counters)
+    lookups = data['hits'] + data['misses']
+    data['hit_ratio'] = round(data['hits'] / lookups, 4) if lookups else None
+    data['size'] = get_route_cache().size()
+    data['backend'] = getattr(settings, 'SHORTLINK_CACHE', 'local')
+    return data
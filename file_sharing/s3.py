@@ -0,0 +1,373 @@
+"""
+S3-compatible object storage.
+
+S3Storage is a Django storage backend for Amazon S3 and compatible stores
+(MinIO, Ceph RGW, Garage, ...). It talks to the S3 REST API with ``requests``,
+signing requests with AWS Signature Version 4, and addresses objects
+path-style (``<endpoint>/<bucket>/<key>``).
+
+- Reads stream: S3File issues a ranged GET from the current position.
+- Files larger than one part are written with a multipart upload. Parts of a
+  local file are sent in parallel.
+- presigned_url() lets clients download straight from the store (see the
+  ``redirect`` download backend), so no bytes pass through Django.
+
+``manage.py s3_standin`` runs a local S3-compatible server for development
+and tests.
+"""
+import datetime
+import hashlib
+import hmac
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import File
+from django.core.files.storage import Storage
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+from django.utils.http import content_disposition_header
+
+ALGORITHM = 'AWS4-HMAC-SHA256'
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 rejects smaller parts (except the last)
+MAX_PARTS = 10000
+
+
+class S3Error(OSError):
+    """Error response from the object store"""
+
+    def __init__(self, status, code, message=''):
+        super().__init__(f'{status} {code}: {message}'.rstrip(': '))
+        self.status = status
+        self.code = code
+
+
+def uri_encode(value, safe='-_.~'):
+    return quote(value, safe=safe)
+
+
+def canonical_query_string(query):
+    return '&'.join(f'{uri_encode(key)}={uri_encode(value)}' for key, value in sorted(query.items()))
+
+
+def canonical_request(method, path, query, headers, signed_headers, payload_hash):
+    """SigV4 canonical request; path is the unencoded '/bucket/key', headers have lower-case names"""
+    canonical_headers = ''.join(f'{name}:{" ".join(str(headers[name]).split())}\n' for name in signed_headers)
+    return '\n'.join([
+        method, uri_encode(path, safe='/-_.~'), canonical_query_string(query),
+        canonical_headers, ';'.join(signed_headers), payload_hash,
+    ])
+
+
+def credential_scope(datestamp, region):
+    return f'{datestamp}/{region}/s3/aws4_request'
+
+
+def signature(secret_key, amz_date, region, canonical):
+    """Sign a canonical request made at amz_date (YYYYMMDDTHHMMSSZ)"""
+    datestamp = amz_date[:8]
+    string_to_sign = '\n'.join([
+        ALGORITHM, amz_date, credential_scope(datestamp, region), hashlib.sha256(canonical.encode()).hexdigest()
+    ])
+    key = ('AWS4' + secret_key).encode()
+    for part in (datestamp, region, 's3', 'aws4_request'):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+
+def _amz_date(now=None):
+    return (now or datetime.datetime.now(datetime.timezone.utc)).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _xml_text(root, tag):
+    """Text of the first element named tag, whatever its namespace"""
+    for element in root.iter():
+        if element.tag.rsplit('}', 1)[-1] == tag:
+            return element.text
+    return None
+
+
+def _xml_all(root, tag):
+    return [element for element in root.iter() if element.tag.rsplit('}', 1)[-1] == tag]
+
+
+class S3File(File):
+    """Readable, seekable stored object; the first read after a seek starts a ranged GET"""
+
+    def __init__(self, storage, name):
+        super().__init__(None, name)
+        self.mode = 'rb'
+        self._storage = storage
+        self._position = 0
+        self._size = None
+        self._response = None
+        self._closed = False
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = self._storage.size(self.name)
+        return self._size
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset != self._position:
+            self._release()
+            self._position = offset
+        return self._position
+
+    def read(self, size=-1):
+        if self._response is None:
+            headers = {'range': f'bytes={self._position}-'} if self._position else {}
+            response = self._storage._request('GET', self.name, headers=headers, stream=True)
+            if response.status_code == 416:
+                return b''
+            self._storage._check(response, 200, 206)
+            self._response = response
+        data = self._response.raw.read(None if size is None or size < 0 else size)
+        self._position += len(data)
+        return data
+
+    def _release(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    def close(self):
+        self._release()
+        self._closed = True
+
+
+class _Body:
+    """Request body of known length read from a file object (requests needs the length up front)"""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+
+@deconstructible(path='file_sharing.s3.S3Storage')
+class S3Storage(Storage):
+    """Storage backend for S3-compatible object stores"""
+
+    def __init__(self, endpoint_url=None, bucket=None, access_key=None, secret_key=None, region='us-east-1',
+                 presign_expires=3600, part_size=16 * 1024 * 1024, upload_concurrency=4, timeout=60):
+        if not endpoint_url or not bucket:
+            raise ImproperlyConfigured('S3Storage needs endpoint_url and bucket')
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.host = urlsplit(self.endpoint_url).netloc
+        self.bucket = bucket
+        self.access_key = access_key or ''
+        self.secret_key = secret_key or ''
+        self.region = region
+        self.presign_expires = presign_expires
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.upload_concurrency = upload_concurrency
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self):
+        # One session per thread and per process: connections are not shared across forks
+        session = getattr(self._local, 'session', None)
+        if session is None or self._local.pid != os.getpid():
+            session = self._local.session = requests.Session()
+            self._local.pid = os.getpid()
+        return session
+
+    def _path(self, name=''):
+        return f'/{self.bucket}/{name.replace(os.sep, "/")}' if name else f'/{self.bucket}'
+
+    def _request(self, method, name='', query=None, headers=None, data=None, payload_hash=UNSIGNED_PAYLOAD,
+                 stream=False):
+        path = self._path(name)
+        query = query or {}
+        amz_date = _amz_date()
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        headers.update({'host': self.host, 'x-amz-date': amz_date, 'x-amz-content-sha256': payload_hash})
+        signed_headers = sorted(headers)
+        canonical = canonical_request(method, path, query, headers, signed_headers, payload_hash)
+        headers['authorization'] = (
+            f'{ALGORITHM} Credential={self.access_key}/{credential_scope(amz_date[:8], self.region)}, '
+            f'SignedHeaders={";".join(signed_headers)}, '
+            f'Signature={signature(self.secret_key, amz_date, self.region, canonical)}'
+        )
+        url = self.endpoint_url + uri_encode(path, safe='/-_.~')
+        if query:
+            url += '?' + canonical_query_string(query)
+        return self._session().request(method, url, headers=headers, data=data, stream=stream, timeout=self.timeout)
+
+    def _check(self, response, *ok):
+        if response.status_code in ok:
+            return response
+        code = message = ''
+        if response.content and not response.request.method == 'HEAD':
+            try:
+                root = ElementTree.fromstring(response.content)
+                code, message = _xml_text(root, 'Code') or '', _xml_text(root, 'Message') or ''
+            except ElementTree.ParseError:
+                pass
+        if response.status_code == 404:
+            raise FileNotFoundError(f'{response.request.url.split("?")[0]}: {code or "Not Found"}')
+        raise S3Error(response.status_code, code or response.reason, message)
+
+    def _call(self, method, name='', query=None, ok=(200,), **kwargs):
+        return self._check(self._request(method, name, query, **kwargs), *ok)
+
+    def _xml_call(self, method, name, query, body):
+        data = body.encode()
+        response = self._call(method, name, query, data=data, payload_hash=hashlib.sha256(data).hexdigest())
+        root = ElementTree.fromstring(response.content)
+        # CompleteMultipartUpload can fail after a 200 status line
+        if root.tag.rsplit('}', 1)[-1] == 'Error':
+            raise S3Error(response.status_code, _xml_text(root, 'Code'), _xml_text(root, 'Message') or '')
+        return root
+
+    # Storage API
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError('S3 objects are opened read-only; save() writes them')
+        return S3File(self, name)
+
+    def _save(self, name, content):
+        size = content.size
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        if size <= self.part_size:
+            self._call('PUT', name, data=_Body(content, size), headers={'content-length': str(size)})
+        else:
+            self._multipart_upload(name, content, size)
+        return name
+
+    def _multipart_upload(self, name, content, size):
+        part_size = max(self.part_size, math.ceil(size / MAX_PARTS))
+        root = self._xml_call('POST', name, {'uploads': ''}, '')
+        upload_id = _xml_text(root, 'UploadId')
+        try:
+            numbers = range(1, math.ceil(size / part_size) + 1)
+            try:
+                fd = content.fileno()
+            except (AttributeError, OSError, ValueError):
+                fd = None
+            if fd is not None and hasattr(os, 'pread'):
+                # A local file: each thread reads and sends its own part
+                def send(number):
+                    data = os.pread(fd, part_size, (number - 1) * part_size)
+                    return self._upload_part(name, upload_id, number, data)
+                with ThreadPoolExecutor(max_workers=self.upload_concurrency) as executor:
+                    etags = list(executor.map(send, numbers))
+            else:
+                etags = [self._upload_part(name, upload_id, number, content.read(part_size)) for number in numbers]
+            self._xml_call('POST', name, {'uploadId': upload_id}, '<CompleteMultipartUpload>' + ''.join(
+                f'<Part><PartNumber>{number}</PartNumber><ETag>{escape(etag)}</ETag></Part>'
+                for number, etag in zip(numbers, etags)
+            ) + '</CompleteMultipartUpload>')
+        except BaseException:
+            self._request('DELETE', name, {'uploadId': upload_id})
+            raise
+
+    def _upload_part(self, name, upload_id, number, data):
+        response = self._call('PUT', name, {'partNumber': str(number), 'uploadId': upload_id}, data=data)
+        return response.headers['ETag']
+
+    def get_available_name(self, name, max_length=None):
+        # Names are unique or content-addressed: writing over the same name is intended
+        return name.replace(os.sep, '/')
+
+    def delete(self, name):
+        self._call('DELETE', name, ok=(200, 204, 404))
+
+    def _head(self, name):
+        return self._call('HEAD', name)
+
+    def exists(self, name):
+        response = self._request('HEAD', name)
+        if response.status_code == 404:
+            return False
+        self._check(response, 200)
+        return True
+
+    def stat(self, name):
+        """(mtime_ns, size) from a single HEAD request"""
+        headers = self._head(name).headers
+        mtime = parsedate_to_datetime(headers['Last-Modified'])
+        return int(mtime.timestamp()) * 10 ** 9, int(headers['Content-Length'])
+
+    def size(self, name):
+        return int(self._head(name).headers['Content-Length'])
+
+    def get_modified_time(self, name):
+        mtime = parsedate_to_datetime(self._head(name).headers['Last-Modified'])
+        return mtime if settings.USE_TZ else timezone.make_naive(mtime)
+
+    def listdir(self, path):
+        prefix = path.replace(os.sep, '/').strip('/')
+        prefix = prefix + '/' if prefix else ''
+        directories, files = [], []
+        query = {'list-type': '2', 'prefix': prefix, 'delimiter': '/'}
+        while True:
+            root = ElementTree.fromstring(self._call('GET', query=query).content)
+            directories += [
+                _xml_text(element, 'Prefix')[len(prefix):].rstrip('/') for element in _xml_all(root, 'CommonPrefixes')
+            ]
+            files += [_xml_text(element, 'Key')[len(prefix):] for element in _xml_all(root, 'Contents')]
+            token = _xml_text(root, 'NextContinuationToken')
+            if _xml_text(root, 'IsTruncated') != 'true' or not token:
+                return directories, files
+            query['continuation-token'] = token
+
+    def presigned_url(self, name, expires=None, filename=None, content_type=None, method='GET'):
+        """URL granting method on the object for expires seconds without credentials"""
+        path = self._path(name)
+        amz_date = _amz_date()
+        query = {
+            'X-Amz-Algorithm': ALGORITHM,
+            'X-Amz-Credential': f'{self.access_key}/{credential_scope(amz_date[:8], self.region)}',
+            'X-Amz-Date': amz_date,
+            'X-Amz-Expires': str(expires or self.presign_expires),
+            'X-Amz-SignedHeaders': 'host',
+        }
+        if filename:
+            query['response-content-disposition'] = content_disposition_header(True, filename)
+        if content_type:
+            query['response-content-type'] = content_type
+        canonical = canonical_request(method, path, query, {'host': self.host}, ['host'], UNSIGNED_PAYLOAD)
+        query['X-Amz-Signature'] = signature(self.secret_key, amz_date, self.region, canonical)
+        return f'{self.endpoint_url}{uri_encode(path, safe="/-_.~")}?{canonical_query_string(query)}'
+
+    def url(self, name):
+        return self.presigned_url(name)
+
+    def create_bucket(self):
+        """Create the bucket if it does not exist yet"""
+        self._call('PUT', ok=(200, 409))
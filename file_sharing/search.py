@@ -0,0 +1,351 @@
+"""
+Filename search for the file list.
+
+``filename__icontains`` is a leading-wildcard LIKE that no B-tree index can
+serve, so search goes through a backend chosen by SEARCH_BACKEND:
+
+- ``sqlite_fts``: FTS5 table with the trigram tokenizer, kept in sync by triggers
+- ``postgres_trgm``: pg_trgm GIN indexes serving icontains, ranked by similarity
+- ``ngram``: in-process trigram index built on first use, patched by this process's
+  signals and rebuilt when another process changes files (needs a shared cache)
+- ``like``: plain icontains scan (the original behaviour)
+- ``auto`` (default): the first of the above that the database supports
+
+Every backend matches the query as a case-insensitive substring of the filename
+or file type. Result counts and download totals are cached until a file changes.
+"""
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.expressions import RawSQL
+from .models import FileUpload
+
+logger = logging.getLogger(__name__)
+
+COUNT_CACHE_TIMEOUT = 300
+GENERATION_KEY = 'search-generation'
+FTS_TABLE = 'file_sharing_fileupload_fts'
+
+SQLITE_FTS_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        filename, file_type, content='file_sharing_fileupload', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON file_sharing_fileupload BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, filename, file_type) VALUES (new.id, new.filename, new.file_type);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON file_sharing_fileupload BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, filename, file_type) VALUES ('delete', old.id, old.filename, old.file_type);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF filename, file_type ON file_sharing_fileupload BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, filename, file_type) VALUES ('delete', old.id, old.filename, old.file_type);
+        INSERT INTO {FTS_TABLE}(rowid, filename, file_type) VALUES (new.id, new.filename, new.file_type);
+    END""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+POSTGRES_TRGM_SQL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS file_sharing_fileupload_filename_trgm '
+    'ON file_sharing_fileupload USING gin (UPPER(filename) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS file_sharing_fileupload_file_type_trgm '
+    'ON file_sharing_fileupload USING gin (UPPER(file_type) gin_trgm_ops)',
+]
+
+
+def install_search_index(conn=connection):
+    """Create (or repair) the database-side search index; returns False if unsupported"""
+    if conn.vendor == 'sqlite':
+        statements = SQLITE_FTS_SQL
+    elif conn.vendor == 'postgresql':
+        statements = POSTGRES_TRGM_SQL
+    else:
+        return False
+    try:
+        # A savepoint, so a failure leaves the surrounding transaction usable
+        with transaction.atomic(using=conn.alias), conn.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    except Exception as e:
+        # Old SQLite without trigram tokenizer, or no permission to create pg_trgm
+        logger.warning('Search index not installed on %s: %s', conn.vendor, e)
+        return False
+    return True
+
+
+def _table_exists(name):
+    with connection.cursor() as cursor:
+        return name in connection.introspection.table_names(cursor)
+
+
+class LikeSearchBackend:
+    """Substring search with icontains; a full scan on most databases"""
+    name = 'like'
+
+    def queryset(self, query):
+        return FileUpload.objects.filter(is_active=True).filter(
+            Q(filename__icontains=query) | Q(file_type__icontains=query)
+        )
+
+    def totals(self, query):
+        result = self.queryset(query).aggregate(count=Count('id'), downloads=Sum('download_count'))
+        return result['count'] or 0, result['downloads'] or 0
+
+    def page(self, query, offset, limit):
+        return list(self.queryset(query).order_by('-uploaded_at', '-id')[offset:offset + limit])
+
+
+class SQLiteFTSSearchBackend(LikeSearchBackend):
+    """SQLite FTS5 trigram index, ranked by bm25"""
+    name = 'sqlite_fts'
+    min_query_length = 3  # The trigram tokenizer cannot match shorter strings
+
+    def _match(self, query):
+        return '"' + query.replace('"', '""') + '"'
+
+    def _from(self):
+        return (f'FROM {FTS_TABLE} JOIN file_sharing_fileupload f ON f.id = {FTS_TABLE}.rowid '
+                f'WHERE {FTS_TABLE} MATCH %s AND f.is_active')
+
+    def totals(self, query):
+        if len(query) < self.min_query_length:
+            return super().totals(query)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*), COALESCE(SUM(f.download_count), 0) {self._from()}', [self._match(query)])
+            count, downloads = cursor.fetchone()
+        return count, downloads
+
+    def page(self, query, offset, limit):
+        if len(query) < self.min_query_length:
+            return super().page(query, offset, limit)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT f.id {self._from()} ORDER BY {FTS_TABLE}.rank, f.uploaded_at DESC LIMIT %s OFFSET %s',
+                [self._match(query), limit, offset],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        files = FileUpload.objects.in_bulk(ids)
+        return [files[pk] for pk in ids if pk in files]
+
+
+class PostgresTrigramSearchBackend(LikeSearchBackend):
+    """pg_trgm GIN indexes serve icontains; results ranked by trigram similarity"""
+    name = 'postgres_trgm'
+
+    def page(self, query, offset, limit):
+        similarity = RawSQL('GREATEST(similarity(filename, %s), similarity(file_type, %s))', (query, query))
+        return list(
+            self.queryset(query).annotate(rank=similarity).order_by('-rank', '-uploaded_at')[offset:offset + limit]
+        )
+
+
+class NgramSearchBackend(LikeSearchBackend):
+    """In-process trigram index over filename and file type, built on first use.
+
+    The index is rebuilt when GENERATION_KEY moves past the generation it was
+    built at, so changes made by other processes show up once the cache is shared.
+    """
+    name = 'ngram'
+    n = 3
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = None
+        self._texts = {}
+        self._generation = None
+
+    def _grams(self, text):
+        text = text.lower()
+        return {text[i:i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def _ensure_index(self):
+        generation = cache.get_or_set(GENERATION_KEY, 1, None)
+        if self._postings is not None and self._generation == generation:
+            return
+        with self._lock:
+            if self._postings is not None and self._generation == generation:
+                return
+            postings = defaultdict(set)
+            texts = {}
+            rows = FileUpload.objects.filter(is_active=True).values_list('id', 'filename', 'file_type')
+            for pk, filename, file_type in rows.iterator(chunk_size=5000):
+                texts[pk] = (filename.lower(), file_type.lower())
+                for gram in self._grams(filename) | self._grams(file_type):
+                    postings[gram].add(pk)
+            self._texts = texts
+            self._postings = postings
+            self._generation = generation
+
+    def update(self, file_upload, generation=None):
+        """Add, refresh or drop one file in the index; generation is the one this change moved to"""
+        if self._postings is None:
+            return
+        with self._lock:
+            self._remove(file_upload.pk)
+            if file_upload.is_active:
+                self._texts[file_upload.pk] = (file_upload.filename.lower(), file_upload.file_type.lower())
+                for gram in self._grams(file_upload.filename) | self._grams(file_upload.file_type):
+                    self._postings[gram].add(file_upload.pk)
+            self._advance(generation)
+
+    def remove(self, pk, generation=None):
+        if self._postings is None:
+            return
+        with self._lock:
+            self._remove(pk)
+            self._advance(generation)
+
+    def _advance(self, generation):
+        # Only this process's change happened since the index was current: no rebuild needed
+        if generation is not None and self._generation == generation - 1:
+            self._generation = generation
+
+    def _remove(self, pk):
+        texts = self._texts.pop(pk, None)
+        if texts is None:
+            return
+        for gram in self._grams(texts[0]) | self._grams(texts[1]):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(pk)
+                if not posting:
+                    del self._postings[gram]
+
+    def _ranked_ids(self, query):
+        self._ensure_index()
+        needle = query.lower()
+        grams = self._grams(needle)
+        with self._lock:
+            if grams:
+                candidates = set.intersection(*(self._postings.get(gram, set()) for gram in grams))
+            else:
+                candidates = set(self._texts)
+            matches = []
+            for pk in candidates:
+                filename, file_type = self._texts[pk]
+                if needle in filename:
+                    # Prefix matches first, then closer (shorter) filenames
+                    matches.append((0 if filename.startswith(needle) else 1, len(filename), -pk))
+                elif needle in file_type:
+                    matches.append((2, len(filename), -pk))
+        return [-key[2] for key in sorted(matches)]
+
+    def totals(self, query):
+        ids = self._ranked_ids(query)
+        downloads = FileUpload.objects.filter(pk__in=ids).aggregate(total=Sum('download_count'))['total'] if ids else 0
+        return len(ids), downloads or 0
+
+    def page(self, query, offset, limit):
+        ids = self._ranked_ids(query)[offset:offset + limit]
+        files = FileUpload.objects.in_bulk(ids)
+        return [files[pk] for pk in ids if pk in files and files[pk].is_active]
+
+
+BACKENDS = {
+    'like': LikeSearchBackend,
+    'sqlite_fts': SQLiteFTSSearchBackend,
+    'postgres_trgm': PostgresTrigramSearchBackend,
+    'ngram': NgramSearchBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _auto_backend_name():
+    if connection.vendor == 'sqlite' and _table_exists(FTS_TABLE):
+        return 'sqlite_fts'
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            if cursor.fetchone():
+                return 'postgres_trgm'
+    return 'ngram'
+
+
+def get_backend():
+    """Return the (process-wide) search backend selected by SEARCH_BACKEND"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = getattr(settings, 'SEARCH_BACKEND', 'auto')
+                if name == 'auto':
+                    name = _auto_backend_name()
+                _backend = BACKENDS[name]()
+    return _backend
+
+
+def invalidate():
+    """Forget cached result counts after files change; returns the new generation, or None if unknown"""
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+        return None
+
+
+def file_changed(file_upload):
+    """Keep search state current after a file is saved"""
+    generation = invalidate()
+    if isinstance(_backend, NgramSearchBackend):
+        _backend.update(file_upload, generation)
+
+
+def file_deleted(pk):
+    """Keep search state current after a file is deleted"""
+    generation = invalidate()
+    if isinstance(_backend, NgramSearchBackend):
+        _backend.remove(pk, generation)
+
+
+def bulk_changed():
+    """Files were changed by a queryset update: drop cached counts and the in-process index"""
+    invalidate()
+    if isinstance(_backend, NgramSearchBackend):
+        with _backend._lock:
+            _backend._postings = None
+            _backend._texts = {}
+
+
+class SearchResults:
+    """Lazily evaluated, ranked search results that a Paginator can page through"""
+
+    def __init__(self, query, backend=None):
+        self.query = query
+        self.backend = backend or get_backend()
+        self._totals = None
+
+    def totals(self):
+        """(matching files, their total downloads), cached until a file changes"""
+        if self._totals is None:
+            generation = cache.get_or_set(GENERATION_KEY, 1, None)
+            digest = hashlib.md5(self.query.encode()).hexdigest()
+            key = f'search-totals:{self.backend.name}:{generation}:{digest}'
+            self._totals = cache.get(key)
+            if self._totals is None:
+                self._totals = self.backend.totals(self.query)
+                cache.set(key, self._totals, COUNT_CACHE_TIMEOUT)
+        return self._totals
+
+    def count(self):
+        return self.totals()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start = key.start or 0
+            stop = self.count() if key.stop is None else key.stop
+            return self.backend.page(self.query, start, max(stop - start, 0))
+        return self.backend.page(self.query, key, 1)[0]
+
+
+def search(query):
+    """Search active files by filename or file type"""
+    return SearchResults(query.strip())
@@ -0,0 +1,85 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from .models import FileUpload, ShortLink
+from . import blobs, routecache, search, stats
+
+
+@receiver(pre_save, sender=FileUpload)
+def remember_stats_contribution(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Load the stored values the rollup was built from before they are overwritten"""
+    instance._stats_old = None
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & set(stats.TRACKED_FIELDS):
+        return
+    old = FileUpload.objects.filter(pk=instance.pk).values(*stats.TRACKED_FIELDS).first()
+    if old is not None:
+        instance._stats_old = stats.contribution(**old)
+        if update_fields is not None and 'download_count' not in update_fields:
+            # The count is not written: the stored one stays, so the rollup must not see this instance's
+            instance.download_count = old['download_count']
+
+
+@receiver(post_save, sender=FileUpload)
+def update_stats_on_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_stats_old', None)
+    if not created and old is None:
+        return
+    new = stats.contribution(instance.is_active, instance.file_size, instance.file_type, instance.download_count)
+    if created:
+        stats.apply_delta(*new)
+    else:
+        stats.file_changed(old, new)
+    instance._stats_old = None
+
+
+@receiver(pre_delete, sender=FileUpload)
+def remember_stats_on_delete(sender, instance, **kwargs):
+    """The stored row, not a possibly stale instance, is what the rollup counted"""
+    instance._stats_old = FileUpload.objects.filter(pk=instance.pk).values(*stats.TRACKED_FIELDS).first()
+
+
+@receiver(post_delete, sender=FileUpload)
+def update_stats_on_delete(sender, instance, **kwargs):
+    old = getattr(instance, '_stats_old', None)
+    instance._stats_old = None
+    if old is None:
+        return
+    totals, types = stats.contribution(**old)
+    stats.apply_delta({field: -delta for field, delta in totals.items()}, {t: -d for t, d in types.items()})
+
+
+@receiver(post_save, sender=FileUpload)
+def update_search_on_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not set(update_fields) & {'filename', 'file_type', 'is_active'}):
+        return
+    search.file_changed(instance)
+
+
+@receiver(post_delete, sender=FileUpload)
+def update_search_on_delete(sender, instance, **kwargs):
+    search.file_deleted(instance.pk)
+
+
+@receiver(post_delete, sender=FileUpload)
+def release_blob_on_delete(sender, instance, **kwargs):
+    blobs.release_on_commit(instance.blob_id, instance.file.name if instance.file else None)
+
+
+@receiver(post_save, sender=FileUpload)
+@receiver(post_delete, sender=FileUpload)
+def invalidate_routes_for_file(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'is_active' not in update_fields and 'file' not in update_fields:
+        return
+    routecache.invalidate_file(instance.unique_id)
+
+
+@receiver(post_save, sender=ShortLink)
+@receiver(post_delete, sender=ShortLink)
+def invalidate_route(sender, instance, **kwargs):
+    routecache.invalidate_code(instance.code)
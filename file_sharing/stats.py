@@ -0,0 +1,131 @@
+"""
+Incrementally maintained storage statistics.
+
+StorageStats holds global totals and FileTypeStats the number of active files
+per type. Both are adjusted by deltas: signal receivers in signals.py handle
+saves and deletes of single files, and the helpers below handle bulk updates
+that bypass signals (admin actions, batched download counts). The stats and
+admin pages therefore read a single row instead of aggregating the whole
+FileUpload table. ``manage.py reconcile_stats`` rebuilds everything from scratch.
+"""
+from collections import Counter
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from .models import FileUpload, FileTypeStats, StorageStats
+
+STATS_FIELDS = ('total_files', 'active_files', 'total_size', 'active_size', 'total_downloads', 'active_downloads')
+TRACKED_FIELDS = ('is_active', 'file_size', 'file_type', 'download_count')
+
+
+def get_stats():
+    """Return the StorageStats row, creating it empty if needed"""
+    stats, _ = StorageStats.objects.get_or_create(pk=1)
+    return stats
+
+
+def top_file_types(limit=10):
+    """Most common active file types as [{'file_type', 'count'}]"""
+    return list(
+        FileTypeStats.objects.filter(active_count__gt=0)
+        .order_by('-active_count')
+        .values('file_type', count=F('active_count'))[:limit]
+    )
+
+
+def contribution(is_active, file_size, file_type, download_count):
+    """Counters contributed by one file, and its per-type contribution"""
+    totals = {
+        'total_files': 1,
+        'active_files': 1 if is_active else 0,
+        'total_size': file_size or 0,
+        'active_size': (file_size or 0) if is_active else 0,
+        'total_downloads': download_count or 0,
+        'active_downloads': (download_count or 0) if is_active else 0,
+    }
+    types = Counter({file_type: 1}) if is_active else Counter()
+    return totals, types
+
+
+def apply_delta(totals, types=None):
+    """Atomically add totals (field -> delta) and types (file_type -> delta) to the rollup"""
+    totals = {field: delta for field, delta in totals.items() if delta}
+    types = {file_type: delta for file_type, delta in (types or {}).items() if delta}
+    if not totals and not types:
+        return
+    with transaction.atomic():
+        if totals:
+            get_stats()
+            StorageStats.objects.filter(pk=1).update(**{field: F(field) + delta for field, delta in totals.items()})
+        for file_type, delta in types.items():
+            FileTypeStats.objects.get_or_create(file_type=file_type)
+            FileTypeStats.objects.filter(file_type=file_type).update(active_count=F('active_count') + delta)
+
+
+def file_changed(old, new):
+    """Apply the change between two contribution() results"""
+    old_totals, old_types = old
+    new_totals, new_types = new
+    totals = {field: new_totals[field] - old_totals[field] for field in STATS_FIELDS}
+    types = Counter(new_types)
+    types.subtract(old_types)
+    apply_delta(totals, types)
+
+
+def set_active(queryset, active):
+    """Bulk activate/deactivate files, keeping the rollup in step; returns rows updated"""
+    sign = 1 if active else -1
+    with transaction.atomic():
+        affected = queryset.filter(is_active=not active)
+        aggregate = affected.aggregate(count=Count('id'), size=Sum('file_size'), downloads=Sum('download_count'))
+        types = Counter({row['file_type']: sign * row['n'] for row in affected.values('file_type').annotate(n=Count('id'))})
+        updated = affected.update(is_active=active)
+        apply_delta({
+            'active_files': sign * aggregate['count'],
+            'active_size': sign * (aggregate['size'] or 0),
+            'active_downloads': sign * (aggregate['downloads'] or 0),
+        }, types)
+    return updated
+
+
+def reset_downloads(queryset):
+    """Bulk reset download counts to zero, keeping the rollup in step; returns rows updated"""
+    with transaction.atomic():
+        total = queryset.aggregate(total=Sum('download_count'))['total'] or 0
+        active = queryset.filter(is_active=True).aggregate(total=Sum('download_count'))['total'] or 0
+        updated = queryset.update(download_count=0)
+        apply_delta({'total_downloads': -total, 'active_downloads': -active})
+    return updated
+
+
+def downloads_added(counts):
+    """Record batched download increments (file id -> count) already written to FileUpload"""
+    active_ids = set(FileUpload.objects.filter(pk__in=list(counts), is_active=True).values_list('pk', flat=True))
+    apply_delta({
+        'total_downloads': sum(counts.values()),
+        'active_downloads': sum(count for file_id, count in counts.items() if file_id in active_ids),
+    })
+
+
+def rebuild():
+    """Recompute the rollup from the FileUpload table"""
+    with transaction.atomic():
+        everything = FileUpload.objects.aggregate(
+            count=Count('id'), size=Sum('file_size'), downloads=Sum('download_count')
+        )
+        active = FileUpload.objects.filter(is_active=True).aggregate(
+            count=Count('id'), size=Sum('file_size'), downloads=Sum('download_count')
+        )
+        StorageStats.objects.update_or_create(pk=1, defaults={
+            'total_files': everything['count'],
+            'total_size': everything['size'] or 0,
+            'total_downloads': everything['downloads'] or 0,
+            'active_files': active['count'],
+            'active_size': active['size'] or 0,
+            'active_downloads': active['downloads'] or 0,
+        })
+        FileTypeStats.objects.all().delete()
+        FileTypeStats.objects.bulk_create([
+            FileTypeStats(file_type=row['file_type'], active_count=row['n'])
+            for row in FileUpload.objects.filter(is_active=True).values('file_type').annotate(n=Count('id'))
+        ])
+    return get_stats()
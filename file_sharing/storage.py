@@ -0,0 +1,140 @@
+import hashlib
+import mmap
+import os
+from django.conf import settings
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import default_storage
+
+
+def _read_chunks(f, chunk_size, use_mmap, io_lock):
+    """Yield the file's contents in chunks, holding io_lock (if any) only while reading"""
+    if use_mmap and os.fstat(f.fileno()).st_size:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            for offset in range(0, len(mapped), chunk_size):
+                if io_lock is None:
+                    yield mapped[offset:offset + chunk_size]
+                else:
+                    with io_lock:
+                        chunk = mapped[offset:offset + chunk_size]
+                    yield chunk
+        return
+    while True:
+        if io_lock is None:
+            chunk = f.read(chunk_size)
+        else:
+            with io_lock:
+                chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _hash_chunks(chunks, progress=None):
+    md5_hash = hashlib.md5()
+    sha256_hash = hashlib.sha256()
+    done = 0
+    for chunk in chunks:
+        md5_hash.update(chunk)
+        sha256_hash.update(chunk)
+        if progress is not None:
+            done += len(chunk)
+            progress(done)
+    return md5_hash.hexdigest(), sha256_hash.hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024, progress=None, use_mmap=False, io_lock=None):
+    """Return (md5, sha256) hex digests of the file at path in one pass.
+
+    progress(bytes_done) is called per chunk; io_lock, a lock or semaphore, limits
+    how many processes read from disk at once while hashing still overlaps.
+    """
+    with open(path, 'rb') as f:
+        return _hash_chunks(_read_chunks(f, chunk_size, use_mmap, io_lock), progress)
+
+
+# Stored files are reached through default_storage: the local filesystem
+# (FileSystemStorage) or an object store (s3.S3Storage). Writes in
+# progress (spooled uploads, chunk assembly) always happen in a local staging
+# directory and enter the storage once complete, see blobs.adopt().
+
+def is_local(storage=None):
+    """Whether the storage keeps files on this machine's filesystem"""
+    try:
+        (storage or default_storage).path('')
+    except NotImplementedError:
+        return False
+    return True
+
+
+def local_path(name):
+    """Filesystem path of a stored file, or None when the storage is remote"""
+    return default_storage.path(name) if is_local() else None
+
+
+def staging_path(*parts):
+    """Local path for writes in progress, before they enter the storage"""
+    return os.path.join(getattr(settings, 'UPLOAD_STAGING_ROOT', None) or settings.MEDIA_ROOT, *parts)
+
+
+def stat(name):
+    """(mtime_ns, size) of a stored file; raises OSError if it is missing"""
+    path = local_path(name)
+    if path is not None:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    return default_storage.stat(name)
+
+
+def open_stored(name):
+    """Open a stored file for reading"""
+    path = local_path(name)
+    if path is not None:
+        return open(path, 'rb')
+    return default_storage.open(name, 'rb')
+
+
+def hash_stored(name, chunk_size=1024 * 1024, progress=None, use_mmap=False, io_lock=None):
+    """hash_file for a stored file wherever it is kept; mmap applies to local files only"""
+    path = local_path(name)
+    if path is not None:
+        return hash_file(path, chunk_size, progress, use_mmap, io_lock)
+    with default_storage.open(name, 'rb') as f:
+        return _hash_chunks(_read_chunks(f, chunk_size, False, io_lock), progress)
+
+
+def walk(top):
+    """Yield (directory, filenames) for top and each directory below it, skipping dot-directories"""
+    try:
+        directories, filenames = default_storage.listdir(top)
+    except FileNotFoundError:
+        return
+    yield top, filenames
+    for directory in directories:
+        if not directory.startswith('.'):
+            yield from walk(f'{top}/{directory}')
+
+
+def put_file(path, name):
+    """Move a local file into the storage under name, replacing any file there"""
+    dest = local_path(name)
+    if dest is not None:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # A rename when staging shares the filesystem
+        file_move_safe(path, dest, allow_overwrite=True)
+        # Spooled uploads are created 0600; the front-end server serving downloads must be able to read them
+        os.chmod(dest, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+        return
+    with open(path, 'rb') as f:
+        default_storage.save(name, File(f, name=name))
+    os.remove(path)
+
+
+def download_url(name, filename, content_type=None):
+    """URL a client can download the file from directly, or None if the storage cannot issue one"""
+    presigned_url = getattr(default_storage, 'presigned_url', None)
+    if presigned_url is None:
+        return None
+    return presigned_url(name, filename=filename, content_type=content_type)
@@ -1,3 +1,1247 @@
-from django.test import TestCase
+import base64
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from http.server import ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+from asgiref.sync import async_to_sync
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from .models import Blob, FileUpload, Job, ShortLink, UploadSession, get_blob_path, get_file_path
+from .management.commands.s3_standin import StandinHandler
+from .storage import hash_file
+from . import aio, blobs, chunked, counters, downloads, ingest, integrity, jobs, linkhealth, progress, routecache, s3, search, stats, storage, views
 
-# Create your tests here.
+
+class MediaTestCase(TestCase):
+    """Runs each test against an empty temporary MEDIA_ROOT, with download counts written immediately"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, UPLOAD_STAGING_ROOT='', DOWNLOAD_COUNT_FLUSH_INTERVAL=0
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, content, filename='file.txt', file_type='text/plain', is_active=True):
+        file_upload = FileUpload(
+            file=SimpleUploadedFile(filename, content), filename=filename, file_size=len(content),
+            file_type=file_type, is_active=is_active,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            file_upload.save()
+        return file_upload
+
+
+class BlobRefcountTests(MediaTestCase):
+    def test_same_contents_share_one_blob(self):
+        first = self.upload(b'shared contents')
+        second = self.upload(b'shared contents', filename='copy.txt')
+        self.assertEqual(first.blob_id, second.blob_id)
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(first.file.name, blob.name)
+        self.assertEqual(blob.sha256_hash, hashlib.sha256(b'shared contents').hexdigest())
+
+    def test_acquire_and_release(self):
+        file_upload = self.upload(b'contents')
+        sha256_hash = file_upload.sha256_hash
+        self.assertIsNone(blobs.acquire(sha256_hash, size=1))
+        blob = blobs.acquire(sha256_hash, size=len(b'contents'))
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+        blobs.release(blob.pk)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(default_storage.exists(blob.name))
+
+    def test_delete_releases_and_last_reference_removes_the_file(self):
+        first = self.upload(b'contents')
+        second = self.upload(b'contents', filename='copy.txt')
+        name = first.file.name
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(default_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_replacing_contents_releases_the_old_blob(self):
+        file_upload = self.upload(b'old contents')
+        shared = self.upload(b'old contents', filename='other.txt')
+        old_blob = file_upload.blob
+        file_upload.file = SimpleUploadedFile('file.txt', b'new contents')
+        with self.captureOnCommitCallbacks(execute=True):
+            file_upload.save()
+        self.assertNotEqual(file_upload.blob_id, old_blob.pk)
+        self.assertEqual(Blob.objects.get(pk=old_blob.pk).ref_count, 1)
+
+        shared.file = SimpleUploadedFile('other.txt', b'new contents')
+        with self.captureOnCommitCallbacks(execute=True):
+            shared.save()
+        self.assertFalse(Blob.objects.filter(pk=old_blob.pk).exists())
+        self.assertFalse(default_storage.exists(old_blob.name))
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+
+    def test_failed_save_rolls_back_the_reference(self):
+        self.upload(b'contents')
+        broken = FileUpload(file=SimpleUploadedFile('copy.txt', b'contents'), filename='copy.txt', file_size=8, file_type=None)
+        with self.assertRaises(IntegrityError):
+            broken.save()
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+    def test_collect_spares_young_blobs(self):
+        file_upload = self.upload(b'in flight')
+        name = file_upload.file.name
+        # A reference taken for a row that has not committed yet
+        FileUpload.objects.filter(pk=file_upload.pk).delete()
+        self.assertEqual(blobs.collect(min_age_hours=1), (0, 0, 0))
+        self.assertTrue(default_storage.exists(name))
+
+        Blob.objects.update(created_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(blobs.collect(min_age_hours=1), (0, 1, 0))
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(name))
+
+class UploadSpoolingTests(MediaTestCase):
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_spooled_upload_is_readable_by_the_web_server(self):
+        data = b'x' * 4096
+        response = self.client.post('/api/upload/', {'file': SimpleUploadedFile('big.bin', data)})
+        self.assertEqual(response.status_code, 200)
+        blob = Blob.objects.get()
+        self.assertEqual(blob.sha256_hash, hashlib.sha256(data).hexdigest())
+        mode = os.stat(default_storage.path(blob.name)).st_mode & 0o777
+        self.assertEqual(mode, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+
+    def test_budget(self):
+        budget = ingest.Budget(100)
+        self.assertEqual(budget.acquire(60), 60)
+        self.assertIsNone(budget.acquire(60))
+        self.assertFalse(budget.try_acquire(41))
+        budget.release(60)
+        # Larger than the whole budget: admitted once it runs alone
+        self.assertEqual(budget.acquire(500), 100)
+        budget.release(100)
+        self.assertEqual(budget.in_use, 0)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=10, UPLOAD_INFLIGHT_BUDGET=1000, UPLOAD_BACKPRESSURE_TIMEOUT=0)
+    def test_exhausted_inflight_budget_answers_503(self):
+        inflight = ingest.inflight_budget()
+        held = inflight.acquire(1000)
+        try:
+            response = self.client.post('/api/upload/', {'file': SimpleUploadedFile('a.bin', b'y' * 100)})
+        finally:
+            inflight.release(held)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(ingest.RETRY_AFTER_SECONDS))
+        self.assertFalse(FileUpload.objects.exists())
+        response = self.client.post('/api/upload/', {'file': SimpleUploadedFile('a.bin', b'y' * 100)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(inflight.in_use, 0)
+
+
+class IntegrityModeTests(MediaTestCase):
+    def corrupt(self, file_upload):
+        path = default_storage.path(file_upload.file.name)
+        st = os.stat(path)
+        with open(path, 'r+b') as f:
+            f.write(b'X')
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+
+    def fetch(self, file_upload):
+        response = self.client.get(f'/download/{file_upload.unique_id}/')
+        if response.status_code == 200:
+            b''.join(response.streaming_content)
+            response.close()
+        return response
+
+    @override_settings(FILE_INTEGRITY_MODE='stat')
+    def test_stat_mode_rehashes_only_changed_files(self):
+        file_upload = self.upload(b'contents')
+        with mock.patch.object(integrity.storage, 'hash_stored', wraps=integrity.storage.hash_stored) as hash_stored:
+            # Hashed while uploading, so the first download is already verified
+            self.assertTrue(integrity.allow_download(file_upload))
+            self.assertTrue(integrity.allow_download(file_upload))
+            self.assertEqual(hash_stored.call_count, 0)
+            self.corrupt(file_upload)
+            self.assertFalse(integrity.allow_download(file_upload))
+            self.assertEqual(hash_stored.call_count, 1)
+        self.assertIs(FileUpload.objects.get(pk=file_upload.pk).integrity_ok, False)
+        self.assertEqual(self.fetch(file_upload).status_code, 302)
+
+    @override_settings(FILE_INTEGRITY_MODE='periodic')
+    def test_periodic_mode_trusts_the_stored_result(self):
+        file_upload = self.upload(b'contents')
+        self.corrupt(file_upload)
+        self.assertEqual(self.fetch(file_upload).status_code, 200)
+        integrity.verify_and_record(file_upload)
+        self.assertEqual(self.fetch(file_upload).status_code, 302)
+
+    @override_settings(FILE_INTEGRITY_MODE='stream')
+    def test_stream_mode_records_a_mismatch_after_sending(self):
+        file_upload = self.upload(b'contents')
+        self.assertEqual(self.fetch(file_upload).status_code, 200)
+        self.assertIs(FileUpload.objects.get(pk=file_upload.pk).integrity_ok, True)
+        self.corrupt(file_upload)
+        self.assertEqual(self.fetch(file_upload).status_code, 200)
+        self.assertIs(FileUpload.objects.get(pk=file_upload.pk).integrity_ok, False)
+        self.assertEqual(self.fetch(file_upload).status_code, 302)
+
+    @override_settings(FILE_INTEGRITY_MODE='sometimes')
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            integrity.get_integrity_mode()
+
+
+class PrecheckTests(MediaTestCase):
+    url = '/api/upload/precheck/'
+
+    def precheck(self, **data):
+        return self.client.post(self.url, json.dumps(data), content_type='application/json')
+
+    def test_known_contents_create_a_file_without_transfer(self):
+        data = b'already stored'
+        original = self.upload(data)
+        response = self.precheck(file_size=len(data))
+        self.assertEqual(response.json(), {'exists': False, 'candidates': True})
+        response = self.precheck(file_size=len(data), sha256_hash=original.sha256_hash, filename='again.txt')
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertTrue(body['exists'])
+        created = FileUpload.objects.get(unique_id=body['file_id'])
+        self.assertEqual(created.blob_id, original.blob_id)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_unknown_contents(self):
+        response = self.precheck(file_size=3)
+        self.assertEqual(response.json(), {'exists': False, 'candidates': False})
+        response = self.precheck(file_size=3, sha256_hash='0' * 64, filename='x.txt')
+        self.assertEqual(response.json(), {'exists': False, 'candidates': True})
+        self.assertFalse(FileUpload.objects.exists())
+
+    def test_contents_of_deactivated_files_are_not_reachable(self):
+        data = b'withdrawn by the admin'
+        original = self.upload(data)
+        FileUpload.objects.filter(pk=original.pk).update(is_active=False)
+        self.assertFalse(self.precheck(file_size=len(data)).json()['candidates'])
+        response = self.precheck(file_size=len(data), sha256_hash=original.sha256_hash, filename='x.txt')
+        self.assertFalse(response.json()['exists'])
+        self.assertEqual(FileUpload.objects.count(), 1)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+    def test_invalid_input(self):
+        self.assertEqual(self.precheck(file_size='big').status_code, 400)
+        self.assertEqual(self.precheck(file_size=1, sha256_hash='xyz', filename='x').status_code, 400)
+        self.assertEqual(self.precheck(file_size=1, sha256_hash='0' * 64).status_code, 400)
+
+    def test_body_must_be_a_json_object(self):
+        for body in ('[1]', '"x"', '3', 'null', '{"file_size": ', '\xff'):
+            response = self.client.post(self.url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+            self.assertIn('error', response.json())
+
+    @override_settings(MAX_UPLOAD_SIZE=1000, FILE_UPLOAD_MAX_MEMORY_SIZE=200, UPLOAD_INFLIGHT_BUDGET=500, UPLOAD_BACKPRESSURE_TIMEOUT=0)
+    def test_admitted_like_an_upload(self):
+        response = self.precheck(file_size=1001, sha256_hash='0' * 64, filename='x.txt')
+        self.assertEqual(response.status_code, 413)
+        inflight = ingest.inflight_budget()
+        held = inflight.acquire(500)
+        try:
+            response = self.precheck(file_size=300, sha256_hash='0' * 64, filename='x.txt')
+        finally:
+            inflight.release(held)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.precheck(file_size=300, sha256_hash='0' * 64, filename='x.txt').status_code, 200)
+        self.assertEqual(inflight.in_use, 0)
+
+
+class ChunkedUploadTests(MediaTestCase):
+    chunk_size = 4
+
+    def start(self, data, upload_id='upload-1'):
+        total_chunks = max(1, -(-len(data) // self.chunk_size))
+        return chunked.get_or_create_session(
+            upload_id, 'data.bin', len(data), 'application/octet-stream', self.chunk_size, total_chunks
+        )
+
+    def send(self, session, data, chunk_number):
+        start = chunk_number * self.chunk_size
+        chunk = SimpleUploadedFile('blob', data[start:start + self.chunk_size])
+        return chunked.receive_chunk(session, chunk_number, chunk)
+
+    def test_out_of_order_chunks_complete_once_bitmap_is_full(self):
+        data = b'0123456789abcdefghij'
+        session = self.start(data)
+        for chunk_number in (4, 1, 3, 0):
+            session, completed = self.send(session, data, chunk_number)
+            self.assertFalse(completed)
+        self.assertEqual(session.received_chunk_numbers(), [0, 1, 3, 4])
+        session, completed = self.send(session, data, 2)
+        self.assertTrue(completed)
+
+        file_upload = chunked.complete_session(session)
+        with file_upload.file.open('rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(file_upload.sha256_hash, hashlib.sha256(data).hexdigest())
+        session.refresh_from_db()
+        self.assertEqual(session.status, UploadSession.STATUS_COMPLETE)
+        self.assertEqual(session.file_upload_id, file_upload.pk)
+        self.assertFalse(os.path.exists(chunked.partial_path(session.upload_id)))
+
+    def test_duplicate_chunk_is_counted_once(self):
+        data = b'0123456789'
+        session = self.start(data)
+        self.send(session, data, 1)
+        session, completed = self.send(session, data, 1)
+        self.assertFalse(completed)
+        self.assertEqual(session.received_count, 1)
+        self.assertEqual(session.bytes_received, self.chunk_size)
+
+    def test_rejects_wrong_chunk_size_and_number(self):
+        data = b'0123456789'
+        session = self.start(data)
+        with self.assertRaises(ValueError):
+            chunked.receive_chunk(session, 0, SimpleUploadedFile('blob', b'xy'))
+        with self.assertRaises(ValueError):
+            chunked.receive_chunk(session, 3, SimpleUploadedFile('blob', b'xy'))
+
+    def test_rejects_mismatched_session_parameters(self):
+        self.start(b'0123456789')
+        with self.assertRaises(ValueError):
+            chunked.get_or_create_session('upload-1', 'data.bin', 12, 'application/octet-stream', self.chunk_size, 3)
+
+    def post_chunk(self, view=None, **fields):
+        data = {
+            'file_id': 'upload-2', 'chunk_number': '0', 'total_chunks': '1', 'chunk_size': '4',
+            'filename': 'data.bin', 'file_size': '4', 'chunk': SimpleUploadedFile('blob', b'abcd'),
+        }
+        data.update(fields)
+        if view is None:
+            return self.client.post('/api/chunked-upload/', data)
+        return async_to_sync(view)(RequestFactory().post('/api/chunked-upload/', data))
+
+    def test_view_assembles_the_upload(self):
+        response = self.post_chunk()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['complete'])
+        self.assertEqual(FileUpload.objects.get().sha256_hash, hashlib.sha256(b'abcd').hexdigest())
+
+    def test_view_rejects_non_integer_fields(self):
+        for field in ('chunk_number', 'total_chunks', 'chunk_size', 'file_size'):
+            response = self.post_chunk(**{field: 'x'})
+            self.assertEqual(response.status_code, 400, field)
+            response = self.post_chunk(views.chunked_upload_async, **{field: ''})
+            self.assertEqual(response.status_code, 400, field)
+            self.assertIn('integers', json.loads(response.content)['error'])
+        self.assertFalse(UploadSession.objects.exists())
+
+
+class LegacyUploadTests(MediaTestCase):
+    def test_dedupe_uploads_moves_flat_uploads_into_the_blob_store(self):
+        data = b'stored before the blob store'
+        name = get_file_path(None, 'old.txt')
+        self.assertEqual(os.path.dirname(name), 'uploads')
+        default_storage.save(name, ContentFile(data))
+        legacy = FileUpload.objects.create(
+            file=name, filename='old.txt', file_size=len(data), file_type='text/plain',
+            md5_hash=hashlib.md5(data).hexdigest(), sha256_hash=hashlib.sha256(data).hexdigest(),
+        )
+        missing = FileUpload.objects.create(file='uploads/gone.txt', filename='gone.txt', file_size=1, file_type='text/plain')
+        call_command('dedupe_uploads', stdout=StringIO(), stderr=StringIO())
+
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.file.name, get_blob_path(legacy.sha256_hash))
+        self.assertEqual(legacy.blob.ref_count, 1)
+        self.assertFalse(default_storage.exists(name))
+        with legacy.file.open('rb') as f:
+            self.assertEqual(f.read(), data)
+        missing.refresh_from_db()
+        self.assertIsNone(missing.blob)
+
+
+class RouteCacheTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        routecache._route_cache = None
+        self.addCleanup(setattr, routecache, '_route_cache', None)
+
+    def test_local_cache_bounds_and_expiry(self):
+        route_cache = routecache.LocalRouteCache(max_size=2, ttl=60)
+        route_cache.set('a', {'file_id': 'f1'})
+        route_cache.set('b', {'file_id': 'f1'})
+        route_cache.get('a')
+        route_cache.set('c', {'file_id': None})
+        # b was the least recently used
+        self.assertIsNone(route_cache.get('b'))
+        self.assertEqual(route_cache.get('a'), {'file_id': 'f1'})
+        route_cache.delete_file('f1')
+        self.assertIsNone(route_cache.get('a'))
+        self.assertEqual(route_cache.size(), 1)
+        with mock.patch.object(routecache.time, 'monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(route_cache.get('c'))
+
+    @override_settings(SHORTLINK_LOCAL_CACHE_TTL=3, SHORTLINK_CACHE_TTL=300)
+    def test_local_cache_uses_the_short_ttl(self):
+        self.assertEqual(routecache.get_route_cache().ttl, 3)
+
+    def test_changes_invalidate_cached_routes(self):
+        file_upload = self.upload(b'contents')
+        url = f'http://testserver/download/{file_upload.unique_id}/'
+        ShortLink.objects.create(code='doc', target_url=url, file_upload=file_upload)
+        response = self.client.get('/share/doc/')
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        with self.assertNumQueries(0):
+            self.client.get('/share/doc/')
+
+        file_upload.is_active = False
+        file_upload.save(update_fields=['is_active'])
+        response = self.client.get('/share/doc/')
+        self.assertTemplateUsed(response, 'file_sharing/file_deleted.html')
+
+        ShortLink.objects.filter(code='doc').delete()
+        self.assertEqual(self.client.get('/share/doc/').status_code, 404)
+
+    def test_route_for_another_host_does_not_depend_on_the_request_host(self):
+        file_upload = self.upload(b'contents')
+        ShortLink.objects.create(code='lan', target_url=f'http://192.0.2.7/download/{file_upload.unique_id}/')
+        self.assertEqual(self.client.get('/share/lan/').status_code, 302)
+        file_upload.is_active = False
+        file_upload.save(update_fields=['is_active'])
+        # For other hosts the target is external and keeps its stored status; on its own host the file is gone
+        self.assertEqual(self.client.get('/share/lan/').status_code, 302)
+        with override_settings(ALLOWED_HOSTS=['testserver', '192.0.2.7']):
+            response = self.client.get('/share/lan/', headers={'Host': '192.0.2.7'})
+        self.assertTemplateUsed(response, 'file_sharing/file_deleted.html')
+
+
+class DownloadBackendTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.file_upload = self.upload(b'0123456789' * 10, filename='digits.txt')
+        self.url = f'/download/{self.file_upload.unique_id}/'
+
+    def download_count(self):
+        return FileUpload.objects.get(pk=self.file_upload.pk).download_count
+
+    def test_stream_counts_full_gets_only(self):
+        response = self.client.head(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.download_count(), 0)
+        response = self.client.get(self.url, headers={'Range': 'bytes=50-'})
+        b''.join(response.streaming_content)
+        self.assertEqual(self.download_count(), 0)
+        response = self.client.get(self.url)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789' * 10)
+        self.assertEqual(self.download_count(), 1)
+
+    @override_settings(DOWNLOAD_BACKEND='nginx', DOWNLOAD_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_nginx(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.file_upload.file.name)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], f'"{self.file_upload.sha256_hash}"')
+        self.assertEqual(self.download_count(), 1)
+        self.client.head(self.url)
+        self.client.get(self.url, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(self.download_count(), 1)
+
+    @override_settings(DOWNLOAD_BACKEND='xsendfile')
+    def test_xsendfile(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], default_storage.path(self.file_upload.file.name))
+        self.assertEqual(self.download_count(), 1)
+
+    def test_remote_files_are_not_handed_to_the_web_server(self):
+        def serve():
+            # No local path: the file lives in an object store
+            request = RequestFactory().get(self.url)
+            return downloads.XSendfileDownloadBackend().serve(request, self.file_upload, None, 100, None, 0)
+
+        with mock.patch.object(downloads.storage, 'download_url', return_value='https://bucket.example/obj?sig=1'):
+            response = serve()
+        self.assertNotIn('X-Sendfile', response)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], 'https://bucket.example/obj?sig=1')
+        # Without presigned URLs the bytes are streamed
+        response = serve()
+        self.assertNotIn('X-Sendfile', response)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789' * 10)
+        self.assertEqual(self.download_count(), 2)
+
+    @override_settings(DOWNLOAD_BACKEND='redirect')
+    def test_redirect_streams_from_local_storage(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        b''.join(response.streaming_content)
+        self.assertEqual(self.download_count(), 1)
+
+
+class UploadHashingTests(MediaTestCase):
+    def test_uploads_are_hashed_while_received(self):
+        for size in (100, 4096):
+            data = os.urandom(size)
+            with override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024):
+                with mock.patch.object(blobs, 'hash_file', side_effect=AssertionError('re-read')):
+                    response = self.client.post('/api/upload/', {'file': SimpleUploadedFile('data.bin', data)})
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertEqual(body['md5_hash'], hashlib.md5(data).hexdigest())
+            self.assertEqual(body['sha256_hash'], hashlib.sha256(data).hexdigest())
+            file_upload = FileUpload.objects.get(unique_id=body['file_id'])
+            self.assertIs(file_upload.integrity_ok, True)
+            self.assertIsNotNone(file_upload.last_verified_at)
+
+    def test_hash_file(self):
+        path = os.path.join(self.media_root, 'data.bin')
+        data = os.urandom(3000)
+        with open(path, 'wb') as f:
+            f.write(data)
+        expected = (hashlib.md5(data).hexdigest(), hashlib.sha256(data).hexdigest())
+        done = []
+        self.assertEqual(hash_file(path, chunk_size=1024, progress=done.append), expected)
+        self.assertEqual(done, [1024, 2048, 3000])
+        self.assertEqual(hash_file(path, chunk_size=1024, use_mmap=True, io_lock=threading.Lock()), expected)
+
+
+class UploadProgressTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def send_chunk(self, chunk_number, data=b'0123456789', chunk_size=4):
+        start = chunk_number * chunk_size
+        return self.client.post('/api/chunked-upload/', {
+            'file_id': 'progress-1', 'chunk_number': str(chunk_number), 'total_chunks': '3',
+            'chunk_size': str(chunk_size), 'filename': 'data.bin', 'file_size': str(len(data)),
+            'chunk': SimpleUploadedFile('blob', data[start:start + chunk_size]),
+        })
+
+    def test_progress_follows_chunks(self):
+        self.assertEqual(self.client.get('/api/upload-progress/progress-1/').status_code, 404)
+        self.send_chunk(2)
+        self.send_chunk(0)
+        data = self.client.get('/api/upload-progress/progress-1/').json()
+        self.assertEqual((data['chunks_received'], data['bytes_received'], data['progress']), (2, 6, 60.0))
+        self.assertEqual(data['status'], UploadSession.STATUS_ACTIVE)
+        self.assertNotIn('started_at', data)
+
+        # Without the cache entry the session row answers
+        cache.clear()
+        self.assertEqual(self.client.get('/api/upload-progress/progress-1/').json()['bytes_received'], 6)
+
+        self.send_chunk(1)
+        data = self.client.get('/api/upload-progress/progress-1/').json()
+        self.assertEqual(data['status'], UploadSession.STATUS_COMPLETE)
+        self.assertEqual(data['file_id'], str(FileUpload.objects.get().unique_id))
+
+    def test_progress_never_moves_backwards(self):
+        self.send_chunk(0)
+        self.send_chunk(1)
+        session = UploadSession.objects.get()
+        stale = UploadSession.objects.get()
+        stale.bytes_received = 4
+        self.assertEqual(progress.record(stale)['bytes_received'], 8)
+        self.assertEqual(progress.get(session.upload_id)['bytes_received'], 8)
+
+    @mock.patch.object(views, 'PROGRESS_STREAM_TIMEOUT', 0)
+    def test_stream_long_poll(self):
+        url = '/api/upload-progress/progress-1/stream/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.send_chunk(0)
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = response.content.decode()
+        event_id = re.search(r'^id: (.+)$', body, re.M).group(1)
+        data = json.loads(re.search(r'^data: (.+)$', body, re.M).group(1))
+        self.assertEqual(data['chunks_received'], 1)
+
+        # Nothing new before the timeout: a keep-alive, and the client reconnects
+        body = self.client.get(url, headers={'Last-Event-ID': event_id}).content.decode()
+        self.assertIn(': keep-alive', body)
+        self.assertNotIn('data:', body)
+
+        self.send_chunk(1)
+        self.send_chunk(2)
+        body = self.client.get(url, headers={'Last-Event-ID': event_id}).content.decode()
+        event_id = re.search(r'^id: (.+)$', body, re.M).group(1)
+        self.assertEqual(json.loads(re.search(r'^data: (.+)$', body, re.M).group(1))['status'], 'complete')
+        # The final state was delivered: stop reconnecting
+        self.assertEqual(self.client.get(url, headers={'Last-Event-ID': event_id}).status_code, 204)
+
+
+class RangeAndConditionalTests(MediaTestCase):
+    def test_parse_range_header(self):
+        self.assertEqual(downloads.parse_range_header('bytes=0-9', 100), [(0, 9)])
+        self.assertEqual(downloads.parse_range_header('bytes=90-', 100), [(90, 99)])
+        self.assertEqual(downloads.parse_range_header('bytes=-10', 100), [(90, 99)])
+        self.assertEqual(downloads.parse_range_header('bytes=95-200', 100), [(95, 99)])
+        self.assertEqual(downloads.parse_range_header('bytes=0-1, 5-6', 100), [(0, 1), (5, 6)])
+        self.assertEqual(downloads.parse_range_header('bytes=100-', 100), [])
+        self.assertIsNone(downloads.parse_range_header('', 100))
+        self.assertIsNone(downloads.parse_range_header('items=0-1', 100))
+        self.assertIsNone(downloads.parse_range_header('bytes=5-1', 100))
+        self.assertIsNone(downloads.parse_range_header('bytes=a-b', 100))
+        too_many = 'bytes=' + ','.join(f'{i}-{i}' for i in range(downloads.MAX_RANGES + 1))
+        self.assertIsNone(downloads.parse_range_header(too_many, 100))
+
+    def test_if_none_match(self):
+        etag = '"abc"'
+        factory = RequestFactory()
+        self.assertTrue(downloads.is_not_modified(factory.get('/', HTTP_IF_NONE_MATCH='"abc"'), etag, 0))
+        self.assertTrue(downloads.is_not_modified(factory.get('/', HTTP_IF_NONE_MATCH='W/"abc"'), etag, 0))
+        self.assertTrue(downloads.is_not_modified(factory.get('/', HTTP_IF_NONE_MATCH='"x", "abc"'), etag, 0))
+        self.assertTrue(downloads.is_not_modified(factory.get('/', HTTP_IF_NONE_MATCH='*'), etag, 0))
+        self.assertFalse(downloads.is_not_modified(factory.get('/', HTTP_IF_NONE_MATCH='"other"'), etag, 0))
+        self.assertFalse(downloads.is_not_modified(factory.get('/'), etag, 0))
+
+    def test_download_responses(self):
+        data = bytes(range(256)) * 4
+        file_upload = self.upload(data, filename='data.bin', file_type='application/octet-stream')
+        url = f'/download/{file_upload.unique_id}/'
+
+        response = self.client.get(url, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(data)}')
+        self.assertEqual(b''.join(response.streaming_content), data[10:20])
+
+        response = self.client.get(url, headers={'Range': 'bytes=0-1,10-11'})
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        body = b''.join(response.streaming_content)
+        self.assertIn(data[0:2], body)
+        self.assertIn(data[10:12], body)
+        self.assertEqual(len(body), int(response['Content-Length']))
+
+        response = self.client.get(url, headers={'Range': f'bytes={len(data)}-'})
+        self.assertEqual(response.status_code, 416)
+
+        etag = f'"{file_upload.sha256_hash}"'
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # A stale If-Range validator gets the whole file
+        response = self.client.get(url, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_range_and_if_modified_since(self):
+        file_upload = self.upload(b'0123456789', filename='digits.txt')
+        url = f'/download/{file_upload.unique_id}/'
+        etag = f'"{file_upload.sha256_hash}"'
+        response = self.client.get(url, headers={'Range': 'bytes=2-3', 'If-Range': etag})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'23')
+        # Weak validators never satisfy If-Range
+        response = self.client.get(url, headers={'Range': 'bytes=2-3', 'If-Range': 'W/' + etag})
+        self.assertEqual(response.status_code, 200)
+        last_modified = self.client.head(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, headers={'If-Modified-Since': last_modified}).status_code, 304)
+
+
+class DownloadCounterTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(DOWNLOAD_COUNT_FLUSH_INTERVAL=60)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Flush by hand instead of from the background thread
+        patcher = mock.patch.object(counters, '_ensure_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(counters._pending.clear)
+        self.first = self.upload(b'first')
+        self.second = self.upload(b'second', filename='second.txt')
+
+    def counts(self):
+        return dict(FileUpload.objects.values_list('pk', 'download_count'))
+
+    def test_downloads_are_written_in_batches(self):
+        for _ in range(3):
+            self.first.increment_download_count()
+        self.second.increment_download_count()
+        self.assertEqual(counters.pending_count(self.first.pk), 3)
+        self.assertEqual(self.counts(), {self.first.pk: 0, self.second.pk: 0})
+
+        self.assertEqual(counters.flush(), 2)
+        self.assertEqual(self.counts(), {self.first.pk: 3, self.second.pk: 1})
+        self.assertEqual(counters.pending_count(self.first.pk), 0)
+        self.assertEqual(stats.get_stats().total_downloads, 4)
+        self.assertEqual(counters.flush(), 0)
+
+    def test_full_save_keeps_flushed_counts(self):
+        self.first.increment_download_count()
+        counters.flush()
+        self.first.filename = 'renamed.txt'
+        self.first.save()
+        self.assertEqual(self.counts()[self.first.pk], 1)
+
+    def test_failed_flush_keeps_the_counts(self):
+        self.first.increment_download_count()
+        with mock.patch.object(counters, '_apply', side_effect=DatabaseError('down')):
+            with self.assertRaises(DatabaseError):
+                counters.flush()
+        self.assertEqual(counters.pending_count(self.first.pk), 1)
+        counters.flush()
+        self.assertEqual(self.counts()[self.first.pk], 1)
+
+
+class IncrementalStatsTests(MediaTestCase):
+    fields = stats.STATS_FIELDS
+
+    def assertMatchesRebuild(self):
+        incremental = stats.get_stats()
+        incremental = {field: getattr(incremental, field) for field in self.fields}
+        incremental_types = {row['file_type']: row['count'] for row in stats.top_file_types(100)}
+        rebuilt = stats.rebuild()
+        self.assertEqual(incremental, {field: getattr(rebuilt, field) for field in self.fields})
+        self.assertEqual(incremental_types, {row['file_type']: row['count'] for row in stats.top_file_types(100)})
+
+    def test_deltas_match_rebuild(self):
+        text = self.upload(b'text one')
+        self.upload(b'text two', filename='two.txt')
+        image = self.upload(b'\x89PNG', filename='a.png', file_type='image/png')
+        self.upload(b'hidden', filename='hidden.txt', is_active=False)
+        self.assertMatchesRebuild()
+
+        for _ in range(3):
+            image.increment_download_count()
+        text.filename = 'renamed.txt'
+        text.save()
+        self.assertMatchesRebuild()
+
+        # A stale instance saved after downloads must not roll the count back
+        stale = FileUpload.objects.get(pk=image.pk)
+        image.increment_download_count()
+        stale.file_type = 'image/x-png'
+        stale.save()
+        self.assertEqual(FileUpload.objects.get(pk=image.pk).download_count, 4)
+        self.assertMatchesRebuild()
+
+        stats.set_active(FileUpload.objects.filter(file_type='text/plain'), False)
+        self.assertMatchesRebuild()
+        stats.reset_downloads(FileUpload.objects.filter(pk=image.pk))
+        self.assertMatchesRebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertMatchesRebuild()
+
+    def test_stats_page_reads_the_rollup(self):
+        self.upload(b'one')
+        self.upload(b'\x89PNG', filename='a.png', file_type='image/png')
+        self.upload(b'hidden', is_active=False)
+        response = self.client.get('/stats/')
+        self.assertEqual(response.context['total_files'], 2)
+        self.assertEqual(response.context['total_size_mb'], round(7 / (1024 * 1024), 2))
+        self.assertEqual({row['file_type'] for row in response.context['file_types']}, {'text/plain', 'image/png'})
+
+
+class FileListApiTests(MediaTestCase):
+    url = '/api/files/'
+
+    def setUp(self):
+        super().setUp()
+        uploaded_at = timezone.now()
+        self.files = [self.upload(f'file {i}'.encode(), filename=f'{i}.txt') for i in range(5)]
+        # Two files share a timestamp: the id breaks the tie
+        for i, file_upload in enumerate(self.files):
+            FileUpload.objects.filter(pk=file_upload.pk).update(uploaded_at=uploaded_at + timedelta(seconds=min(i, 3)))
+        self.upload(b'hidden', filename='hidden.txt', is_active=False)
+
+    def test_pages_follow_the_cursor(self):
+        names, cursor = [], None
+        while True:
+            params = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+            data = self.client.get(self.url, params).json()
+            names += [row['filename'] for row in data['files']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(names, ['4.txt', '3.txt', '2.txt', '1.txt', '0.txt'])
+
+    def test_fields(self):
+        data = self.client.get(self.url, {'fields': 'id,sha256_hash'}).json()
+        newest = self.files[-1]
+        self.assertEqual(data['files'][0], {'id': str(newest.unique_id), 'sha256_hash': newest.sha256_hash})
+        row = self.client.get(self.url).json()['files'][0]
+        self.assertEqual(set(row), set(views.DEFAULT_API_FILE_FIELDS))
+        self.assertEqual(row['download_url'], f'http://testserver/download/{newest.unique_id}/')
+
+    def test_ndjson_streams_every_file(self):
+        response = self.client.get(self.url, {'format': 'ndjson', 'fields': 'filename'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['filename'] for line in lines], ['4.txt', '3.txt', '2.txt', '1.txt', '0.txt'])
+
+    def test_invalid_parameters(self):
+        bad_cursors = [
+            'not-base64!', views._encode_cursor(timezone.now(), 1)[:-4],
+            base64.urlsafe_b64encode(b'[1, 2, 3]').decode(),
+            base64.urlsafe_b64encode(b'["2024-01-01T00:00:00", 1]').decode(),
+            base64.urlsafe_b64encode(b'["2024-01-01T00:00:00+00:00", -1]').decode(),
+        ]
+        for params in [{'limit': 'ten'}, {'limit': 0}, {'limit': 1001}, {'fields': 'id,secret'}] + [{'cursor': c} for c in bad_cursors]:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.json())
+
+
+class SearchTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(setattr, search, '_backend', None)
+        search._backend = None
+        self.report = self.upload(b'1', filename='Quarterly Report.pdf', file_type='application/pdf')
+        self.photo = self.upload(b'2', filename='holiday photo.jpg', file_type='image/jpeg')
+        self.notes = self.upload(b'3', filename='report notes.txt')
+        self.upload(b'4', filename='old report.txt', is_active=False)
+
+    def backends(self):
+        backends = [search.LikeSearchBackend(), search.NgramSearchBackend()]
+        if search._table_exists(search.FTS_TABLE):
+            backends.append(search.SQLiteFTSSearchBackend())
+        return backends
+
+    def test_backends_match_substrings(self):
+        for backend in self.backends():
+            for query, expected in [
+                ('report', {self.report, self.notes}),
+                ('REPO', {self.report, self.notes}),
+                ('jpeg', {self.photo}),
+                ('e', {self.report, self.photo, self.notes}),
+                ('missing', set()),
+            ]:
+                results = search.SearchResults(query, backend)
+                with self.subTest(backend=backend.name, query=query):
+                    self.assertEqual(set(results[:10]), expected)
+                    self.assertEqual(results.count(), len(expected))
+
+    def test_ngram_ranks_prefix_matches_first(self):
+        results = search.SearchResults('report', search.NgramSearchBackend())
+        self.assertEqual(results[:10], [self.notes, self.report])
+
+    def test_ngram_index_follows_changes(self):
+        search._backend = backend = search.NgramSearchBackend()
+        self.assertEqual(search.SearchResults('holiday', backend).count(), 1)
+        self.photo.filename = 'vacation.jpg'
+        self.photo.save()
+        self.assertEqual(backend.page('vacation', 0, 10), [self.photo])
+        self.assertEqual(backend.page('holiday', 0, 10), [])
+
+        # A change made by another process only moves the shared generation
+        FileUpload.objects.filter(pk=self.notes.pk).update(filename='minutes.txt')
+        self.assertEqual(backend.page('minutes', 0, 10), [])
+        search.invalidate()
+        self.assertEqual(backend.page('minutes', 0, 10), [self.notes])
+
+    def test_file_list_search(self):
+        response = self.client.get('/files/', {'search': 'report'})
+        self.assertEqual(response.context['total_files'], 2)
+        self.assertEqual(set(response.context['page_obj']), {self.report, self.notes})
+
+
+class LinkHealthTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        routecache._route_cache = None
+        self.addCleanup(setattr, routecache, '_route_cache', None)
+        self.link = ShortLink.objects.create(code='ext', target_url='https://example.com/file.zip')
+
+    def check(self, ok, status_code):
+        with mock.patch.object(linkhealth, 'probe', return_value=(ok, status_code)) as probe:
+            counts = linkhealth.check_links(linkhealth.links_due(0), workers=2)
+        self.link.refresh_from_db()
+        return counts, probe
+
+    def test_resolving_makes_no_http_request(self):
+        with mock.patch('requests.Session.request', side_effect=AssertionError('outbound request')):
+            response = self.client.get('/share/ext/')
+            self.assertRedirects(response, 'https://example.com/file.zip', fetch_redirect_response=False)
+            ShortLink.objects.filter(pk=self.link.pk).update(status=ShortLink.STATUS_BROKEN)
+            routecache.invalidate_all()
+            self.assertTemplateUsed(self.client.get('/share/ext/'), 'file_sharing/file_deleted.html')
+
+    @override_settings(LINK_CHECK_FAILURE_THRESHOLD=2)
+    def test_repeated_failures_break_a_link(self):
+        self.assertEqual(self.check(False, 503)[0], (0, 0))
+        self.assertEqual((self.link.status, self.link.failure_count), (ShortLink.STATUS_UNKNOWN, 1))
+        self.assertEqual(self.check(False, None)[0], (0, 1))
+        self.assertEqual(self.link.status, ShortLink.STATUS_BROKEN)
+        self.assertEqual(self.check(True, 200)[0], (1, 0))
+        self.assertEqual((self.link.status, self.link.failure_count), (ShortLink.STATUS_OK, 0))
+        self.assertEqual(self.check(False, 404)[0], (0, 1))
+        self.assertEqual(self.link.status, ShortLink.STATUS_BROKEN)
+
+    def test_local_targets_are_checked_in_the_database(self):
+        file_upload = self.upload(b'contents')
+        local = ShortLink.objects.create(
+            code='local', target_url=f'http://testserver/download/{file_upload.unique_id}/', file_upload=file_upload,
+        )
+        self.link.delete()
+        file_upload.is_active = False
+        file_upload.save(update_fields=['is_active'])
+        with mock.patch.object(linkhealth, 'probe') as probe:
+            counts = linkhealth.check_links(linkhealth.links_due(0))
+        probe.assert_not_called()
+        self.assertEqual(counts, (0, 1))
+        local.refresh_from_db()
+        self.assertEqual(local.status, ShortLink.STATUS_BROKEN)
+
+    def test_links_due(self):
+        self.assertEqual(list(linkhealth.links_due(60)), [self.link])
+        ShortLink.objects.filter(pk=self.link.pk).update(last_checked_at=timezone.now() - timedelta(minutes=30))
+        self.assertEqual(list(linkhealth.links_due(60)), [])
+        self.assertEqual(list(linkhealth.links_due(10)), [self.link])
+
+
+class ShortLinkFileTests(MediaTestCase):
+    def test_new_links_to_local_downloads_reference_the_file(self):
+        file_upload = self.upload(b'contents')
+        response = self.client.post('/share/create/', {
+            'code': 'doc', 'target_url': f'http://localhost:8000/download/{file_upload.unique_id}/',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.client.post('/share/create/', {'code': 'ext', 'target_url': 'https://example.com/download/x/'})
+        self.assertEqual(ShortLink.objects.get(code='doc').file_upload, file_upload)
+        self.assertIsNone(ShortLink.objects.get(code='ext').file_upload)
+        with self.captureOnCommitCallbacks(execute=True):
+            file_upload.delete()
+        self.assertEqual(list(ShortLink.objects.values_list('code', flat=True)), ['ext'])
+
+
+class ShortLinkBackfillMigrationTests(TransactionTestCase):
+    migrate_from = [('file_sharing', '0010_shortlink_health')]
+    migrate_to = [('file_sharing', '0011_shortlink_file_upload')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        self.addCleanup(call_command, 'migrate', 'file_sharing', verbosity=0)
+        apps = executor.loader.project_state(self.migrate_from).apps
+        FileUpload = apps.get_model('file_sharing', 'FileUpload')
+        ShortLink = apps.get_model('file_sharing', 'ShortLink')
+        self.unique_id = uuid.uuid4()
+        FileUpload.objects.create(
+            file='uploads/a.txt', filename='a.txt', file_size=1, file_type='text/plain', unique_id=self.unique_id,
+        )
+        ShortLink.objects.create(code='local', target_url=f'http://10.0.0.5:8000/download/{self.unique_id}/')
+        ShortLink.objects.create(code='upper', target_url=f'http://files.example/download/{str(self.unique_id).upper()}/')
+        ShortLink.objects.create(code='gone', target_url=f'http://10.0.0.5:8000/download/{uuid.uuid4()}/')
+        ShortLink.objects.create(code='ext', target_url=f'https://example.com/mirror?u=/download/{self.unique_id}/')
+
+    def test_backfill_links_download_urls_to_their_files(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        apps = executor.loader.project_state(self.migrate_to).apps
+        ShortLink = apps.get_model('file_sharing', 'ShortLink')
+        linked = dict(ShortLink.objects.values_list('code', 'file_upload__unique_id'))
+        self.assertEqual(linked, {'local': self.unique_id, 'upper': self.unique_id, 'gone': None, 'ext': None})
+
+
+class JobQueueTests(MediaTestCase):
+    def test_jobs_run_in_order_and_record_results(self):
+        good = self.upload(b'good contents')
+        bad = self.upload(b'bad contents', filename='bad.txt')
+        with open(default_storage.path(bad.file.name), 'r+b') as f:
+            f.write(b'B')
+        batch, count = jobs.enqueue_for_files(Job.KIND_VERIFY_INTEGRITY, FileUpload.objects.order_by('pk'))
+        self.assertEqual(count, 2)
+        jobs.enqueue(Job.KIND_COLLECT_BLOBS)
+
+        jobs.work(burst=True)
+        results = list(Job.objects.order_by('pk').values_list('status', 'result', 'worker'))
+        self.assertEqual([result[:2] for result in results], [
+            (Job.STATUS_DONE, 'Verified'), (Job.STATUS_DONE, 'Corrupted'),
+            (Job.STATUS_DONE, '0 counts fixed, 0 blobs and 0 orphaned files deleted'),
+        ])
+        self.assertTrue(all(result[2] for result in results))
+        self.assertEqual(set(Job.objects.filter(batch=batch).values_list('progress_done', flat=True)), {13, 12})
+        self.assertIs(FileUpload.objects.get(pk=good.pk).integrity_ok, True)
+        self.assertIs(FileUpload.objects.get(pk=bad.pk).integrity_ok, False)
+
+    def test_claim_takes_each_job_once(self):
+        job = jobs.enqueue(Job.KIND_CLEANUP_UPLOADS)
+        self.assertEqual(jobs.claim('a').pk, job.pk)
+        self.assertIsNone(jobs.claim('b'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.attempts), (Job.STATUS_RUNNING, 'a', 1))
+
+    def test_failures_are_recorded_and_retried(self):
+        file_upload = self.upload(b'contents')
+        job = jobs.enqueue(Job.KIND_RECALCULATE_HASHES, file_upload)
+        os.remove(default_storage.path(file_upload.file.name))
+        self.assertFalse(jobs.run(jobs.claim('a')))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertIn('FileNotFoundError', job.error)
+        self.assertEqual(jobs.retry(Job.objects.all()), 1)
+        self.assertEqual(jobs.claim('a').attempts, 2)
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = jobs.enqueue(Job.KIND_CLEANUP_UPLOADS)
+        jobs.claim('crashed')
+        self.assertEqual(jobs.requeue_stale(), 0)
+        Job.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.claim('b').pk, job.pk)
+
+
+class VerifyStoreCommandTests(MediaTestCase):
+    def verify(self, *args):
+        out = StringIO()
+        call_command('verify_store', '--processes', '2', '--no-progress', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_report_lists_corrupted_and_missing_files(self):
+        self.upload(b'intact contents')
+        corrupted = self.upload(b'corrupted contents', filename='corrupted.txt')
+        missing = self.upload(b'missing contents', filename='missing.txt')
+        with open(default_storage.path(corrupted.file.name), 'r+b') as f:
+            f.write(b'C')
+        os.remove(default_storage.path(missing.file.name))
+
+        report = json.loads(self.verify('--all', '--report', '-'))
+        self.assertEqual((report['verified'], report['corrupted'], report['missing']), (1, 1, 1))
+        self.assertEqual(report['bytes_hashed'], len(b'intact contents') + len(b'corrupted contents'))
+        self.assertEqual(
+            sorted((problem['filename'], problem['status']) for problem in report['problems']),
+            [('corrupted.txt', 'corrupted'), ('missing.txt', 'missing')],
+        )
+        self.assertIs(FileUpload.objects.get(pk=corrupted.pk).integrity_ok, False)
+        with self.assertRaises(CommandError):
+            self.verify('--all', '--fail-on-corruption')
+
+    def test_incremental_skips_unchanged_files(self):
+        file_upload = self.upload(b'contents')
+        # Uploads are verified when stored
+        self.assertIn('0 files verified, 0 files corrupted, 0 missing, 1 unchanged', self.verify('--incremental'))
+        FileUpload.objects.update(verified_mtime=None)
+        self.assertIn('1 files verified', self.verify('--incremental'))
+        self.assertIn('1 unchanged', self.verify('--incremental'))
+
+        path = default_storage.path(file_upload.file.name)
+        with open(path, 'r+b') as f:
+            f.write(b'C')
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        self.assertIn('1 files corrupted', self.verify('--incremental'))
+
+    def test_max_age_skips_recently_verified_files(self):
+        self.upload(b'contents')
+        self.assertIn('0 files verified', self.verify('--max-age', '1'))
+        FileUpload.objects.update(last_verified_at=timezone.now() - timedelta(hours=2))
+        self.assertIn('1 files verified', self.verify('--max-age', '1'))
+
+
+class AdminIntegrityStatusTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+    def test_changelist_shows_stored_state_without_reading_files(self):
+        verified = self.upload(b'verified contents', filename='verified.txt')
+        corrupted = self.upload(b'corrupted contents', filename='corrupted.txt')
+        unverified = self.upload(b'unverified contents', filename='unverified.txt')
+        FileUpload.objects.filter(pk=corrupted.pk).update(integrity_ok=False)
+        FileUpload.objects.filter(pk=unverified.pk).update(integrity_ok=None, last_verified_at=None)
+        # Keep the verified file's state but remove it from disk: the column must not notice
+        os.remove(default_storage.path(verified.file.name))
+
+        with mock.patch('file_sharing.storage.stat', side_effect=AssertionError('stat called')), \
+                mock.patch('file_sharing.storage.hash_stored', side_effect=AssertionError('hash called')):
+            response = self.client.get('/admin/file_sharing/fileupload/')
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('integrity-verified', content)
+        self.assertIn('integrity-corrupted', content)
+        self.assertIn('Not Verified', content)
+
+
+class RawPutTests(MediaTestCase):
+    def put(self, data, **headers):
+        return self.client.put(
+            '/api/files/data.bin', data, content_type='application/octet-stream',
+            CONTENT_LENGTH=str(len(data)), headers=headers,
+        )
+
+    def test_matching_digests_store_the_file(self):
+        data = b'raw body'
+        response = self.put(
+            data,
+            **{'Content-MD5': base64.b64encode(hashlib.md5(data).digest()).decode(),
+               'Digest': 'sha-256=' + base64.b64encode(hashlib.sha256(data).digest()).decode()},
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['sha256_hash'], hashlib.sha256(data).hexdigest())
+
+    def test_content_md5_mismatch_is_rejected(self):
+        response = self.put(b'raw body', **{'Content-MD5': base64.b64encode(hashlib.md5(b'other').digest()).decode()})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('md5', response.json()['error'])
+        self.assertFalse(FileUpload.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+        incoming = os.path.join(self.media_root, blobs.INCOMING_DIR)
+        self.assertEqual(os.listdir(incoming) if os.path.isdir(incoming) else [], [])
+
+    def test_malformed_headers(self):
+        self.assertEqual(self.put(b'x', **{'Content-MD5': 'not base64!'}).status_code, 400)
+        response = self.client.put(
+            '/api/files/data.bin', b'', content_type='application/octet-stream', CONTENT_LENGTH='abc'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncViewTests(TransactionTestCase):
+    # The views reach the database from the file I/O pool, which cannot see a test transaction
+    def setUp(self):
+        MediaTestCase.setUp(self)
+        self.factory = AsyncRequestFactory()
+
+    def upload(self, content):
+        file_upload = FileUpload(
+            file=SimpleUploadedFile('file.txt', content), filename='file.txt', file_size=len(content),
+            file_type='text/plain',
+        )
+        file_upload.save()
+        return file_upload
+
+    def call(self, view, request, *args):
+        return async_to_sync(view)(request, *args)
+
+    def test_download_streams_from_the_file_io_pool(self):
+        file_upload = self.upload(b'async contents')
+        response = self.call(views.download_file_async, self.factory.get('/'), file_upload.unique_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        self.assertEqual(async_to_sync(read)(), b'async contents')
+        self.assertEqual(FileUpload.objects.get(pk=file_upload.pk).download_count, 1)
+
+    def test_api_upload_stores_the_file(self):
+        request = self.factory.post('/api/upload/', {'file': SimpleUploadedFile('data.bin', b'uploaded asynchronously')})
+        response = self.call(views.api_upload_async, request)
+        self.assertEqual(response.status_code, 200)
+        file_upload = FileUpload.objects.get(unique_id=json.loads(response.content)['file_id'])
+        self.assertEqual(file_upload.sha256_hash, hashlib.sha256(b'uploaded asynchronously').hexdigest())
+
+        response = self.call(views.api_upload_async, self.factory.post('/api/upload/', {}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_chunked_upload_completes_the_session(self):
+        data = b'0123456789'
+        for chunk_number, start in enumerate(range(0, len(data), 4)):
+            request = self.factory.post('/api/chunked-upload/', {
+                'file_id': 'async-upload', 'chunk_number': chunk_number, 'total_chunks': 3, 'chunk_size': 4,
+                'file_size': len(data), 'filename': 'data.bin',
+                'chunk': SimpleUploadedFile('blob', data[start:start + 4]),
+            })
+            response = self.call(views.chunked_upload_async, request)
+            self.assertEqual(response.status_code, 200)
+        file_upload = FileUpload.objects.get(unique_id=json.loads(response.content)['file_id'])
+        with file_upload.file.open('rb') as f:
+            self.assertEqual(f.read(), data)
+
+        request = self.factory.post('/api/chunked-upload/', {'file_id': 'async-upload', 'chunk_number': 'x'})
+        self.assertEqual(self.call(views.chunked_upload_async, request).status_code, 400)
+
+    def test_run_db_closes_old_connections_around_the_call(self):
+        with mock.patch('file_sharing.aio.close_old_connections') as close_old_connections:
+            self.assertEqual(async_to_sync(aio.run_db)(lambda: close_old_connections.call_count), 1)
+        self.assertEqual(close_old_connections.call_count, 2)
+
+
+class S3StorageTests(MediaTestCase):
+    """S3Storage against the s3_standin server"""
+
+    def setUp(self):
+        super().setUp()
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StandinHandler)
+        server.daemon_threads = True
+        server.root = tempfile.mkdtemp()
+        server.bucket, server.access_key, server.secret_key, server.verbose = 'files', 'key', 'secret', False
+        self.addCleanup(shutil.rmtree, server.root, ignore_errors=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.options = {
+            'endpoint_url': f'http://127.0.0.1:{server.server_port}', 'bucket': 'files',
+            'access_key': 'key', 'secret_key': 'secret',
+        }
+        self.s3 = s3.S3Storage(**self.options)
+        self.s3.create_bucket()
+
+    def test_objects_round_trip(self):
+        self.s3.save('dir/a.txt', ContentFile(b'0123456789'))
+        self.s3.save('b.txt', ContentFile(b'b'))
+        self.assertTrue(self.s3.exists('dir/a.txt'))
+        self.assertEqual(self.s3.size('dir/a.txt'), 10)
+        self.assertEqual(self.s3.stat('dir/a.txt')[1], 10)
+        self.assertEqual(self.s3.listdir(''), (['dir'], ['b.txt']))
+        with self.s3.open('dir/a.txt') as f:
+            f.seek(4)
+            self.assertEqual(f.read(3), b'456')
+            self.assertEqual(f.read(), b'789')
+
+        self.s3.delete('dir/a.txt')
+        self.assertFalse(self.s3.exists('dir/a.txt'))
+        with self.assertRaises(FileNotFoundError):
+            self.s3.stat('dir/a.txt')
+
+    def test_large_files_use_multipart_upload(self):
+        data = os.urandom(s3.MIN_PART_SIZE + 1000)
+        path = os.path.join(self.media_root, 'large.bin')
+        with open(path, 'wb') as f:
+            f.write(data)
+        with open(path, 'rb') as f:
+            self.s3.save('large.bin', File(f, name='large.bin'))
+        with self.s3.open('large.bin') as f:
+            self.assertEqual(hashlib.sha256(f.read()).hexdigest(), hashlib.sha256(data).hexdigest())
+
+    def test_presigned_url_needs_no_credentials(self):
+        self.s3.save('a.txt', ContentFile(b'presigned'))
+        response = requests.get(self.s3.presigned_url('a.txt', filename='report.txt'))
+        self.assertEqual(response.content, b'presigned')
+        self.assertIn('report.txt', response.headers['Content-Disposition'])
+        url = self.s3.presigned_url('a.txt').replace('X-Amz-Expires=3600', 'X-Amz-Expires=7200')
+        self.assertEqual(requests.get(url).status_code, 403)
+
+    def test_uploads_are_stored_in_the_bucket(self):
+        with override_settings(STORAGES={
+            **settings.STORAGES, 'default': {'BACKEND': 'file_sharing.s3.S3Storage', 'OPTIONS': self.options},
+        }):
+            file_upload = self.upload(b'stored remotely')
+            self.assertIsNone(storage.local_path(file_upload.file.name))
+            self.assertTrue(self.s3.exists(file_upload.file.name))
+            self.assertEqual(storage.stat(file_upload.file.name)[1], len(b'stored remotely'))
+            self.assertEqual(
+                storage.hash_stored(file_upload.file.name)[1], hashlib.sha256(b'stored remotely').hexdigest()
+            )
+            self.assertTrue(storage.download_url(file_upload.file.name, 'file.txt').startswith(self.options['endpoint_url']))
@@ -0,0 +1,69 @@
+import hashlib
+import os
+import tempfile
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, MemoryFileUploadHandler, TemporaryFileUploadHandler
+from .blobs import INCOMING_DIR
+from .storage import staging_path
+from . import ingest
+
+
+class HashingUploadMixin:
+    """Feed MD5 and SHA256 digests incrementally as upload chunks arrive"""
+
+    def new_file(self, *args, **kwargs):
+        # Reset before super(): MemoryFileUploadHandler raises StopFutureHandlers
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super().receive_data_chunk(raw_data, start)
+        # A handler that keeps the chunk returns None; only that one hashes it
+        if remaining is None:
+            self.md5.update(raw_data)
+            self.sha256.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.md5_hash = self.md5.hexdigest()
+            uploaded_file.sha256_hash = self.sha256.hexdigest()
+        return uploaded_file
+
+
+class SpooledUploadedFile(TemporaryUploadedFile):
+    """Temporary upload created in the staging directory, so storing it locally is a rename and not a copy"""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        directory = staging_path(INCOMING_DIR)
+        os.makedirs(directory, exist_ok=True)
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + ext, dir=directory)
+        super(TemporaryUploadedFile, self).__init__(file, name, content_type, size, charset, content_type_extra)
+
+
+class BudgetedMemoryFileUploadHandler(MemoryFileUploadHandler):
+    """Keeps small uploads in memory only while the process-wide memory budget has room"""
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        super().handle_raw_input(input_data, META, content_length, boundary, encoding)
+        if self.activated:
+            self.activated = ingest.hold_memory(self.request, content_length)
+
+
+class SpoolingFileUploadHandler(TemporaryFileUploadHandler):
+    """Streams uploads into SpooledUploadedFile instead of FILE_UPLOAD_TEMP_DIR"""
+
+    def new_file(self, *args, **kwargs):
+        FileUploadHandler.new_file(self, *args, **kwargs)
+        self.file = SpooledUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, BudgetedMemoryFileUploadHandler):
+    """In-memory upload handler that hashes the bytes it keeps"""
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, SpoolingFileUploadHandler):
+    """Temporary-file upload handler that hashes the bytes it writes"""
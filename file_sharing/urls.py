@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, re_path
 from . import views
 
@@ -11,7 +12,7 @@ urlpatterns = [
     path('stats/', views.stats, name='stats'),
     
     # File operations
-    path('download/<uuid:unique_id>/', views.download_file, name='download_file'),
+    path('download/<uuid:unique_id>/', views.download_file_async if settings.ASYNC_VIEWS else views.download_file, name='download_file'),
     path('delete/<uuid:unique_id>/', views.delete_file, name='delete_file'),
     
     # Short link operations
@@ -21,8 +22,14 @@ urlpatterns = [
     re_path(r'^share/create/share/(?P<code>[^/]+)/$', views.redirect_to_short_link),
     
     # API endpoints
-    path('api/upload/', views.api_upload, name='api_upload'),
+    path('api/upload/', views.api_upload_async if settings.ASYNC_VIEWS else views.api_upload, name='api_upload'),
+    path('api/upload/precheck/', views.api_upload_precheck, name='api_upload_precheck'),
     path('api/files/', views.api_file_list, name='api_file_list'),
-    path('api/chunked-upload/', views.chunked_upload, name='chunked_upload'),
+    path('api/files/<str:filename>', views.api_put_file, name='api_put_file'),
+    path('api/chunked-upload/', views.chunked_upload_async if settings.ASYNC_VIEWS else views.chunked_upload, name='chunked_upload'),
+    path('api/chunked-upload/<str:upload_id>/', views.upload_session_status, name='upload_session_status'),
     path('api/upload-progress/', views.upload_progress, name='upload_progress'),
+    path('api/upload-progress/<str:upload_id>/', views.upload_progress, name='upload_progress_detail'),
+    path('api/upload-progress/<str:upload_id>/stream/', views.upload_progress_stream, name='upload_progress_stream'),
+    path('api/shortlink-cache/', views.shortlink_cache_stats, name='shortlink_cache_stats'),
 ] 
\ No newline at end of file
@@ -1,22 +1,57 @@
-from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, JsonResponse, Http404, FileResponse
+import asyncio
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
+from django.http import HttpResponse, JsonResponse, Http404, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+from django.conf import settings
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.files.storage import default_storage
 from django.core.paginator import Paginator
 from django.utils import timezone
-from django.db.models import Q, Sum, Count
+from django.db import transaction
+from django.db.models import Q
 import os
 import mimetypes
-from .models import FileUpload, ShortLink
-from .forms import FileUploadForm, ShortLinkForm
 import json
-import tempfile
-import shutil
-import socket
-from urllib.parse import urlparse
+import time
+import base64
+import binascii
 import re
-import requests
+from datetime import datetime
+from .models import FileUpload, ShortLink, UploadSession
+from .forms import FileUploadForm, ShortLinkForm
+from . import aio, integrity, chunked, progress, downloads
+from . import stats as stats_rollup
+from . import search
+from . import linkhealth, routecache
+from . import blobs, ingest
+import socket
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # Matches the 1MB chunks sent by the upload page
+PROGRESS_STREAM_INTERVAL = 0.5  # Seconds between progress checks while a progress stream waits
+PROGRESS_STREAM_TIMEOUT = 5  # Longest a progress stream waits for a change before it ends
+PROGRESS_STREAM_RETRY_MS = 500  # Reconnection delay suggested to EventSource clients
+
+# File list API: output field -> FileUpload column
+API_FILE_FIELDS = {
+    'id': 'unique_id',
+    'filename': 'filename',
+    'file_size': 'file_size',
+    'file_type': 'file_type',
+    'uploaded_at': 'uploaded_at',
+    'download_count': 'download_count',
+    'download_url': 'unique_id',
+    'md5_hash': 'md5_hash',
+    'sha256_hash': 'sha256_hash',
+}
+DEFAULT_API_FILE_FIELDS = ('id', 'filename', 'file_size', 'file_type', 'uploaded_at', 'download_count', 'download_url')
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+# Digest header algorithms (RFC 3230) checked on raw uploads
+DIGEST_ALGORITHMS = {'md5': 'md5', 'sha-256': 'sha256'}
 
 def get_local_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -38,14 +73,10 @@ def home(request):
             file_upload = form.save(commit=False)
             file_upload.file_size = request.FILES['file'].size
             file_upload.file_type = request.FILES['file'].content_type or 'application/octet-stream'
+            # Hashes are computed while the upload streams in and stored with the row
             file_upload.save()
             
-            # Calculate hashes for file integrity
-            md5_hash, sha256_hash = file_upload.calculate_hashes()
-            if md5_hash and sha256_hash:
-                file_upload.md5_hash = md5_hash
-                file_upload.sha256_hash = sha256_hash
-                file_upload.save(update_fields=['md5_hash', 'sha256_hash'])
+            if file_upload.md5_hash and file_upload.sha256_hash:
                 messages.success(request, f'File "{file_upload.filename}" uploaded successfully with integrity verification!')
             else:
                 messages.warning(request, f'File "{file_upload.filename}" uploaded but hash calculation failed.')
@@ -68,27 +99,31 @@ def home(request):
 
 def file_list(request):
     """Display all uploaded files, only active files."""
-    search_query = request.GET.get('search', '')
-    files = FileUpload.objects.filter(is_active=True)
+    search_query = request.GET.get('search', '').strip()
+    if search_query:
+        # Indexed, ranked search (see search.py); counts are cached
+        files = search.search(search_query)
+    else:
+        files = FileUpload.objects.filter(is_active=True).order_by('-uploaded_at', '-id')
     
+    # Totals: the stats rollup covers the unfiltered list, searches cache their own
     if search_query:
-        files = files.filter(
-            Q(filename__icontains=search_query) |
-            Q(file_type__icontains=search_query)
-        )
+        total_files, total_downloads = files.totals()
+    else:
+        storage_stats = stats_rollup.get_stats()
+        total_files = storage_stats.active_files
+        total_downloads = storage_stats.active_downloads
     
-    # Pagination
+    # Pagination, reusing the known total instead of a COUNT(*) query
     paginator = Paginator(files, 20)  # Show 20 files per page
+    paginator.count = total_files
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
-
-    # Calculate total downloads
-    total_downloads = files.aggregate(Sum('download_count'))['download_count__sum'] or 0
     
     context = {
         'page_obj': page_obj,
         'search_query': search_query,
-        'total_files': files.count(),
+        'total_files': total_files,
         'total_downloads': total_downloads,
     }
     return render(request, 'file_sharing/file_list.html', context)
@@ -99,30 +134,34 @@ def download_file(request, unique_id):
         file_upload = get_object_or_404(FileUpload, unique_id=unique_id, is_active=True)
         
         # Check if file exists
-        if not os.path.exists(file_upload.file.path):
+        if not default_storage.exists(file_upload.file.name):
             raise Http404("File not found")
         
-        # Verify file integrity if hashes are available
-        if file_upload.md5_hash and file_upload.sha256_hash:
-            if not file_upload.verify_file_integrity():
-                messages.error(request, 'File integrity check failed. The file may be corrupted.')
-                return redirect('file_sharing:file_list')
+        # Check file integrity according to FILE_INTEGRITY_MODE
+        if not integrity.allow_download(file_upload):
+            messages.error(request, 'File integrity check failed. The file may be corrupted.')
+            return redirect('file_sharing:file_list')
         
-        # Increment download count
-        file_upload.increment_download_count()
+        # Stream the file, answering Range and conditional requests (counts the download)
+        return downloads.serve_file(request, file_upload)
         
-        # Prepare response using FileResponse for efficient streaming
-        response = FileResponse(open(file_upload.file.path, 'rb'), content_type=file_upload.file_type)
-        response['Content-Disposition'] = f'attachment; filename="{file_upload.filename}"'
-        response['Content-Length'] = file_upload.file_size
+    except Exception as e:
+        messages.error(request, f'Error downloading file: {str(e)}')
+        return redirect('file_sharing:file_list')
+
+async def download_file_async(request, unique_id):
+    """download_file for ASGI: checks run on the file I/O pool and the body streams without holding a thread"""
+    try:
+        file_upload = await aget_object_or_404(FileUpload, unique_id=unique_id, is_active=True)
+        
+        if not await aio.run(default_storage.exists, file_upload.file.name):
+            raise Http404("File not found")
         
-        # Add hash information to headers for client verification
-        if file_upload.md5_hash:
-            response['X-File-MD5'] = file_upload.md5_hash
-        if file_upload.sha256_hash:
-            response['X-File-SHA256'] = file_upload.sha256_hash
+        if not await aio.run_db(integrity.allow_download, file_upload):
+            messages.error(request, 'File integrity check failed. The file may be corrupted.')
+            return redirect('file_sharing:file_list')
         
-        return response
+        return await downloads.aserve_file(request, file_upload)
         
     except Exception as e:
         messages.error(request, f'Error downloading file: {str(e)}')
@@ -133,13 +172,8 @@ def delete_file(request, unique_id):
     if request.method == 'POST':
         try:
             file_upload = get_object_or_404(FileUpload, unique_id=unique_id, is_active=True)
-            # Delete the physical file
-            if os.path.exists(file_upload.file.path):
-                os.remove(file_upload.file.path)
-            # Delete all short links pointing to this file's download URL
-            download_url = f"/download/{file_upload.unique_id}/"
-            ShortLink.objects.filter(target_url__icontains=download_url).delete()
-            # Delete the database record
+            # Delete the database record; short links cascade and the stored
+            # contents are removed once no other upload shares them
             filename = file_upload.filename
             file_upload.delete()
             messages.success(request, f'File "{filename}" and related short links deleted successfully!')
@@ -147,6 +181,22 @@ def delete_file(request, unique_id):
             messages.error(request, f'Error deleting file: {str(e)}')
     return redirect('file_sharing:file_list')
 
+def _upload_result(request, file_upload):
+    """JSON body describing a newly uploaded file"""
+    return {
+        'success': True,
+        'file_id': str(file_upload.unique_id),
+        'filename': file_upload.filename,
+        'file_size': file_upload.file_size,
+        'download_url': request.build_absolute_uri(f'/download/{file_upload.unique_id}/'),
+        'md5_hash': file_upload.md5_hash,
+        'sha256_hash': file_upload.sha256_hash
+    }
+
+def _parse_upload(request):
+    """Parse the multipart body; blocking, so async views run it on the file I/O pool"""
+    return request.POST, request.FILES
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def api_upload(request):
@@ -164,46 +214,237 @@ def api_upload(request):
             file_size=uploaded_file.size,
             file_type=uploaded_file.content_type or 'application/octet-stream'
         )
+        # Hashes are computed while the upload streams in and stored with the row
         file_upload.save()
         
-        # Calculate hashes for file integrity
-        md5_hash, sha256_hash = file_upload.calculate_hashes()
-        if md5_hash and sha256_hash:
-            file_upload.md5_hash = md5_hash
-            file_upload.sha256_hash = sha256_hash
-            file_upload.save(update_fields=['md5_hash', 'sha256_hash'])
+        return JsonResponse(_upload_result(request, file_upload))
         
-        return JsonResponse({
-            'success': True,
-            'file_id': str(file_upload.unique_id),
-            'filename': file_upload.filename,
-            'file_size': file_upload.file_size,
-            'download_url': request.build_absolute_uri(f'/download/{file_upload.unique_id}/'),
-            'md5_hash': md5_hash,
-            'sha256_hash': sha256_hash
-        })
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def api_upload_async(request):
+    """api_upload for ASGI: parsing and storing the file run on the file I/O pool"""
+    try:
+        _, files = await aio.run(_parse_upload, request)
+        if 'file' not in files:
+            return JsonResponse({'error': 'No file provided'}, status=400)
         
+        uploaded_file = files['file']
+        file_upload = FileUpload(
+            file=uploaded_file,
+            filename=uploaded_file.name,
+            file_size=uploaded_file.size,
+            file_type=uploaded_file.content_type or 'application/octet-stream'
+        )
+        await aio.run_db(file_upload.save)
+        return JsonResponse(_upload_result(request, file_upload))
+        
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def api_upload_precheck(request):
+    """Create a file from contents already stored, given their size and SHA256, without any transfer"""
+    try:
+        data = json.loads(request.body) if request.content_type == 'application/json' else request.POST
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return JsonResponse({'error': 'Request body is not valid JSON'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Request body must be a JSON object'}, status=400)
+    try:
+        file_size = int(data.get('file_size'))
+        if file_size < 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'file_size must be a non-negative integer'}, status=400)
+    
+    sha256_hash = (data.get('sha256_hash') or '').lower()
+    if not sha256_hash:
+        # Size only: tells the client whether hashing the file can pay off
+        return JsonResponse({'exists': False, 'candidates': blobs.has_size(file_size)})
+    if not SHA256_RE.match(sha256_hash):
+        return JsonResponse({'error': 'sha256_hash must be 64 hex digits'}, status=400)
+    filename = data.get('filename')
+    if not filename:
+        return JsonResponse({'error': 'filename is required'}, status=400)
+    
+    # Creating a file this way is admitted like an upload of the same size
+    inflight = ingest.inflight_budget()
+    rejected, reserved = ingest.admit_upload(file_size, inflight, getattr(settings, 'UPLOAD_BACKPRESSURE_TIMEOUT', 0))
+    if rejected:
+        return rejected
+    try:
+        # The reference and the row using it commit together, see blobs.collect()
+        with transaction.atomic():
+            blob = blobs.acquire_by_digest(sha256_hash, file_size)
+            if blob is None:
+                return JsonResponse({'exists': False, 'candidates': True})
+            
+            file_upload = FileUpload(
+                filename=filename,
+                file_size=file_size,
+                file_type=data.get('file_type') or 'application/octet-stream'
+            )
+            file_upload.use_blob(blob)
+            file_upload.save()
+    finally:
+        inflight.release(reserved)
+    
+    return JsonResponse({'exists': True, **_upload_result(request, file_upload)}, status=201)
+
+def _expected_digests(request):
+    """Raw digests a client sent in Content-MD5 and Digest headers, as {'md5': ..., 'sha256': ...}"""
+    expected = {}
+    values = []
+    if request.headers.get('Content-MD5'):
+        values.append(('md5', request.headers['Content-MD5']))
+    for item in request.headers.get('Digest', '').split(','):
+        algorithm, _, value = item.strip().partition('=')
+        if algorithm.lower() in DIGEST_ALGORITHMS:
+            values.append((DIGEST_ALGORITHMS[algorithm.lower()], value))
+    for name, value in values:
+        try:
+            digest = base64.b64decode(value.strip(), validate=True)
+        except (binascii.Error, ValueError):
+            raise ValueError(f'Malformed {name} digest')
+        if expected.get(name, digest) != digest:
+            raise ValueError(f'Conflicting {name} digests')
+        expected[name] = digest
+    return expected
+
+@csrf_exempt
+@require_http_methods(["PUT"])
+def api_put_file(request, filename):
+    """Raw upload: the request body is the file, streamed to storage without multipart parsing"""
+    if 'CONTENT_LENGTH' not in request.META:
+        return JsonResponse({'error': 'Content-Length is required'}, status=411)
+    try:
+        file_size = int(request.META['CONTENT_LENGTH'] or 0)
+    except ValueError:
+        file_size = -1
+    if file_size < 0:
+        return JsonResponse({'error': 'Content-Length must be a non-negative integer'}, status=400)
+    if len(filename) > 255:
+        return JsonResponse({'error': 'File name is too long'}, status=400)
+    try:
+        expected = _expected_digests(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    try:
+        path, md5_digest, sha256_digest = blobs.write_stream(request, file_size)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    actual = {'md5': md5_digest, 'sha256': sha256_digest}
+    mismatched = [name for name, digest in expected.items() if actual[name] != digest]
+    if mismatched:
+        os.remove(path)
+        return JsonResponse({'error': f'Body does not match the {" and ".join(mismatched)} digest'}, status=400)
+    
+    try:
+        # A failed save rolls back the new reference; `gc_blobs` removes a file left without a row
+        with transaction.atomic():
+            blob, created = blobs.adopt(path, md5_digest.hex(), sha256_digest.hex())
+            file_upload = FileUpload(
+                filename=filename,
+                file_size=file_size,
+                file_type=request.content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            )
+            file_upload.use_blob(blob, fresh=created)
+            file_upload.save()
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+    
+    return JsonResponse(_upload_result(request, file_upload), status=201)
+
+def _encode_cursor(uploaded_at, pk):
+    """Opaque keyset cursor pointing just after the row (uploaded_at, pk)"""
+    return base64.urlsafe_b64encode(json.dumps([uploaded_at.isoformat(), pk]).encode()).decode()
+
+def _decode_cursor(cursor):
+    try:
+        uploaded_at, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        uploaded_at, pk = datetime.fromisoformat(uploaded_at), int(pk)
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError('Invalid cursor')
+    # Cursors are only ever issued for stored rows: an aware timestamp and a 64-bit id
+    if timezone.is_naive(uploaded_at) or not 0 <= pk < 2 ** 63:
+        raise ValueError('Invalid cursor')
+    return uploaded_at, pk
+
+def _api_file_row(row, fields, download_base):
+    """Serialise one .values() row of FileUpload for the file list API"""
+    data = {}
+    for field in fields:
+        if field == 'id':
+            data['id'] = str(row['unique_id'])
+        elif field == 'download_url':
+            data['download_url'] = f"{download_base}{row['unique_id']}/"
+        elif field == 'uploaded_at':
+            data['uploaded_at'] = row['uploaded_at'].isoformat()
+        else:
+            data[field] = row[API_FILE_FIELDS[field]]
+    return data
 
 def api_file_list(request):
-    """API endpoint to get list of files"""
+    """
+    API endpoint to get list of files, newest first.
+    
+    Query parameters:
+    - limit: page size (default 100, max 1000)
+    - cursor: value of next_cursor from the previous page
+    - fields: comma-separated subset of fields to return
+    - format=ndjson: stream every matching file as one JSON object per line
+    """
     try:
-        files = FileUpload.objects.filter(is_active=True).order_by('-uploaded_at')
-        file_list = []
+        fields = request.GET.get('fields')
+        fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else list(DEFAULT_API_FILE_FIELDS)
+        unknown = [f for f in fields if f not in API_FILE_FIELDS]
+        if unknown:
+            return JsonResponse({'error': f'Unknown fields: {", ".join(unknown)}'}, status=400)
+        
+        stream = request.GET.get('format') == 'ndjson'
+        limit = request.GET.get('limit')
+        try:
+            limit = int(limit) if limit else (None if stream else API_PAGE_SIZE)
+        except ValueError:
+            limit = 0
+        if limit is not None and (limit < 1 or (not stream and limit > API_MAX_PAGE_SIZE)):
+            return JsonResponse({'error': f'limit must be between 1 and {API_MAX_PAGE_SIZE}'}, status=400)
+        
+        # Keyset pagination on (uploaded_at, id): every page is an index range scan
+        files = FileUpload.objects.filter(is_active=True).order_by('-uploaded_at', '-id')
+        cursor = request.GET.get('cursor')
+        if cursor:
+            try:
+                uploaded_at, pk = _decode_cursor(cursor)
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+            files = files.filter(Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, id__lt=pk))
         
-        for file_upload in files:
-            file_list.append({
-                'id': str(file_upload.unique_id),
-                'filename': file_upload.filename,
-                'file_size': file_upload.file_size,
-                'file_type': file_upload.file_type,
-                'uploaded_at': file_upload.uploaded_at.isoformat(),
-                'download_count': file_upload.download_count,
-                'download_url': request.build_absolute_uri(f'/download/{file_upload.unique_id}/')
-            })
+        columns = {'id', 'uploaded_at'} | {API_FILE_FIELDS[f] for f in fields}
+        rows = files.values(*columns)
+        download_base = request.build_absolute_uri('/download/')
         
-        return JsonResponse({'files': file_list})
+        if stream:
+            if limit is not None:
+                rows = rows[:limit]
+            lines = (json.dumps(_api_file_row(row, fields, download_base)) + '\n' for row in rows.iterator(chunk_size=2000))
+            return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+        
+        page = list(rows[:limit + 1])
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = _encode_cursor(page[-1]['uploaded_at'], page[-1]['id'])
+        
+        return JsonResponse({
+            'files': [_api_file_row(row, fields, download_base) for row in page],
+            'next_cursor': next_cursor,
+        })
         
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
@@ -214,18 +455,14 @@ def about(request):
 
 def stats(request):
     """Statistics page showing file sharing statistics"""
-    total_files = FileUpload.objects.filter(is_active=True).count()
-    total_downloads = FileUpload.objects.filter(is_active=True).aggregate(
-        total=Sum('download_count')
-    )['total'] or 0
-    total_size = FileUpload.objects.filter(is_active=True).aggregate(
-        total=Sum('file_size')
-    )['total'] or 0
+    # Read the incrementally maintained rollup instead of aggregating FileUpload
+    storage_stats = stats_rollup.get_stats()
+    total_files = storage_stats.active_files
+    total_downloads = storage_stats.active_downloads
+    total_size = storage_stats.active_size
     
     # File type statistics with percentages
-    file_types = FileUpload.objects.filter(is_active=True).values('file_type').annotate(
-        count=Count('id')
-    ).order_by('-count')[:10]
+    file_types = stats_rollup.top_file_types(10)
     
     # Calculate percentages for each file type
     for file_type in file_types:
@@ -246,161 +483,237 @@ def stats(request):
     }
     return render(request, 'file_sharing/stats.html', context)
 
+def _chunked_upload_result(request, file_upload):
+    """JSON body returned once a chunked upload has been assembled"""
+    return JsonResponse({
+        'success': True,
+        'complete': True,
+        'file_id': str(file_upload.unique_id),
+        'filename': file_upload.filename,
+        'file_size': file_upload.file_size,
+        'download_url': request.build_absolute_uri(f'/download/{file_upload.unique_id}/'),
+        'md5_hash': file_upload.md5_hash,
+        'sha256_hash': file_upload.sha256_hash,
+        'message': 'File uploaded successfully with integrity verification!'
+    })
+
+def _chunk_progress_result(session, chunk_number):
+    """JSON response for a chunk that did not complete its upload"""
+    return JsonResponse({
+        'success': True,
+        'complete': False,
+        'chunk_number': chunk_number,
+        'total_chunks': session.total_chunks,
+        'received_chunks': session.received_count,
+        'progress': round(session.received_count / session.total_chunks * 100, 2),
+        'message': f'Chunk {chunk_number + 1} of {session.total_chunks} uploaded'
+    })
+
+def _chunk_params(post):
+    """(chunk_number, total_chunks, chunk_size, file_size) from a chunk's form fields; raises ValueError if not integers"""
+    try:
+        return (
+            int(post.get('chunk_number', 0)),
+            int(post.get('total_chunks', 1)),
+            int(post.get('chunk_size', DEFAULT_CHUNK_SIZE)),
+            int(post.get('file_size', 0)),
+        )
+    except (TypeError, ValueError):
+        raise ValueError('chunk_number, total_chunks, chunk_size and file_size must be integers')
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def chunked_upload(request):
-    """Handle chunked file uploads with progress tracking"""
+    """Handle chunked file uploads; chunks may arrive in any order and in parallel"""
     try:
         # Get upload parameters
         file_id = request.POST.get('file_id')
-        chunk_number = int(request.POST.get('chunk_number', 0))
-        total_chunks = int(request.POST.get('total_chunks', 1))
+        try:
+            chunk_number, total_chunks, chunk_size, file_size = _chunk_params(request.POST)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         filename = request.POST.get('filename')
-        file_size = int(request.POST.get('file_size', 0))
         file_type = request.POST.get('file_type', 'application/octet-stream')
         
         if 'chunk' not in request.FILES:
             return JsonResponse({'error': 'No chunk data provided'}, status=400)
         
-        chunk_data = request.FILES['chunk']
-        
-        # Create temporary directory for chunks
-        temp_dir = os.path.join(tempfile.gettempdir(), 'file_sharing_chunks', file_id)
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # Save chunk
-        chunk_path = os.path.join(temp_dir, f'chunk_{chunk_number}')
-        with open(chunk_path, 'wb') as f:
-            for chunk in chunk_data.chunks():
-                f.write(chunk)
+        try:
+            session = chunked.get_or_create_session(file_id, filename, file_size, file_type, chunk_size, total_chunks)
+            if session.status == UploadSession.STATUS_COMPLETE and session.file_upload:
+                return _chunked_upload_result(request, session.file_upload)
+            # Write the chunk at its offset straight into the partial destination file
+            session, completed = chunked.receive_chunk(session, chunk_number, request.FILES['chunk'])
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         
-        # Check if all chunks are uploaded
-        if chunk_number == total_chunks - 1:
-            # Combine all chunks
-            final_path = os.path.join(temp_dir, 'final_file')
-            with open(final_path, 'wb') as outfile:
-                for i in range(total_chunks):
-                    chunk_path = os.path.join(temp_dir, f'chunk_{i}')
-                    if os.path.exists(chunk_path):
-                        with open(chunk_path, 'rb') as infile:
-                            outfile.write(infile.read())
-                        os.remove(chunk_path)  # Clean up chunk
-            
-            # Create FileUpload object
-            with open(final_path, 'rb') as f:
-                file_upload = FileUpload(
-                    filename=filename,
-                    file_size=file_size,
-                    file_type=file_type
-                )
-                file_upload.file.save(filename, f, save=False)
-                file_upload.save()
-            
-            # Calculate hashes for file integrity
-            md5_hash, sha256_hash = file_upload.calculate_hashes()
-            if md5_hash and sha256_hash:
-                file_upload.md5_hash = md5_hash
-                file_upload.sha256_hash = sha256_hash
-                file_upload.save(update_fields=['md5_hash', 'sha256_hash'])
-            
-            # Clean up temporary directory
-            shutil.rmtree(temp_dir)
-            
-            return JsonResponse({
-                'success': True,
-                'file_id': str(file_upload.unique_id),
-                'filename': file_upload.filename,
-                'file_size': file_upload.file_size,
-                'download_url': request.build_absolute_uri(f'/download/{file_upload.unique_id}/'),
-                'md5_hash': md5_hash,
-                'sha256_hash': sha256_hash,
-                'message': 'File uploaded successfully with integrity verification!'
-            })
+        # The request that fills the bitmap moves the file into the blob store without copying it
+        if completed:
+            file_upload = chunked.complete_session(session)
+            progress.record(session, str(file_upload.unique_id))
+            return _chunked_upload_result(request, file_upload)
+        progress.record(session)
         
         # Return progress for incomplete upload
-        return JsonResponse({
-            'success': True,
-            'chunk_number': chunk_number,
-            'total_chunks': total_chunks,
-            'progress': round((chunk_number + 1) / total_chunks * 100, 2),
-            'message': f'Chunk {chunk_number + 1} of {total_chunks} uploaded'
-        })
+        return _chunk_progress_result(session, chunk_number)
         
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def upload_progress(request):
-    """Get upload progress for a specific file"""
+async def chunked_upload_async(request):
+    """chunked_upload for ASGI: session lookups use the async ORM, file work runs on the file I/O pool"""
     try:
-        file_id = request.POST.get('file_id')
-        temp_dir = os.path.join(tempfile.gettempdir(), 'file_sharing_chunks', file_id)
-        
-        if not os.path.exists(temp_dir):
-            return JsonResponse({'error': 'Upload session not found'}, status=404)
-        
-        # Count uploaded chunks
-        uploaded_chunks = len([f for f in os.listdir(temp_dir) if f.startswith('chunk_')])
+        post, files = await aio.run(_parse_upload, request)
+        file_id = post.get('file_id')
+        try:
+            chunk_number, total_chunks, chunk_size, file_size = _chunk_params(post)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        filename = post.get('filename')
+        file_type = post.get('file_type', 'application/octet-stream')
         
-        # Try to get total chunks from metadata file
-        metadata_file = os.path.join(temp_dir, 'metadata.json')
-        total_chunks = 1
-        if os.path.exists(metadata_file):
-            with open(metadata_file, 'r') as f:
-                metadata = json.load(f)
-                total_chunks = metadata.get('total_chunks', 1)
+        if 'chunk' not in files:
+            return JsonResponse({'error': 'No chunk data provided'}, status=400)
         
-        progress = round(uploaded_chunks / total_chunks * 100, 2) if total_chunks > 0 else 0
+        try:
+            session = await chunked.aget_or_create_session(file_id, filename, file_size, file_type, chunk_size, total_chunks)
+            if session.status == UploadSession.STATUS_COMPLETE and session.file_upload_id:
+                file_upload = await FileUpload.objects.aget(pk=session.file_upload_id)
+                return _chunked_upload_result(request, file_upload)
+            session, completed = await chunked.areceive_chunk(session, chunk_number, files['chunk'])
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         
-        return JsonResponse({
-            'uploaded_chunks': uploaded_chunks,
-            'total_chunks': total_chunks,
-            'progress': progress
-        })
+        if completed:
+            file_upload = await aio.run_db(chunked.complete_session, session)
+            await sync_to_async(progress.record)(session, str(file_upload.unique_id))
+            return _chunked_upload_result(request, file_upload)
+        await sync_to_async(progress.record)(session)
+        return _chunk_progress_result(session, chunk_number)
         
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@require_http_methods(["GET"])
+def upload_session_status(request, upload_id):
+    """Report which chunks of an upload have been received, so clients can resume"""
+    session = UploadSession.objects.filter(upload_id=upload_id).first()
+    if session is None:
+        return JsonResponse({'error': 'Upload session not found'}, status=404)
+    
+    data = {
+        'upload_id': session.upload_id,
+        'status': session.status,
+        'file_size': session.file_size,
+        'chunk_size': session.chunk_size,
+        'total_chunks': session.total_chunks,
+        'received': session.received_chunk_numbers(),
+    }
+    if session.file_upload:
+        data['file_id'] = str(session.file_upload.unique_id)
+    return JsonResponse(data)
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def upload_progress(request, upload_id=None):
+    """Get upload progress for a specific upload from the progress store"""
+    upload_id = upload_id or request.POST.get('file_id') or request.GET.get('file_id')
+    snapshot = progress.get(upload_id) if upload_id else None
+    if snapshot is None:
+        return JsonResponse({'error': 'Upload session not found'}, status=404)
+    
+    data = progress.public(snapshot)
+    # Field names used by earlier clients of this endpoint
+    data['uploaded_chunks'] = data['chunks_received']
+    return JsonResponse(data)
+
+@require_http_methods(["GET"])
+async def upload_progress_stream(request, upload_id):
+    """
+    Server-sent events long poll: answers with the next progress change, or a
+    keep-alive after PROGRESS_STREAM_TIMEOUT seconds, and ends. EventSource
+    reconnects by itself (sending the Last-Event-ID it saw), so no worker is held
+    for the length of an upload.
+    """
+    snapshot = await sync_to_async(progress.get)(upload_id)
+    if snapshot is None:
+        return JsonResponse({'error': 'Upload session not found'}, status=404)
+    
+    last_seen = request.headers.get('Last-Event-ID')
+    deadline = time.monotonic() + PROGRESS_STREAM_TIMEOUT
+    while repr(snapshot['updated_at']) == last_seen:
+        if snapshot['status'] == UploadSession.STATUS_COMPLETE:
+            # The client has the final event: 204 tells EventSource to stop reconnecting
+            return HttpResponse(status=204)
+        if time.monotonic() >= deadline:
+            break
+        await asyncio.sleep(PROGRESS_STREAM_INTERVAL)
+        snapshot = await sync_to_async(progress.get)(upload_id)
+        if snapshot is None:
+            return HttpResponse(status=204)
+    
+    body = f"retry: {PROGRESS_STREAM_RETRY_MS}\n"
+    if repr(snapshot['updated_at']) == last_seen:
+        body += ': keep-alive\n\n'
+    else:
+        body += f"id: {snapshot['updated_at']!r}\ndata: {json.dumps(progress.public(snapshot))}\n\n"
+    response = HttpResponse(body, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 def create_short_link(request):
     """View to create a custom short link"""
     if request.method == 'POST':
         form = ShortLinkForm(request.POST)
         if form.is_valid():
             short_link = form.save(commit=False)
+            linkhealth.attach_file(short_link, [request.get_host().split(':')[0]])
             short_link.save()
             return render(request, 'file_sharing/shortlink_success.html', {'short_link': short_link})
     else:
         form = ShortLinkForm()
     return render(request, 'file_sharing/create_shortlink.html', {'form': form, 'local_ip': get_local_ip()})
 
+def _resolve_route(code):
+    """Routing cache entry for a short code: target URL, availability and target file"""
+    short_link = ShortLink.objects.select_related('file_upload').filter(code=code).first()
+    if short_link is None:
+        return {'missing': True}
+    route = {
+        'target_url': short_link.target_url,
+        # Local downloads are checked in the database; external targets use the
+        # status stored by `manage.py check_links`, so no HTTP request is made here
+        'available': linkhealth.is_available(short_link),
+        'file_id': str(short_link.file_upload.unique_id) if short_link.file_upload_id else None,
+    }
+    if not short_link.file_upload_id:
+        route['file_id'] = linkhealth.local_file_id(short_link.target_url)
+        host, file_id = linkhealth.download_target(short_link.target_url)
+        if route['file_id'] is None and file_id:
+            # A download URL on a host outside ALLOWED_HOSTS is local only when requested
+            # through that host, so the entry carries both answers and stays host-independent
+            route.update(file_id=file_id, local_host=host, local_available=linkhealth.local_file_exists(file_id))
+    return route
+
 def resolve_short_link(request, code):
     """Redirect to the target URL for a given short code, or show a message if the file is deleted/missing or the target is unreachable."""
-    short_link = get_object_or_404(ShortLink, code=code)
-    parsed = urlparse(short_link.target_url)
-    # 1. If the target is a download link to a missing file
-    if parsed.path.startswith('/download/'):
-        match = re.match(r'/download/([\w-]+)/', parsed.path)
-        if match:
-            unique_id = match.group(1)
-            file_qs = FileUpload.objects.filter(unique_id=unique_id, is_active=True)
-            if not file_qs.exists():
-                return render(request, 'file_sharing/file_deleted.html', {'code': code})
-    # 2. If the target is unreachable (404 or connection error)
-    try:
-        # Build absolute URL if needed
-        if short_link.target_url.startswith('/'):
-            # Local path, build full URL
-            base_url = request.build_absolute_uri('/')[:-1]
-            check_url = base_url + short_link.target_url
-        else:
-            check_url = short_link.target_url
-        resp = requests.head(check_url, allow_redirects=True, timeout=3)
-        if resp.status_code == 404:
-            return render(request, 'file_sharing/file_deleted.html', {'code': code})
-    except Exception:
+    route = routecache.lookup(code, _resolve_route)
+    if route.get('missing'):
+        raise Http404("Short link not found")
+    available = route['available']
+    if route.get('local_host') and route['local_host'] == request.get_host().split(':')[0]:
+        available = route['local_available']
+    if not available:
         return render(request, 'file_sharing/file_deleted.html', {'code': code})
-    return redirect(short_link.target_url)
+    return redirect(route['target_url'])
+
+@staff_member_required
+def shortlink_cache_stats(request):
+    """Short-code routing cache hit/miss counters for this process"""
+    return JsonResponse(routecache.stats())
 
 def redirect_to_short_link(request, code):
     """Redirect /share/create/share/<code>/ to /share/<code>/ for mistyped or legacy links."""
@@ -54,6 +54,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'file_sharing.ingest.UploadBudgetMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -90,6 +91,21 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock up front so parallel chunk requests queue instead of failing
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    }
+}
+
+
+# Cache
+# Upload progress is kept here; use a shared backend (Redis/Memcached) with several workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
     }
 }
 
@@ -138,10 +154,81 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Storage: local (MEDIA_ROOT) | s3 (any S3-compatible object store, see file_sharing/s3.py)
+STORAGE_BACKEND = config('STORAGE_BACKEND', default='local')
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+if STORAGE_BACKEND == 's3':
+    STORAGES['default'] = {
+        'BACKEND': 'file_sharing.s3.S3Storage',
+        'OPTIONS': {
+            'endpoint_url': config('S3_ENDPOINT_URL'),
+            'bucket': config('S3_BUCKET'),
+            'access_key': config('S3_ACCESS_KEY'),
+            'secret_key': config('S3_SECRET_KEY'),
+            'region': config('S3_REGION', default='us-east-1'),
+            'presign_expires': config('S3_PRESIGN_EXPIRES', default=3600, cast=int),  # seconds
+        },
+    }
+# Local directory for uploads in progress before they enter the storage (default: MEDIA_ROOT)
+UPLOAD_STAGING_ROOT = config('UPLOAD_STAGING_ROOT', default='')
+
 # File upload settings
-FILE_UPLOAD_MAX_MEMORY_SIZE = 107374182400  # 100GB
-DATA_UPLOAD_MAX_MEMORY_SIZE = 107374182400  # 100GB
+# Hashing handlers compute MD5/SHA256 as bytes arrive, so uploads are never re-read
+FILE_UPLOAD_HANDLERS = [
+    'file_sharing.uploadhandlers.HashingMemoryFileUploadHandler',
+    'file_sharing.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+# Larger uploads are spooled into MEDIA_ROOT and renamed into place (see file_sharing/ingest.py)
+FILE_UPLOAD_MAX_MEMORY_SIZE = config('FILE_UPLOAD_MAX_MEMORY_SIZE', default=2621440, cast=int)  # 2.5MB per request
+DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB of non-file form data
 MAX_UPLOAD_SIZE = 107374182400  # 100GB
+# Per-process budgets (0 disables): uploads held in memory at once, and bodies being received at once
+UPLOAD_MEMORY_BUDGET = config('UPLOAD_MEMORY_BUDGET', default=67108864, cast=int)  # 64MB
+UPLOAD_INFLIGHT_BUDGET = config('UPLOAD_INFLIGHT_BUDGET', default=10737418240, cast=int)  # 10GB
+# Seconds an upload waits for in-flight budget before it is answered with 503
+UPLOAD_BACKPRESSURE_TIMEOUT = config('UPLOAD_BACKPRESSURE_TIMEOUT', default=10, cast=int)
+
+# Under an ASGI server, serve downloads and uploads from async views (see file_sharing/aio.py)
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+# Threads doing blocking file I/O for the async views
+FILE_IO_THREADS = config('FILE_IO_THREADS', default=32, cast=int)
+
+# File list search: auto | sqlite_fts | postgres_trgm | ngram | like (see file_sharing/search.py)
+SEARCH_BACKEND = config('SEARCH_BACKEND', default='auto')
+
+# Short-link health: `manage.py check_links` re-probes external targets this often (minutes)
+LINK_CHECK_INTERVAL_MINUTES = config('LINK_CHECK_INTERVAL_MINUTES', default=60, cast=int)
+# Consecutive failed probes before an external target is treated as broken
+LINK_CHECK_FAILURE_THRESHOLD = 2
+
+# Short-code routing cache: 'local' (per-process LRU) or a CACHES alias shared by all workers.
+# Changes invalidate the local cache of the worker that made them only: with several workers the
+# others can serve a deleted or deactivated link for up to SHORTLINK_LOCAL_CACHE_TTL seconds
+SHORTLINK_CACHE = config('SHORTLINK_CACHE', default='local')
+SHORTLINK_CACHE_SIZE = 10000
+SHORTLINK_LOCAL_CACHE_TTL = config('SHORTLINK_LOCAL_CACHE_TTL', default=5, cast=int)  # seconds
+SHORTLINK_CACHE_TTL = 300  # seconds, for a shared cache
+
+# Download backend: stream (through Django) | nginx (X-Accel-Redirect) | xsendfile (Apache/lighttpd)
+# | redirect (presigned object-store URL)
+DOWNLOAD_BACKEND = config('DOWNLOAD_BACKEND', default='stream')
+# nginx "internal" location that aliases MEDIA_ROOT, used by the nginx backend
+DOWNLOAD_ACCEL_REDIRECT_PREFIX = config('DOWNLOAD_ACCEL_REDIRECT_PREFIX', default='/protected-media/')
+
+# Downloads are counted in memory and written in batches this often (seconds); 0 writes each one
+DOWNLOAD_COUNT_FLUSH_INTERVAL = config('DOWNLOAD_COUNT_FLUSH_INTERVAL', default=5, cast=int)
+
+# Download integrity policy: always | stat | periodic | stream (see file_sharing/integrity.py)
+FILE_INTEGRITY_MODE = config('FILE_INTEGRITY_MODE', default='stat')
+# In periodic mode, `manage.py verify_store` re-checks files verified longer ago than this
+FILE_INTEGRITY_MAX_AGE_HOURS = config('FILE_INTEGRITY_MAX_AGE_HOURS', default=24, cast=int)
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field